@@ -77,6 +77,7 @@ WSGI_APPLICATION = 'core.wsgi.application'
 #     }
 # }
 
+# psycopg 3 connection pool per process
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.postgresql',
@@ -84,10 +85,27 @@ DATABASES = {
         'USER': env('DB_USER'),
         'PASSWORD': env('DB_PASS'),
         'HOST': env('DB_HOST'),
-        'PORT': env('DB_PORT')
+        'PORT': env('DB_PORT'),
+        # Validate pooled connections on checkout so restarts and
+        # failovers don't surface as request errors
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'pool': {
+                'min_size': env.int('DB_POOL_MIN_SIZE', default=2),
+                'max_size': env.int('DB_POOL_MAX_SIZE', default=10),
+                'timeout': env.float('DB_POOL_TIMEOUT', default=10.0),
+                'max_idle': 300,
+                'max_lifetime': 1800,
+            },
+        },
     }
 }
 
+# Transaction-mode PgBouncer (server-side pooling) can't hold cursors
+# across transactions
+if env.bool('DB_PGBOUNCER', default=False):
+    DATABASES['default']['DISABLE_SERVER_SIDE_CURSORS'] = True
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -0,0 +1,138 @@
+"""
+Closed-loop HTTP load generator (stdlib only).
+
+Keeps --concurrency keep-alive connections busy for --duration seconds
+and reports throughput, latency percentiles and status codes. Used to
+compare service throughput before and after a change, e.g.:
+
+    # email service, 202 path
+    python benchmarks/http_load.py http://localhost:8003/email/send \\
+        -X POST -H "X-API-Key: $KEY" \\
+        -d '{"to_email": "a@example.com", "subject": "hi", "body_text": "x",
+             "service_name": "auth-service"}'
+
+    # notification inbox
+    python benchmarks/http_load.py http://localhost:8004/notifications/ \\
+        -H "Authorization: Bearer $TOKEN"
+
+Run it against the old and new build with the same flags; add --json to
+get a machine-readable summary.
+"""
+import argparse
+import http.client
+import json
+import threading
+import time
+from collections import Counter
+from urllib.parse import urlsplit
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(pct / 100 * len(values)))]
+
+
+class Worker(threading.Thread):
+    def __init__(self, url, method, headers, body, deadline):
+        super().__init__(daemon=True)
+        self.url = urlsplit(url)
+        self.method = method
+        self.headers = headers
+        self.body = body
+        self.deadline = deadline
+        self.latencies = []
+        self.statuses = Counter()
+        self.errors = Counter()
+
+    def _connect(self):
+        conn_class = (
+            http.client.HTTPSConnection if self.url.scheme == 'https'
+            else http.client.HTTPConnection
+        )
+        return conn_class(self.url.netloc, timeout=30)
+
+    def run(self):
+        path = self.url.path or '/'
+        if self.url.query:
+            path += '?' + self.url.query
+        conn = self._connect()
+        while time.perf_counter() < self.deadline:
+            started = time.perf_counter()
+            try:
+                conn.request(self.method, path, body=self.body, headers=self.headers)
+                response = conn.getresponse()
+                response.read()
+            except (OSError, http.client.HTTPException) as e:
+                self.errors[type(e).__name__] += 1
+                conn.close()
+                conn = self._connect()
+                continue
+            self.latencies.append(time.perf_counter() - started)
+            self.statuses[response.status] += 1
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Closed-loop HTTP load generator')
+    parser.add_argument('url')
+    parser.add_argument('-X', '--method', default='GET')
+    parser.add_argument('-H', '--header', action='append', default=[])
+    parser.add_argument('-d', '--data', help='request body (JSON)')
+    parser.add_argument('-c', '--concurrency', type=int, default=16)
+    parser.add_argument('-t', '--duration', type=float, default=15.0)
+    parser.add_argument('--json', action='store_true', help='print a JSON summary')
+    args = parser.parse_args()
+
+    headers = {'Connection': 'keep-alive'}
+    if args.data:
+        headers['Content-Type'] = 'application/json'
+    for header in args.header:
+        name, _, value = header.partition(':')
+        headers[name.strip()] = value.strip()
+    body = args.data.encode() if args.data else None
+
+    deadline = time.perf_counter() + args.duration
+    workers = [
+        Worker(args.url, args.method.upper(), headers, body, deadline)
+        for _ in range(args.concurrency)
+    ]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(l for w in workers for l in w.latencies)
+    statuses = sum((w.statuses for w in workers), Counter())
+    errors = sum((w.errors for w in workers), Counter())
+    summary = {
+        'url': args.url,
+        'concurrency': args.concurrency,
+        'requests': len(latencies),
+        'requests_per_sec': round(len(latencies) / elapsed, 1),
+        'latency_ms': {
+            'p50': round(percentile(latencies, 50) * 1000, 2),
+            'p95': round(percentile(latencies, 95) * 1000, 2),
+            'p99': round(percentile(latencies, 99) * 1000, 2),
+        },
+        'statuses': {str(k): v for k, v in sorted(statuses.items())},
+        'errors': dict(errors),
+    }
+
+    if args.json:
+        print(json.dumps(summary, indent=2))
+        return
+    print(f"{summary['requests']} requests in {elapsed:.1f}s "
+          f"({args.concurrency} connections)")
+    print(f"  throughput: {summary['requests_per_sec']} req/s")
+    print("  latency:    p50 {p50} ms, p95 {p95} ms, p99 {p99} ms".format(
+        **summary['latency_ms']))
+    print(f"  statuses:   {summary['statuses']}")
+    if errors:
+        print(f"  errors:     {summary['errors']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""
+Concurrency capacity of one email service process, WSGI vs ASGI.
+
+Runs benchmarks/http_load.py (repo root) against POST /email/send at
+increasing connection counts and prints throughput and p99 per level.
+Start a single process of each flavour and point the script at it:
+
+    gunicorn core.wsgi:application -w 1 --threads 8 -b :8003
+    uvicorn core.asgi:application --workers 1 --port 8013
+
+    python -m benchmarks.concurrency http://localhost:8003 --key $KEY
+    python -m benchmarks.concurrency http://localhost:8013 --key $KEY
+
+Use --sync to exercise send_async=false (provider call in the request),
+which is where the WSGI worker runs out of threads first.
+"""
+import argparse
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+HTTP_LOAD = Path(__file__).resolve().parents[2] / 'benchmarks' / 'http_load.py'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Email ingress concurrency sweep')
+    parser.add_argument('base_url')
+    parser.add_argument('--key', required=True, help='X-API-Key of --service')
+    parser.add_argument('--service', default='auth-service')
+    parser.add_argument('--levels', default='1,8,32,128,256')
+    parser.add_argument('--duration', type=float, default=15.0)
+    parser.add_argument('--sync', action='store_true', help='send_async=false')
+    args = parser.parse_args()
+
+    body = json.dumps({
+        'to_email': 'loadtest@example.com',
+        'subject': 'load test',
+        'body_text': 'load test',
+        'service_name': args.service,
+        'send_async': not args.sync,
+    })
+
+    print(f"{'connections':>11} {'req/s':>10} {'p50 ms':>9} {'p99 ms':>9} {'non-2xx':>8}")
+    for level in [int(level) for level in args.levels.split(',')]:
+        output = subprocess.run(
+            [
+                sys.executable, str(HTTP_LOAD), args.base_url.rstrip('/') + '/email/send',
+                '-X', 'POST', '-H', f'X-API-Key: {args.key}', '-d', body,
+                '-c', str(level), '-t', str(args.duration), '--json',
+            ],
+            check=True, capture_output=True, text=True,
+        ).stdout
+        summary = json.loads(output)
+        failed = sum(
+            count for code, count in summary['statuses'].items()
+            if not code.startswith('2')
+        ) + sum(summary['errors'].values())
+        print(f"{level:>11} {summary['requests_per_sec']:>10} "
+              f"{summary['latency_ms']['p50']:>9} {summary['latency_ms']['p99']:>9} "
+              f"{failed:>8}")
+
+
+if __name__ == '__main__':
+    main()
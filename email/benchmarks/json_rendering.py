@@ -0,0 +1,103 @@
+"""
+Serialization + rendering throughput for one 50-row EmailHistoryView page.
+
+Compares the stock DRF path (EmailLogSerializer + JSONRenderer) with the
+fast path (``.values()`` rows + ORJSONRenderer). Rows are built in memory
+so the numbers isolate the CPU cost that sits on top of the DB query.
+
+Usage (from the email/ directory):
+    python -m benchmarks.json_rendering [--rows 50] [--seconds 3]
+"""
+import argparse
+import os
+import time
+import uuid
+from datetime import timedelta
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+django.setup()
+
+from django.utils import timezone  # noqa: E402
+from rest_framework.renderers import JSONRenderer  # noqa: E402
+
+from core.renderers import ORJSONRenderer  # noqa: E402
+from core.serializers import values_fields  # noqa: E402
+from email_service.models import EmailLog, EmailStatus  # noqa: E402
+from email_service.serializers import EmailLogSerializer  # noqa: E402
+
+
+def build_rows(count):
+    now = timezone.now()
+    logs = []
+    for i in range(count):
+        logs.append(EmailLog(
+            id=uuid.uuid4(),
+            to_email=f'user{i}@example.com',
+            to_name=f'User {i}',
+            cc=['cc@example.com'],
+            bcc=None,
+            subject=f'Welcome to the platform #{i}',
+            body_html='<html><body>' + '<p>Hello there, welcome aboard.</p>' * 20 + '</body></html>',
+            body_text='Hello there, welcome aboard. ' * 20,
+            template_name='welcome',
+            template_data={'user_name': f'User {i}', 'platform_name': 'MyApp'},
+            service_name='auth-service',
+            user_id=str(uuid.uuid4()),
+            provider='smtp',
+            provider_message_id=f'smtp-{i}',
+            status=EmailStatus.SENT,
+            created_at=now - timedelta(minutes=i),
+            updated_at=now,
+            sent_at=now,
+            retry_count=0,
+        ))
+    fields = values_fields(EmailLogSerializer)
+    values = [{name: getattr(log, name) for name in fields} for log in logs]
+    return logs, values
+
+
+def measure(label, func, seconds):
+    func()  # warm up
+    calls = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < seconds:
+        func()
+        calls += 1
+    elapsed = time.perf_counter() - started
+    print(f'{label:<40} {calls / elapsed:>10.0f} pages/sec  '
+          f'{elapsed / calls * 1e6:>8.0f} us/page')
+    return calls / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rows', type=int, default=50)
+    parser.add_argument('--seconds', type=float, default=3.0)
+    args = parser.parse_args()
+
+    logs, values = build_rows(args.rows)
+    drf_renderer = JSONRenderer()
+    fast_renderer = ORJSONRenderer()
+
+    def drf_path():
+        data = EmailLogSerializer(logs, many=True).data
+        return drf_renderer.render({"success": True, "data": data})
+
+    def orjson_only():
+        data = EmailLogSerializer(logs, many=True).data
+        return fast_renderer.render({"success": True, "data": data})
+
+    def fast_path():
+        return fast_renderer.render({"success": True, "data": values})
+
+    print(f'{args.rows}-row page, {args.seconds:.0f}s per case')
+    baseline = measure('ModelSerializer + JSONRenderer', drf_path, args.seconds)
+    measure('ModelSerializer + ORJSONRenderer', orjson_only, args.seconds)
+    fast = measure('.values() rows + ORJSONRenderer', fast_path, args.seconds)
+    print(f'speedup: {fast / baseline:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,381 @@
+"""
+End-to-end benchmark of the email pipeline without real inboxes.
+
+Starts the provider fakes from ``benchmarks.sinks``, optionally starts the
+service itself (uvicorn + a Celery worker, pointed at the fakes), then
+sends ``--rate`` emails/sec for ``--duration`` seconds either through
+``POST /email/send`` (``--mode api``) or straight onto the queue
+(``--mode worker``). Postgres and Redis are the local ones from core/.env.
+
+Reported per run:
+- emails/sec delivered to the fake provider
+- p50/p95/p99 latency from submit to provider receipt
+- DB statements per email (pg_stat_statements, or committed transactions
+  from pg_stat_database when the extension is missing)
+- broker bytes per email (Redis INFO net in/out)
+
+Results are written to benchmarks/results/<timestamp>-<git sha>.json;
+compare two runs with ``--compare OLD NEW``.
+
+    python -m benchmarks.pipeline --start --provider sendgrid \\
+        --latency-ms 80 --error-rate 0.01 --rate 200 --duration 30
+"""
+import argparse
+import http.client
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+
+import redis
+
+from .sinks import Arrivals, FakeProviderServer, SMTPSink
+
+EMAIL_DIR = Path(__file__).resolve().parents[1]
+RESULTS_DIR = Path(__file__).resolve().parent / 'results'
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Email pipeline benchmark')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'),
+                        help='compare two result files and exit')
+    parser.add_argument('--provider', choices=['smtp', 'sendgrid', 'ses'], default='smtp')
+    parser.add_argument('--mode', choices=['api', 'worker'], default='api')
+    parser.add_argument('--rate', type=float, default=50.0, help='emails/sec offered')
+    parser.add_argument('--duration', type=float, default=30.0)
+    parser.add_argument('--drain', type=float, default=60.0,
+                        help='max seconds to wait for stragglers')
+    parser.add_argument('--concurrency', type=int, default=32,
+                        help='parallel submitters')
+    parser.add_argument('--latency-ms', type=float, default=0.0,
+                        help='fake provider latency')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='fake provider error rate')
+    parser.add_argument('--start', action='store_true',
+                        help='start uvicorn and a Celery worker for the run')
+    parser.add_argument('--workers', type=int, default=4, help='Celery concurrency')
+    parser.add_argument('--base-url', default='http://127.0.0.1:8013')
+    parser.add_argument('--service', default='bench-service')
+    parser.add_argument('--api-key', default='bench-key')
+    parser.add_argument('--smtp-port', type=int, default=8025)
+    parser.add_argument('--http-port', type=int, default=8090)
+    parser.add_argument('--label', default='', help='free-form note stored with the result')
+    return parser.parse_args()
+
+
+def service_env(args):
+    """Environment pointing the service at the local fakes"""
+    fake_http = f'http://127.0.0.1:{args.http_port}'
+    return {
+        'EMAIL_PROVIDER': args.provider,
+        'SMTP_HOST': '127.0.0.1',
+        'SMTP_PORT': str(args.smtp_port),
+        'SENDGRID_API_KEY': 'bench',
+        'SENDGRID_API_HOST': fake_http,
+        'AWS_ACCESS_KEY_ID': 'bench',
+        'AWS_SECRET_ACCESS_KEY': 'bench',
+        'AWS_SES_ENDPOINT_URL': fake_http,
+        'INTERNAL_API_KEYS': f'{args.service}={args.api_key}',
+        'ALLOWED_SERVICES': args.service,
+        'SERVICE_RATE_LIMITS': f'{args.service}=1000000000',
+    }
+
+
+def start_service(args, env):
+    port = args.base_url.rsplit(':', 1)[-1].strip('/')
+    web = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'core.asgi:application',
+         '--port', port, '--log-level', 'warning'],
+        cwd=EMAIL_DIR, env=env,
+    )
+    worker = subprocess.Popen(
+        [sys.executable, '-m', 'celery', '-A', 'core', 'worker',
+         '-c', str(args.workers), '--loglevel', 'warning'],
+        cwd=EMAIL_DIR, env=env,
+    )
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection(args.base_url.split('//', 1)[-1], timeout=1)
+            conn.request('GET', '/email/health')
+            if conn.getresponse().status == 200:
+                break
+        except OSError:
+            pass
+        time.sleep(0.5)
+    else:
+        raise RuntimeError('email service did not come up')
+    time.sleep(2)  # let the worker connect to the broker
+    return [web, worker]
+
+
+class Counters:
+    """Before/after readings of Postgres and broker counters"""
+
+    def __init__(self, broker_url):
+        from django.db import connection
+
+        self.connection = connection
+        self.broker = redis.Redis.from_url(broker_url)
+        self.db_source = None
+
+    def _db_statements(self):
+        with self.connection.cursor() as cursor:
+            if self.db_source in (None, 'pg_stat_statements'):
+                try:
+                    cursor.execute(
+                        "SELECT sum(calls) FROM pg_stat_statements s "
+                        "JOIN pg_database d ON d.oid = s.dbid "
+                        "WHERE d.datname = current_database()"
+                    )
+                    self.db_source = 'pg_stat_statements'
+                    return int(cursor.fetchone()[0] or 0)
+                except Exception:
+                    self.connection.rollback()
+                    self.db_source = 'pg_stat_database.xact_commit'
+            cursor.execute(
+                "SELECT xact_commit FROM pg_stat_database "
+                "WHERE datname = current_database()"
+            )
+            return int(cursor.fetchone()[0])
+
+    def read(self):
+        stats = self.broker.info('stats')
+        return {
+            'db_statements': self._db_statements(),
+            'broker_in': stats['total_net_input_bytes'],
+            'broker_out': stats['total_net_output_bytes'],
+        }
+
+
+class Driver:
+    """Offers emails at a fixed rate and records submit times"""
+
+    def __init__(self, args, run_id):
+        self.args = args
+        self.run_id = run_id
+        self.submitted = {}
+        self.failed_submits = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def payload(self, subject):
+        return {
+            'to_email': 'bench@example.com',
+            'subject': subject,
+            'body_html': '<html><body><p>benchmark</p></body></html>',
+            'body_text': 'benchmark',
+            'service_name': self.args.service,
+        }
+
+    def _submit_api(self, body):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = http.client.HTTPConnection(
+                self.args.base_url.split('//', 1)[-1], timeout=30
+            )
+        conn.request('POST', '/email/send', body=json.dumps(body), headers={
+            'Content-Type': 'application/json',
+            'X-API-Key': self.args.api_key,
+        })
+        response = conn.getresponse()
+        response.read()
+        return response.status < 300
+
+    def _submit_worker(self, body):
+        from email_service.tasks import send_email_task
+
+        send_email_task.delay(**body)
+        return True
+
+    def submit(self, index):
+        subject = f'bench-{self.run_id}-{index}'
+        submit = self._submit_api if self.args.mode == 'api' else self._submit_worker
+        started = time.time()
+        try:
+            ok = submit(self.payload(subject))
+        except Exception:
+            self._local.conn = None
+            ok = False
+        with self._lock:
+            if ok:
+                self.submitted[subject] = started
+            else:
+                self.failed_submits += 1
+
+    def run(self):
+        total = int(self.args.rate * self.args.duration)
+        interval = 1.0 / self.args.rate
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.args.concurrency) as pool:
+            for index in range(total):
+                delay = started + index * interval - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                pool.submit(self.submit, index)
+        return total
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(pct / 100 * len(values)))]
+
+
+def git_sha():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=EMAIL_DIR,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def run(args):
+    overrides = service_env(args)
+    os.environ.update(overrides)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+    sys.path.insert(0, str(EMAIL_DIR))
+    import django
+
+    django.setup()
+    from django.conf import settings
+
+    arrivals = Arrivals()
+    sinks = [
+        SMTPSink(arrivals, port=args.smtp_port),
+        FakeProviderServer(arrivals, port=args.http_port,
+                           latency_ms=args.latency_ms, error_rate=args.error_rate),
+    ]
+    for sink in sinks:
+        sink.start()
+
+    processes = []
+    try:
+        if args.start:
+            processes = start_service(args, {**os.environ, **overrides})
+
+        counters = Counters(settings.CELERY_BROKER_URL)
+        before = counters.read()
+
+        run_id = uuid.uuid4().hex[:8]
+        driver = Driver(args, run_id)
+        offered = driver.run()
+
+        deadline = time.time() + args.drain
+        while time.time() < deadline:
+            delivered = sum(1 for s in driver.submitted if s in arrivals.times)
+            if delivered >= len(driver.submitted):
+                break
+            time.sleep(0.5)
+        time.sleep(1)  # Postgres flushes activity stats about once a second
+        after = counters.read()
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait(timeout=30)
+        for sink in sinks:
+            sink.stop()
+
+    latencies = sorted(
+        arrivals.times[subject] - submitted
+        for subject, submitted in driver.submitted.items()
+        if subject in arrivals.times
+    )
+    delivered = len(latencies)
+    window = None
+    if delivered:
+        first = min(driver.submitted.values())
+        last = max(arrivals.times[s] for s in driver.submitted if s in arrivals.times)
+        window = last - first
+
+    def per_email(key):
+        return round((after[key] - before[key]) / delivered, 2) if delivered else None
+
+    return {
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'git_sha': git_sha(),
+        'label': args.label,
+        'config': {
+            key: getattr(args, key) for key in (
+                'provider', 'mode', 'rate', 'duration', 'concurrency',
+                'latency_ms', 'error_rate', 'workers',
+            )
+        },
+        'offered': offered,
+        'submitted': len(driver.submitted),
+        'submit_failures': driver.failed_submits,
+        'delivered': delivered,
+        'provider_rejections': arrivals.rejected,
+        'emails_per_sec': round(delivered / window, 2) if window else None,
+        'latency_ms': {
+            name: round(value * 1000, 1) if value is not None else None
+            for name, value in (
+                ('p50', percentile(latencies, 50)),
+                ('p95', percentile(latencies, 95)),
+                ('p99', percentile(latencies, 99)),
+            )
+        },
+        'db_statements_per_email': per_email('db_statements'),
+        'db_statements_source': counters.db_source,
+        'broker_bytes_in_per_email': per_email('broker_in'),
+        'broker_bytes_out_per_email': per_email('broker_out'),
+    }
+
+
+def save(result):
+    RESULTS_DIR.mkdir(exist_ok=True)
+    stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S')
+    path = RESULTS_DIR / f"{stamp}-{result['git_sha']}.json"
+    path.write_text(json.dumps(result, indent=2))
+    return path
+
+
+def _flatten(result):
+    flat = {
+        'emails_per_sec': result['emails_per_sec'],
+        'db_statements_per_email': result['db_statements_per_email'],
+        'broker_bytes_in_per_email': result['broker_bytes_in_per_email'],
+        'broker_bytes_out_per_email': result['broker_bytes_out_per_email'],
+    }
+    for name, value in result['latency_ms'].items():
+        flat[f'latency_{name}_ms'] = value
+    return flat
+
+
+def compare(old_path, new_path):
+    old = json.loads(Path(old_path).read_text())
+    new = json.loads(Path(new_path).read_text())
+    if old['config'] != new['config']:
+        print('warning: runs used different configs')
+    print(f"{'metric':<28} {old['git_sha']:>12} {new['git_sha']:>12} {'change':>9}")
+    old_flat, new_flat = _flatten(old), _flatten(new)
+    for metric, old_value in old_flat.items():
+        new_value = new_flat[metric]
+        change = ''
+        if old_value and new_value is not None:
+            change = f'{(new_value - old_value) / old_value:+.1%}'
+        print(f'{metric:<28} {str(old_value):>12} {str(new_value):>12} {change:>9}')
+
+
+def main():
+    args = parse_args()
+    if args.compare:
+        compare(*args.compare)
+        return
+    result = run(args)
+    path = save(result)
+    print(json.dumps(result, indent=2))
+    print(f'saved to {path}')
+
+
+if __name__ == '__main__':
+    main()
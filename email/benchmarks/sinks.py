@@ -0,0 +1,162 @@
+"""
+Local stand-ins for the email providers.
+
+- SMTPSink: an aiosmtpd server that accepts and discards messages
+- FakeProviderServer: HTTP endpoints shaped like SendGrid's
+  ``POST /v3/mail/send`` and SES's ``SendEmail`` query API
+
+Both record when each message arrived, keyed by subject, and the HTTP
+fakes can inject latency and errors. Run standalone with:
+
+    python -m benchmarks.sinks --smtp-port 8025 --http-port 8090 \\
+        --latency-ms 50 --error-rate 0.01
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from email import message_from_bytes
+from email.header import decode_header, make_header
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+
+class Arrivals:
+    """Thread-safe record of received messages by subject"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.times = {}
+        self.rejected = 0
+
+    def record(self, subject):
+        with self._lock:
+            self.times.setdefault(subject, time.time())
+
+    def reject(self):
+        with self._lock:
+            self.rejected += 1
+
+    def count(self):
+        with self._lock:
+            return len(self.times)
+
+
+class SMTPSink:
+    """aiosmtpd server that only records arrivals"""
+
+    def __init__(self, arrivals, host='127.0.0.1', port=8025):
+        from aiosmtpd.controller import Controller
+
+        self.arrivals = arrivals
+        self.controller = Controller(self, hostname=host, port=port)
+
+    async def handle_DATA(self, server, session, envelope):
+        message = message_from_bytes(envelope.content)
+        self.arrivals.record(str(make_header(decode_header(message['Subject'] or ''))))
+        return '250 OK'
+
+    def start(self):
+        self.controller.start()
+
+    def stop(self):
+        self.controller.stop()
+
+
+class FakeProviderServer:
+    """SendGrid- and SES-shaped HTTP endpoints with injected latency/errors"""
+
+    def __init__(self, arrivals, host='127.0.0.1', port=8090,
+                 latency_ms=0.0, error_rate=0.0):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                server.handle(self, body)
+
+        self.arrivals = arrivals
+        self.latency = latency_ms / 1000
+        self.error_rate = error_rate
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def handle(self, request, body):
+        if self.latency:
+            time.sleep(self.latency)
+        if random.random() < self.error_rate:
+            self.arrivals.reject()
+            self._reply(request, 503, b'{"errors": [{"message": "injected"}]}',
+                        'application/json')
+            return
+
+        message_id = uuid.uuid4().hex
+        if request.path.startswith('/v3/mail/send'):
+            payload = json.loads(body)
+            self.arrivals.record(payload.get('subject') or '')
+            self._reply(request, 202, b'', 'application/json',
+                        {'X-Message-Id': message_id})
+        else:
+            params = parse_qs(body.decode())
+            self.arrivals.record(params.get('Message.Subject.Data', [''])[0])
+            xml = (
+                '<SendEmailResponse xmlns="http://ses.amazonaws.com/doc/2010-12-01/">'
+                f'<SendEmailResult><MessageId>{message_id}</MessageId></SendEmailResult>'
+                f'<ResponseMetadata><RequestId>{message_id}</RequestId></ResponseMetadata>'
+                '</SendEmailResponse>'
+            ).encode()
+            self._reply(request, 200, xml, 'text/xml')
+
+    @staticmethod
+    def _reply(request, status, body, content_type, headers=None):
+        request.send_response(status)
+        request.send_header('Content-Type', content_type)
+        request.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            request.send_header(name, value)
+        request.end_headers()
+        request.wfile.write(body)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.httpd.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the fake email providers')
+    parser.add_argument('--smtp-port', type=int, default=8025)
+    parser.add_argument('--http-port', type=int, default=8090)
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    args = parser.parse_args()
+
+    arrivals = Arrivals()
+    smtp = SMTPSink(arrivals, port=args.smtp_port)
+    http = FakeProviderServer(arrivals, port=args.http_port,
+                              latency_ms=args.latency_ms, error_rate=args.error_rate)
+    smtp.start()
+    http.start()
+    print(f'SMTP sink on :{args.smtp_port}, SendGrid/SES fakes on :{args.http_port}')
+    try:
+        while True:
+            time.sleep(5)
+            print(f'received {arrivals.count()}, rejected {arrivals.rejected}')
+    except KeyboardInterrupt:
+        pass
+    finally:
+        smtp.stop()
+        http.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -13,4 +13,9 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Open/click tracking hits are answered before Django's request cycle
+from email_service.tracking import TrackingApp  # noqa: E402
+
+application = TrackingApp(django_application)
@@ -0,0 +1,24 @@
+import orjson
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+
+class ORJSONRenderer(BaseRenderer):
+    """
+    Drop-in replacement for DRF's JSONRenderer backed by orjson.
+
+    orjson natively handles datetimes (rendered as ISO 8601 with a 'Z'
+    suffix for UTC, like DRF), UUIDs, dataclasses and dicts built from
+    ``QuerySet.values()``. Anything else falls back to DRF's encoder.
+    """
+    media_type = 'application/json'
+    format = 'json'
+    charset = None
+    options = orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS
+
+    _fallback = JSONEncoder().default
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return orjson.dumps(data, default=self._fallback, option=self.options)
@@ -2,8 +2,10 @@
 # core/settings.py (UPDATED)
 # ============================================
 from pathlib import Path
+import copy
 import environ
 import os
+import sys
 
 env = environ.Env()
 environ.Env.read_env()
@@ -65,8 +67,28 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'core.wsgi.application'
+# Preferred entry point: uvicorn core.asgi:application (async send/status views)
+ASGI_APPLICATION = 'core.asgi.application'
 
 # Database
+# Web and Celery worker processes each keep a psycopg 3 connection pool,
+# so requests and tasks no longer pay for a new Postgres connection. Beat
+# runs a handful of queries and keeps one persistent connection instead.
+# PROCESS_TYPE is detected from the command line and can be overridden.
+def _detect_process_type():
+    if 'celery' in os.path.basename(sys.argv[0]) or 'celery' in sys.argv[:2]:
+        return 'beat' if 'beat' in sys.argv else 'worker'
+    return 'web'
+
+
+PROCESS_TYPE = env('PROCESS_TYPE', default=_detect_process_type())
+
+# Per-process defaults; a prefork worker child runs one task at a time
+DB_POOL_DEFAULTS = {
+    'web': {'min_size': 2, 'max_size': 10},
+    'worker': {'min_size': 1, 'max_size': 2},
+}
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.postgresql',
@@ -74,10 +96,80 @@ DATABASES = {
         'USER': env('DB_USER'),
         'PASSWORD': env('DB_PASS'),
         'HOST': env('DB_HOST'),
-        'PORT': env('DB_PORT')
+        'PORT': env('DB_PORT'),
+        # Validate connections (pooled ones on checkout) so restarts and
+        # failovers don't surface as request errors
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {},
     }
 }
 
+if PROCESS_TYPE == 'beat':
+    DATABASES['default']['CONN_MAX_AGE'] = env.int('DB_CONN_MAX_AGE', default=300)
+else:
+    DATABASES['default']['OPTIONS']['pool'] = {
+        'min_size': env.int('DB_POOL_MIN_SIZE', default=DB_POOL_DEFAULTS[PROCESS_TYPE]['min_size']),
+        'max_size': env.int('DB_POOL_MAX_SIZE', default=DB_POOL_DEFAULTS[PROCESS_TYPE]['max_size']),
+        'timeout': env.float('DB_POOL_TIMEOUT', default=10.0),
+        'max_idle': 300,
+        'max_lifetime': 1800,
+    }
+
+# Threads available to send_async=false requests under ASGI. Each
+# in-flight send holds a pooled connection from its EmailLog insert to
+# the status update after the provider call, so threads beyond the pool
+# size would only queue on the pool.
+SYNC_SEND_CONCURRENCY = env.int(
+    'SYNC_SEND_CONCURRENCY',
+    default=DATABASES['default']['OPTIONS'].get('pool', {}).get('max_size', 10)
+)
+
+# Transaction-mode PgBouncer (server-side pooling) can't hold cursors
+# across transactions
+if env.bool('DB_PGBOUNCER', default=False):
+    DATABASES['default']['DISABLE_SERVER_SIDE_CURSORS'] = True
+
+# EmailLog sharding: extra databases holding email_logs rows,
+# "shard1=postgres://...,shard2=postgres://...". Each shard inherits
+# the default connection/pool settings.
+EMAIL_LOG_SHARD_URLS = env.dict('EMAIL_LOG_SHARD_URLS', default={})
+for _alias, _url in EMAIL_LOG_SHARD_URLS.items():
+    DATABASES[_alias] = {
+        **copy.deepcopy(DATABASES['default']),
+        **env.db_url_config(_url),
+    }
+
+# Aliases that hold email_logs, in routing order (user_id hashes index
+# into this list, so only append to it)
+EMAIL_LOG_SHARDS = env.list(
+    'EMAIL_LOG_SHARDS', default=['default', *EMAIL_LOG_SHARD_URLS]
+)
+# 'service_name' (routed by EMAIL_LOG_SHARD_ROUTES) or 'user_id' (hashed)
+EMAIL_LOG_SHARD_KEY = env('EMAIL_LOG_SHARD_KEY', default='service_name')
+# service_name -> alias, "project-service=shard1"; others use the first shard
+EMAIL_LOG_SHARD_ROUTES = env.dict('EMAIL_LOG_SHARD_ROUTES', default={})
+
+# Streaming replicas of the default database, "replica1=postgres://..."
+# Read endpoints use them; workers and all writes stay on the primary.
+DB_REPLICA_URLS = env.dict('DB_REPLICA_URLS', default={})
+for _alias, _url in DB_REPLICA_URLS.items():
+    DATABASES[_alias] = {
+        **copy.deepcopy(DATABASES['default']),
+        **env.db_url_config(_url),
+        'TEST': {'MIRROR': 'default'},
+    }
+DB_REPLICAS = list(DB_REPLICA_URLS)
+# Replicas further behind than this are skipped until they catch up
+DB_REPLICA_MAX_LAG_SECONDS = env.float('DB_REPLICA_MAX_LAG_SECONDS', default=5.0)
+DB_REPLICA_LAG_CHECK_SECONDS = env.float('DB_REPLICA_LAG_CHECK_SECONDS', default=2.0)
+# A caller's reads stay on the primary this long after its own writes
+READ_YOUR_WRITES_SECONDS = env.int('READ_YOUR_WRITES_SECONDS', default=10)
+
+DATABASE_ROUTERS = [
+    'email_service.routers.ReplicaRouter',
+    'email_service.routers.EmailLogShardRouter',
+]
+
 # REST Framework - No Authentication
 REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
@@ -87,7 +179,12 @@ REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 50,
     'DEFAULT_RENDERER_CLASSES': [
-        'rest_framework.renderers.JSONRenderer',
+        'core.renderers.ORJSONRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'core.parsers.ORJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
     ],
     'UNAUTHENTICATED_USER': None,  # Don't use Django auth user
     'UNAUTHENTICATED_TOKEN': None,  # Don't use tokens
@@ -124,6 +221,7 @@ if EMAIL_PROVIDER == 'smtp':
 # SendGrid Configuration
 elif EMAIL_PROVIDER == 'sendgrid':
     SENDGRID_API_KEY = env('SENDGRID_API_KEY')
+    SENDGRID_API_HOST = env('SENDGRID_API_HOST', default='https://api.sendgrid.com')
     if not SENDGRID_API_KEY:
         raise ValueError("SENDGRID_API_KEY must be set when using SendGrid provider")
 
@@ -132,6 +230,8 @@ elif EMAIL_PROVIDER == 'ses':
     AWS_ACCESS_KEY_ID = env('AWS_ACCESS_KEY_ID')
     AWS_SECRET_ACCESS_KEY = env('AWS_SECRET_ACCESS_KEY')
     AWS_SES_REGION = env('AWS_SES_REGION', default='us-east-1')
+    # Override to point at a local endpoint (benchmarks)
+    AWS_SES_ENDPOINT_URL = env('AWS_SES_ENDPOINT_URL', default=None)
     
     if not AWS_ACCESS_KEY_ID or not AWS_SECRET_ACCESS_KEY:
         raise ValueError("AWS credentials must be set when using SES provider")
@@ -139,6 +239,37 @@ elif EMAIL_PROVIDER == 'ses':
 else:
     raise ValueError(f"Invalid EMAIL_PROVIDER: {EMAIL_PROVIDER}. Must be 'smtp', 'sendgrid', or 'ses'")
 
+# ============================================
+# ATTACHMENTS
+# ============================================
+# Each upload gets its own id, owned by the uploading service; the blob
+# behind it is stored once per sha256. Sends/tasks only carry the ids.
+# Point ATTACHMENT_STORAGE_BACKEND at an object store backend
+# (e.g. storages.backends.s3.S3Storage) with ATTACHMENT_STORAGE_OPTIONS.
+ATTACHMENT_STORAGE_BACKEND = env(
+    'ATTACHMENT_STORAGE_BACKEND',
+    default='django.core.files.storage.FileSystemStorage'
+)
+ATTACHMENT_STORAGE_OPTIONS = env.json(
+    'ATTACHMENT_STORAGE_OPTIONS',
+    default={'location': str(BASE_DIR / 'attachments')}
+)
+ATTACHMENT_MAX_SIZE = env.int('ATTACHMENT_MAX_SIZE', default=25 * 1024 * 1024)
+ATTACHMENT_MAX_COUNT = env.int('ATTACHMENT_MAX_COUNT', default=10)
+
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+    'attachments': {
+        'BACKEND': ATTACHMENT_STORAGE_BACKEND,
+        'OPTIONS': ATTACHMENT_STORAGE_OPTIONS,
+    },
+}
+
 # ============================================
 # CELERY CONFIGURATION
 # ============================================
@@ -150,6 +281,8 @@ CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'UTC'
 CELERY_TASK_TRACK_STARTED = True
 CELERY_TASK_TIME_LIMIT = 30 * 60  # 30 minutes
+# Pooled broker connections/producers, shared by the async send view
+CELERY_BROKER_POOL_LIMIT = env.int('CELERY_BROKER_POOL_LIMIT', default=32)
 
 # Celery Beat Schedule (for retry failed emails)
 CELERY_BEAT_SCHEDULE = {
@@ -157,16 +290,86 @@ CELERY_BEAT_SCHEDULE = {
         'task': 'email_service.tasks.retry_failed_emails',
         'schedule': 300.0,  # Every 5 minutes
     },
+    'apply-tracking-events': {
+        'task': 'email_service.tasks.apply_tracking_events',
+        'schedule': 5.0,
+    },
+    'train-compression-dictionaries': {
+        'task': 'email_service.tasks.train_compression_dictionaries',
+        'schedule': 86400.0,  # Daily
+    },
 }
 
+# Redis used for service state (quotas etc.), defaults to the broker
+REDIS_URL = env('REDIS_URL', default=CELERY_BROKER_URL)
+
+# ============================================
+# OPEN / CLICK TRACKING
+# ============================================
+# Public base URL for tracking links, e.g. https://email.example.com;
+# tracking is off while empty
+TRACKING_BASE_URL = env('TRACKING_BASE_URL', default='').rstrip('/')
+# Signs tracking links. Separate from SECRET_KEY, so rotating that one
+# doesn't break the links in emails already sent
+TRACKING_SECRET = env('TRACKING_SECRET', default='')
+if TRACKING_BASE_URL and not TRACKING_SECRET:
+    raise ValueError("TRACKING_SECRET must be set when TRACKING_BASE_URL is set")
+# Hits are buffered per process and pipelined to a Redis stream
+TRACKING_FLUSH_INTERVAL = env.float('TRACKING_FLUSH_INTERVAL', default=0.05)
+TRACKING_BATCH_SIZE = env.int('TRACKING_BATCH_SIZE', default=1000)
+TRACKING_MAX_PENDING = env.int('TRACKING_MAX_PENDING', default=100000)
+TRACKING_STREAM_MAXLEN = env.int('TRACKING_STREAM_MAXLEN', default=1000000)
+
+# ============================================
+# EMAIL BODY COMPRESSION
+# ============================================
+# body_html, body_text and template_data are stored zstd-compressed
+EMAIL_COMPRESSION_LEVEL = env.int('EMAIL_COMPRESSION_LEVEL', default=3)
+# Per-template dictionaries, trained once a template has enough emails
+EMAIL_COMPRESSION_DICT_SIZE = env.int('EMAIL_COMPRESSION_DICT_SIZE', default=32768)
+EMAIL_COMPRESSION_DICT_SAMPLES = env.int('EMAIL_COMPRESSION_DICT_SAMPLES', default=1000)
+EMAIL_COMPRESSION_DICT_MIN_SAMPLES = env.int('EMAIL_COMPRESSION_DICT_MIN_SAMPLES', default=100)
+EMAIL_COMPRESSION_DICT_REFRESH_SECONDS = env.int('EMAIL_COMPRESSION_DICT_REFRESH_SECONDS', default=300)
+# Rows per batch when compressing rows stored before compression
+EMAIL_COMPRESSION_BATCH_SIZE = env.int('EMAIL_COMPRESSION_BATCH_SIZE', default=500)
+
+# ============================================
+# HEALTH SNAPSHOT
+# ============================================
+HEALTH_REFRESH_SECONDS = env.float('HEALTH_REFRESH_SECONDS', default=5.0)
+HEALTH_QUEUES = env.list('HEALTH_QUEUES', default=['celery'])
+# Send success rate / latency are computed over this window
+HEALTH_STATS_WINDOW_SECONDS = env.int('HEALTH_STATS_WINDOW_SECONDS', default=300)
+HEALTH_STATS_SAMPLE_SIZE = env.int('HEALTH_STATS_SAMPLE_SIZE', default=1000)
+
+# Port of the Celery worker's Prometheus exporter
+METRICS_WORKER_PORT = env.int('METRICS_WORKER_PORT', default=9808)
+
 # ============================================
 # INTERNAL API SECURITY
 # ============================================
-INTERNAL_API_KEY = env('INTERNAL_API_KEY')
+# Legacy shared key, accepted for any service in ALLOWED_SERVICES
+INTERNAL_API_KEY = env('INTERNAL_API_KEY', default='')
 ALLOWED_SERVICES = env('ALLOWED_SERVICES', default='auth-service,project-service').split(',')
 
-# Rate Limiting
-RATE_LIMIT_PER_HOUR = env('RATE_LIMIT_PER_HOUR', default=100)
+# Per-service keys: "auth-service=key1,project-service=key2"
+INTERNAL_API_KEYS = env.dict('INTERNAL_API_KEYS', default={})
+
+# Paths that require an X-API-Key header
+INTERNAL_API_PATH_PREFIXES = env.list('INTERNAL_API_PATH_PREFIXES', default=['/api/', '/email/'])
+
+# Rate Limiting (sliding window per calling service). Only requests that
+# send or store mail count; template, status and history reads don't.
+RATE_LIMITED_PATH_PREFIXES = env.list(
+    'RATE_LIMITED_PATH_PREFIXES', default=['/email/send', '/email/attachments']
+)
+RATE_LIMIT_PER_HOUR = env.int('RATE_LIMIT_PER_HOUR', default=100)
+RATE_LIMIT_WINDOW_SECONDS = env.int('RATE_LIMIT_WINDOW_SECONDS', default=3600)
+# Per-service overrides: "auth-service=5000,project-service=500"
+SERVICE_RATE_LIMITS = env.dict('SERVICE_RATE_LIMITS', cast={'value': int}, default={})
+# How often each process reconciles its local counters through Redis,
+# from a background thread
+RATE_LIMIT_SYNC_INTERVAL = env.float('RATE_LIMIT_SYNC_INTERVAL', default=1.0)
 
 # Internationalization
 LANGUAGE_CODE = 'en-us'
@@ -184,36 +387,46 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # ============================================
 # LOGGING
 # ============================================
+# Loggers only enqueue records; a listener thread formats and writes
+# them, so handler I/O stays off the send path.
+LOG_LEVEL = env('LOG_LEVEL', default='INFO')
+LOG_FORMAT = env('LOG_FORMAT', default='json')  # json | text
+# Fraction of high-volume success lines (sent/queued/completed) kept
+LOG_SUCCESS_SAMPLE_RATE = env.float('LOG_SUCCESS_SAMPLE_RATE', default=1.0)
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
-    'formatters': {
-        'verbose': {
-            'format': '{levelname} {asctime} {module} {message}',
-            'style': '{',
+    'filters': {
+        'sample': {
+            '()': 'core.logging.SampleFilter',
+            'rate': LOG_SUCCESS_SAMPLE_RATE,
         },
     },
     'handlers': {
-        'console': {
-            'class': 'logging.StreamHandler',
-            'formatter': 'verbose',
-        },
-        'file': {
-            'class': 'logging.handlers.RotatingFileHandler',
-            'filename': BASE_DIR / 'logs' / 'email_service.log',
-            'maxBytes': 1024 * 1024 * 10,  # 10MB
-            'backupCount': 5,
-            'formatter': 'verbose',
+        'queue': {
+            '()': 'core.logging.QueuedHandler',
+            'format': LOG_FORMAT,
+            'filters': ['sample'],
+            'handlers': [
+                {'class': 'logging.StreamHandler'},
+                {
+                    'class': 'logging.handlers.RotatingFileHandler',
+                    'filename': BASE_DIR / 'logs' / 'email_service.log',
+                    'maxBytes': 1024 * 1024 * 10,  # 10MB
+                    'backupCount': 5,
+                },
+            ],
         },
     },
     'loggers': {
         'django': {
-            'handlers': ['console'],
+            'handlers': ['queue'],
             'level': 'INFO',
         },
         'email_service': {
-            'handlers': ['console', 'file'],
-            'level': 'DEBUG',
+            'handlers': ['queue'],
+            'level': LOG_LEVEL,
         },
     },
 }
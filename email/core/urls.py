@@ -1,5 +1,8 @@
 from django.urls import path, include
+from email_service.views import metrics_view, tracking_view
 
 urlpatterns = [
-    path('email/', include('email_service.urls'))
+    path('email/', include('email_service.urls')),
+    path('metrics', metrics_view, name='metrics'),
+    path('t/<path:path>', tracking_view, name='tracking'),
 ]
@@ -0,0 +1,294 @@
+"""
+Attachment blob storage and streaming.
+
+Uploads are hashed while they stream in. Each upload gets its own
+EmailAttachment row (filename, content type, owning service) pointing
+at an AttachmentBlob, and the blob is stored once per sha256 in the
+"attachments" storage. Sends only carry attachment ids, and only the
+uploading service may use them. The blobs are read back in small
+chunks and base64-encoded on the fly into the outgoing MIME message or
+provider request.
+"""
+from django.conf import settings
+from django.core.files.storage import storages
+from email.utils import encode_rfc2231, make_msgid
+from .models import AttachmentBlob, EmailAttachment
+import base64
+import hashlib
+import json
+import mimetypes
+import re
+
+# 57 raw bytes encode to one 76 character base64 line (RFC 2045)
+_LINE_BYTES = 57
+_CHUNK_LINES = 1024
+
+_DOT_LINE = re.compile(rb'^\.', re.MULTILINE)
+
+
+class AttachmentTooLarge(Exception):
+    pass
+
+
+def get_storage():
+    return storages['attachments']
+
+
+def store_upload(upload, service_name):
+    """
+    Store an UploadedFile for service_name, de-duplicating the content.
+
+    Always returns a new attachment. Content that is already stored is
+    not written again.
+    """
+    if upload.size > settings.ATTACHMENT_MAX_SIZE:
+        raise AttachmentTooLarge(
+            f"Attachment exceeds {settings.ATTACHMENT_MAX_SIZE} bytes"
+        )
+
+    digest = hashlib.sha256()
+    for chunk in upload.chunks():
+        digest.update(chunk)
+    sha256 = digest.hexdigest()
+
+    blob = AttachmentBlob.objects.filter(sha256=sha256).first()
+    if blob is None:
+        blob = _store_blob(upload, sha256)
+
+    content_type = (
+        upload.content_type
+        or mimetypes.guess_type(upload.name)[0]
+        or 'application/octet-stream'
+    )
+    return EmailAttachment.objects.create(
+        blob=blob,
+        filename=upload.name,
+        content_type=content_type,
+        service_name=service_name,
+    )
+
+
+def _store_blob(upload, sha256):
+    storage = get_storage()
+    name = f"{sha256[:2]}/{sha256}"
+    if not storage.exists(name):
+        upload.seek(0)
+        # Storages that don't overwrite return another name if a
+        # concurrent upload of the same content saved first
+        name = storage.save(name, upload)
+
+    blob, _ = AttachmentBlob.objects.get_or_create(
+        sha256=sha256,
+        defaults={'size': upload.size, 'storage_name': name},
+    )
+    if blob.storage_name != name:
+        # Lost the race for the row; our copy is unreferenced
+        storage.delete(name)
+    return blob
+
+
+def load_attachments(ids):
+    """Fetch attachment rows for ids, preserving the requested order"""
+    if not ids:
+        return []
+    rows = EmailAttachment.objects.select_related('blob').in_bulk([str(i) for i in ids])
+    by_id = {str(pk): row for pk, row in rows.items()}
+    missing = [str(i) for i in ids if str(i) not in by_id]
+    if missing:
+        raise EmailAttachment.DoesNotExist(
+            f"Unknown attachment ids: {', '.join(missing)}"
+        )
+    return [by_id[str(i)] for i in ids]
+
+
+def iter_base64(attachment, wrap=True):
+    """
+    Yield the blob base64-encoded, reading it in bounded chunks.
+
+    With wrap the output is split into CRLF-terminated 76 character
+    lines for MIME, otherwise it is one continuous string.
+    """
+    chunk_size = _LINE_BYTES * _CHUNK_LINES
+    with get_storage().open(attachment.storage_name, 'rb') as blob:
+        pending = b''
+        while True:
+            data = blob.read(chunk_size)
+            if not data:
+                break
+            data = pending + data
+            cut = len(data) - len(data) % _LINE_BYTES
+            pending = data[cut:]
+            if cut:
+                yield _encode(data[:cut], wrap)
+        if pending:
+            yield _encode(pending, wrap)
+
+
+def _encode(data, wrap):
+    if not wrap:
+        return base64.b64encode(data)
+    return b''.join(
+        base64.b64encode(data[i:i + _LINE_BYTES]) + b'\r\n'
+        for i in range(0, len(data), _LINE_BYTES)
+    )
+
+
+def _filename_params(filename):
+    try:
+        filename.encode('ascii')
+    except UnicodeEncodeError:
+        return f"filename*={encode_rfc2231(filename, 'utf-8')}"
+    escaped = filename.replace('\\', '\\\\').replace('"', '\\"')
+    return f'filename="{escaped}"'
+
+
+def iter_mime(message, attachments):
+    """
+    Yield ``message`` (a Django EmailMessage) as a multipart/mixed MIME
+    document with the attachments appended, CRLF line endings throughout.
+
+    Every chunk ends on a line boundary so it can be dot-stuffed
+    independently for SMTP.
+    """
+    body = message.message()
+    policy = body.policy.clone(linesep='\r\n')
+
+    # Envelope headers move to the outer part, content headers stay
+    headers = []
+    for name, value in list(body.items()):
+        if name.lower() in ('mime-version', 'content-type', 'content-transfer-encoding'):
+            continue
+        headers.append(policy.fold(name, value))
+        del body[name]
+    del body['MIME-Version']
+
+    boundary = make_msgid(domain='mixed')[1:-1]
+    head = ''.join(headers) + (
+        'MIME-Version: 1.0\r\n'
+        f'Content-Type: multipart/mixed; boundary="{boundary}"\r\n'
+        '\r\n'
+    )
+    yield head.encode()
+    yield f'--{boundary}\r\n'.encode() + body.as_bytes(linesep='\r\n') + b'\r\n'
+
+    for attachment in attachments:
+        part = (
+            f'--{boundary}\r\n'
+            f'Content-Type: {attachment.content_type}\r\n'
+            'Content-Transfer-Encoding: base64\r\n'
+            f'Content-Disposition: attachment; {_filename_params(attachment.filename)}\r\n'
+            '\r\n'
+        )
+        yield part.encode()
+        yield from iter_base64(attachment)
+
+    yield f'--{boundary}--\r\n'.encode()
+
+
+def send_smtp_streamed(message, attachments, connection=None):
+    """
+    Deliver a Django EmailMessage over SMTP, streaming the attachments
+    into the DATA command instead of building the message in memory.
+
+    Backends without a raw SMTP connection (console, locmem) get the
+    message built in memory instead. Returns the Message-ID.
+    """
+    from django.core.mail import get_connection
+    from django.core.mail.backends.smtp import EmailBackend as SMTPBackend
+    from django.core.mail.message import sanitize_address
+    from django.core.mail.utils import DNS_NAME
+    import smtplib
+
+    message_id = make_msgid(domain=DNS_NAME)
+    message.extra_headers['Message-ID'] = message_id
+
+    backend = connection or get_connection()
+    if not isinstance(backend, SMTPBackend):
+        for attachment in attachments:
+            with get_storage().open(attachment.storage_name, 'rb') as blob:
+                message.attach(attachment.filename, blob.read(), attachment.content_type)
+        message.connection = backend
+        message.send()
+        return message_id
+
+    encoding = message.encoding or settings.DEFAULT_CHARSET
+    from_email = sanitize_address(message.from_email, encoding)
+    backend.open()
+    smtp = backend.connection
+    try:
+        smtp.ehlo_or_helo_if_needed()
+        code, reply = smtp.mail(from_email)
+        if code != 250:
+            raise smtplib.SMTPSenderRefused(code, reply, from_email)
+        for recipient in message.recipients():
+            recipient = sanitize_address(recipient, encoding)
+            code, reply = smtp.rcpt(recipient)
+            if code not in (250, 251):
+                raise smtplib.SMTPRecipientsRefused({recipient: (code, reply)})
+        code, reply = smtp.docmd('DATA')
+        if code != 354:
+            raise smtplib.SMTPDataError(code, reply)
+
+        for chunk in iter_mime(message, attachments):
+            smtp.send(_DOT_LINE.sub(b'..', chunk))
+        smtp.send(b'.\r\n')
+
+        code, reply = smtp.getreply()
+        if code != 250:
+            raise smtplib.SMTPDataError(code, reply)
+        return message_id
+    finally:
+        backend.close()
+
+
+def iter_sendgrid_body(payload, attachments):
+    """
+    Yield a SendGrid v3 mail/send JSON body whose attachment contents
+    are streamed from storage. ``payload`` is the body without attachments.
+    """
+    yield json.dumps(payload)[:-1].encode() + b',"attachments":['
+    for index, attachment in enumerate(attachments):
+        meta = {
+            'filename': attachment.filename,
+            'type': attachment.content_type,
+            'disposition': 'attachment',
+        }
+        prefix = b',' if index else b''
+        yield prefix + json.dumps(meta)[:-1].encode() + b',"content":"'
+        yield from iter_base64(attachment, wrap=False)
+        yield b'"}'
+    yield b']}'
+
+
+def send_sendgrid_streamed(payload, attachments):
+    """
+    POST a mail/send request with chunked transfer encoding so the
+    attachment contents never sit in memory. Returns the X-Message-Id.
+    """
+    from urllib.parse import urlsplit
+    import http.client
+
+    url = urlsplit(settings.SENDGRID_API_HOST)
+    conn_class = (
+        http.client.HTTPSConnection if url.scheme == 'https'
+        else http.client.HTTPConnection
+    )
+    conn = conn_class(url.netloc, timeout=60)
+    try:
+        conn.request(
+            'POST',
+            url.path.rstrip('/') + '/v3/mail/send',
+            body=iter_sendgrid_body(payload, attachments),
+            headers={
+                'Authorization': f"Bearer {settings.SENDGRID_API_KEY}",
+                'Content-Type': 'application/json',
+            },
+            encode_chunked=True,
+        )
+        response = conn.getresponse()
+        body = response.read()
+        if response.status not in (200, 202):
+            raise Exception(f"SendGrid error: {body.decode(errors='replace')}")
+        return response.getheader('X-Message-Id')
+    finally:
+        conn.close()
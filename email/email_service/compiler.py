@@ -0,0 +1,110 @@
+"""
+Template compilation.
+
+Runs once when a template is saved: CSS is inlined, the HTML minified
+and a plaintext alternative generated. ``{{ key }}`` placeholders pass
+through untouched so sends only substitute variables.
+"""
+from html.parser import HTMLParser
+import re
+
+_BLOCK_TAGS = {
+    'address', 'article', 'aside', 'blockquote', 'div', 'dl', 'dt', 'dd',
+    'footer', 'form', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'header', 'hr',
+    'li', 'main', 'nav', 'ol', 'p', 'pre', 'section', 'table', 'tr', 'ul',
+}
+_SKIP_TAGS = {'head', 'script', 'style', 'title'}
+
+
+class _TextExtractor(HTMLParser):
+    """Flatten HTML to readable text, keeping link targets"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self.skip = 0
+        self.links = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag in _SKIP_TAGS:
+            self.skip += 1
+        elif tag == 'br':
+            self.parts.append('\n')
+        elif tag in _BLOCK_TAGS:
+            self.parts.append('\n\n' if tag in ('p', 'table', 'h1', 'h2', 'h3') else '\n')
+            if tag == 'li':
+                self.parts.append('- ')
+        elif tag in ('td', 'th'):
+            self.parts.append(' ')
+        if tag == 'a':
+            self.links.append(dict(attrs).get('href'))
+        elif tag == 'img':
+            alt = dict(attrs).get('alt')
+            if alt and not self.skip:
+                self.parts.append(alt)
+
+    def handle_startendtag(self, tag, attrs):
+        if tag not in _SKIP_TAGS:
+            self.handle_starttag(tag, attrs)
+
+    def handle_endtag(self, tag):
+        if tag in _SKIP_TAGS:
+            self.skip = max(self.skip - 1, 0)
+        elif tag in _BLOCK_TAGS and tag != 'li':
+            self.parts.append('\n')
+        elif tag == 'a' and self.links:
+            href = self.links.pop()
+            if href and not href.startswith(('#', 'mailto:')) and not self.skip:
+                self.parts.append(f' ({href})')
+
+    def handle_data(self, data):
+        if not self.skip:
+            self.parts.append(re.sub(r'\s+', ' ', data))
+
+    def text(self):
+        text = ''.join(self.parts)
+        lines = [line.strip() for line in text.split('\n')]
+        return re.sub(r'\n{3,}', '\n\n', '\n'.join(lines)).strip()
+
+
+def html_to_text(html):
+    parser = _TextExtractor()
+    parser.feed(html)
+    parser.close()
+    return parser.text()
+
+
+def inline_css(html):
+    import css_inline
+
+    inliner = css_inline.CSSInliner(
+        keep_at_rules=True,  # media queries can't be inlined
+        load_remote_stylesheets=False,
+        minify_css=True,
+    )
+    return inliner.inline(html)
+
+
+def minify(html):
+    import minify_html
+
+    return minify_html.minify(
+        html,
+        keep_closing_tags=True,
+        keep_html_and_head_opening_tags=True,
+        # Its CSS minifier emits modern syntax (media query ranges)
+        # that mail clients don't understand
+        minify_css=False,
+        preserve_brace_template_syntax=True,
+    )
+
+
+def compile_template(html_content, text_content=None):
+    """
+    Return (compiled_html, compiled_text) for a template.
+
+    An explicit text_content wins over the generated plaintext.
+    """
+    compiled_html = minify(inline_css(html_content))
+    compiled_text = text_content or html_to_text(compiled_html)
+    return compiled_html, compiled_text
@@ -0,0 +1,184 @@
+"""
+zstd compression for stored email content.
+
+Content can be compressed against a dictionary trained on earlier
+emails of the same template. Each frame header records the dictionary
+id, so decompression only needs an id lookup. Dictionaries live on the
+default database and are never deleted, because old rows still
+reference them.
+"""
+import logging
+import threading
+import time
+
+import zstandard
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'\x28\xb5\x2f\xfd'
+
+
+def is_compressed(data):
+    return data[:4] == MAGIC
+
+
+class DictionaryCache:
+    """Process-wide cache of trained dictionaries, keyed by id and template"""
+
+    def __init__(self, refresh_seconds):
+        self.refresh_seconds = refresh_seconds
+        self._by_id = {}
+        self._by_template = {}
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def for_template(self, template_name):
+        """Newest dictionary for a template, or None"""
+        if self._loaded_at is None or time.monotonic() - self._loaded_at > self.refresh_seconds:
+            self._refresh()
+        return self._by_template.get(template_name)
+
+    def by_id(self, dict_id):
+        dictionary = self._by_id.get(dict_id)
+        if dictionary is None:
+            from .models import CompressionDictionary
+
+            row = CompressionDictionary.objects.filter(dict_id=dict_id).first()
+            if row is None:
+                raise LookupError(f"Unknown compression dictionary {dict_id}")
+            dictionary = self._add(row.dict_id, row.data)
+        return dictionary
+
+    def _add(self, dict_id, data):
+        dictionary = zstandard.ZstdCompressionDict(bytes(data))
+        dictionary.precompute_compress(level=settings.EMAIL_COMPRESSION_LEVEL)
+        self._by_id[dict_id] = dictionary
+        return dictionary
+
+    def _refresh(self):
+        from .models import CompressionDictionary
+
+        with self._lock:
+            if self._loaded_at is not None and time.monotonic() - self._loaded_at <= self.refresh_seconds:
+                return
+            try:
+                # Oldest first, so each template ends up on its newest one
+                latest = dict(
+                    CompressionDictionary.objects.order_by('created_at')
+                    .values_list('template_name', 'dict_id')
+                )
+                missing = [i for i in latest.values() if i not in self._by_id]
+                for dict_id, data in CompressionDictionary.objects.filter(
+                    dict_id__in=missing
+                ).values_list('dict_id', 'data'):
+                    self._add(dict_id, data)
+                self._by_template = {
+                    name: self._by_id[dict_id] for name, dict_id in latest.items()
+                }
+            except Exception as e:
+                # Compressing without a dictionary is always an option
+                logger.warning("Could not load compression dictionaries: %s", e)
+            self._loaded_at = time.monotonic()
+
+
+dictionaries = DictionaryCache(refresh_seconds=settings.EMAIL_COMPRESSION_DICT_REFRESH_SECONDS)
+
+
+def compress(data, template_name=None):
+    """Compress bytes, with the template's dictionary when there is one"""
+    dictionary = dictionaries.for_template(template_name) if template_name else None
+    compressor = zstandard.ZstdCompressor(
+        level=settings.EMAIL_COMPRESSION_LEVEL, dict_data=dictionary
+    )
+    return compressor.compress(data)
+
+
+def decompress(data):
+    """Plain bytes for a stored value; rows never compressed pass through"""
+    if not is_compressed(data):
+        return data
+    dict_id = zstandard.get_frame_parameters(data).dict_id
+    dictionary = dictionaries.by_id(dict_id) if dict_id else None
+    return zstandard.ZstdDecompressor(dict_data=dictionary).decompress(data)
+
+
+def _compressed_fields():
+    from .fields import CompressedField
+    from .models import EmailLog
+
+    return [
+        field.name for field in EmailLog._meta.concrete_fields
+        if isinstance(field, CompressedField)
+    ]
+
+
+def train_dictionary(template_name):
+    """
+    Train and store a dictionary from the template's recent emails
+    across all shards. Returns the CompressionDictionary, or None when
+    there are too few samples.
+    """
+    from .models import CompressionDictionary, EmailLog
+    from .routers import email_log_shards, fan_out
+
+    fields = _compressed_fields()
+    limit = settings.EMAIL_COMPRESSION_DICT_SAMPLES
+
+    def sample_shard(alias):
+        rows = EmailLog.objects.using(alias).filter(
+            template_name=template_name
+        ).order_by('-created_at').values_list(*fields)[:limit]
+        return [decompress(raw) for row in rows for raw in row if raw]
+
+    samples = [s for shard in fan_out(sample_shard, email_log_shards()) for s in shard]
+    if len(samples) < settings.EMAIL_COMPRESSION_DICT_MIN_SAMPLES:
+        return None
+    try:
+        trained = zstandard.train_dictionary(
+            settings.EMAIL_COMPRESSION_DICT_SIZE, samples,
+            level=settings.EMAIL_COMPRESSION_LEVEL
+        )
+    except zstandard.ZstdError as e:
+        logger.warning("Dictionary training for %s failed: %s", template_name, e)
+        return None
+    return CompressionDictionary.objects.create(
+        dict_id=trained.dict_id(),
+        template_name=template_name,
+        data=trained.as_bytes(),
+        sample_count=len(samples),
+    )
+
+
+def compress_batch(database, after=None):
+    """
+    Move one batch of EmailLog rows written before compression from the
+    plain columns into the compressed ones, in primary key order.
+    Returns (rows compressed, last pk seen or None once the table is
+    exhausted).
+    """
+    from .models import EmailLog
+
+    fields = [EmailLog._meta.get_field(name) for name in _compressed_fields()]
+    plain = [field.plain_field for field in fields]
+    batch_size = settings.EMAIL_COMPRESSION_BATCH_SIZE
+    queryset = EmailLog.objects.using(database).filter(
+        Q(*[Q(**{f'{name}__isnull': False}) for name in plain], _connector=Q.OR)
+    ).order_by('pk')
+    if after is not None:
+        queryset = queryset.filter(pk__gt=after)
+    rows = list(queryset.values_list('pk', 'template_name', *plain)[:batch_size])
+
+    with transaction.atomic(using=database):
+        for pk, template_name, *values in rows:
+            changes = {name: None for name in plain}
+            for field, value in zip(fields, values):
+                if value is not None:
+                    changes[field.name] = compress(field.encode(value), template_name)
+            # Queryset update: leaves updated_at alone
+            EmailLog.objects.using(database).filter(pk=pk).update(**changes)
+
+    last = rows[-1][0] if len(rows) == batch_size else None
+    return len(rows), last
@@ -0,0 +1,55 @@
+"""
+Off-loop execution for the async ingress views.
+
+Broker publishes and synchronous sends are blocking calls. Each gets its
+own bounded thread pool, so a slow broker or provider cannot take over
+the default executor or grow threads without limit, and every publish
+reuses a kombu producer from Celery's producer pool.
+
+Sends stay on threads on purpose. The provider SDKs (smtplib, sendgrid,
+boto3) are blocking and Celery workers send through the same code, so
+async clients would mean a second implementation of every provider.
+The bound on concurrent sends is the DB pool anyway: a send holds its
+connection from the EmailLog insert to the status update after the
+provider call. SYNC_SEND_CONCURRENCY therefore defaults to the pool
+size, and a send thread costs about 100 KiB.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections
+
+_publish_executor = ThreadPoolExecutor(
+    max_workers=settings.CELERY_BROKER_POOL_LIMIT,
+    thread_name_prefix='email-publish',
+)
+_send_executor = ThreadPoolExecutor(
+    max_workers=settings.SYNC_SEND_CONCURRENCY,
+    thread_name_prefix='email-send',
+)
+
+
+def publish(task, kwargs):
+    """Publish ``task`` through a pooled producer, returns the AsyncResult"""
+    with task.app.producer_pool.acquire(block=True) as producer:
+        return task.apply_async(kwargs=kwargs, producer=producer)
+
+
+async def apublish(task, kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_publish_executor, publish, task, kwargs)
+
+
+def _run_and_release(func, kwargs):
+    try:
+        return func(**kwargs)
+    finally:
+        # Executor threads outlive the request; hand DB connections back
+        # to the pool instead of pinning one per thread
+        connections.close_all()
+
+
+async def arun_send(func, kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_send_executor, _run_and_release, func, kwargs)
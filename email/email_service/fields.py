@@ -0,0 +1,115 @@
+"""
+Model fields stored zstd-compressed.
+
+A loaded row keeps the column's bytes as the database returned them.
+The descriptor decompresses on first attribute access and caches the
+result on the instance. Querysets that never read the column skip the
+work, and saving a row whose column was never read writes the bytes
+back unchanged.
+
+Rows written before compression keep their content in the old plain
+column (``plain_field``) until compress_email_logs moves it over; the
+descriptor reads that instead while the compressed column is empty.
+"""
+import orjson
+from django.db import models
+from django.db.models.query_utils import DeferredAttribute
+
+from . import compression
+
+
+class _DecompressOnAccess(DeferredAttribute):
+    def __get__(self, instance, cls=None):
+        if instance is None:
+            return self
+        value = super().__get__(instance, cls)
+        if isinstance(value, bytes):
+            value = self.field.decode(compression.decompress(value))
+            instance.__dict__[self.field.attname] = value
+        elif value is None and self.field.plain_field:
+            # Not moved into the compressed column yet
+            value = getattr(instance, self.field.plain_field)
+        return value
+
+    def __set__(self, instance, value):
+        # A data descriptor, so __get__ runs even once the value is loaded
+        instance.__dict__[self.field.attname] = value
+
+
+class CompressedField(models.Field):
+    """
+    Base for zstd-compressed columns (bytea / BLOB).
+
+    ``dictionary_key`` names a sibling field, e.g. template_name, whose
+    value selects the trained dictionary to compress with.
+    ``plain_field`` names the uncompressed field read when this one is
+    empty.
+    """
+    descriptor_class = _DecompressOnAccess
+
+    def __init__(self, *args, dictionary_key=None, plain_field=None, **kwargs):
+        self.dictionary_key = dictionary_key
+        self.plain_field = plain_field
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        if self.dictionary_key:
+            kwargs['dictionary_key'] = self.dictionary_key
+        if self.plain_field:
+            kwargs['plain_field'] = self.plain_field
+        return name, path, args, kwargs
+
+    def get_internal_type(self):
+        return 'BinaryField'
+
+    def encode(self, value):
+        raise NotImplementedError
+
+    def decode(self, data):
+        raise NotImplementedError
+
+    def from_db_value(self, value, expression, connection):
+        # Left compressed until the attribute is read
+        if isinstance(value, memoryview):
+            return bytes(value)
+        return value
+
+    def pre_save(self, model_instance, add):
+        value = model_instance.__dict__.get(self.attname)
+        if value is None or isinstance(value, bytes):
+            return value
+        key = getattr(model_instance, self.dictionary_key) if self.dictionary_key else None
+        return compression.compress(self.encode(value), key)
+
+    def get_prep_value(self, value):
+        value = super().get_prep_value(value)
+        if value is None or isinstance(value, bytes):
+            return value
+        return compression.compress(self.encode(value))
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        value = super().get_db_prep_value(value, connection, prepared)
+        if value is not None:
+            return connection.Database.Binary(value)
+        return value
+
+
+class CompressedTextField(CompressedField):
+    description = "zstd-compressed text"
+
+    def encode(self, value):
+        return str(value).encode()
+
+    def decode(self, data):
+        return data.decode()
+
+
+class CompressedJSONField(CompressedField):
+    description = "zstd-compressed JSON"
+
+    def encode(self, value):
+        return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS)
+
+    def decode(self, data):
+        return orjson.loads(data)
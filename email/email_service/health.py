@@ -0,0 +1,250 @@
+import collections
+import json
+import logging
+import threading
+import time
+
+import redis
+from celery import current_app
+from django.conf import settings
+from django.db import connection
+
+from .replicas import lag_monitor
+
+logger = logging.getLogger(__name__)
+
+SEND_STATS_KEY = 'email:health:sends:{provider}'
+
+_redis = None
+_broker = None
+
+# Send samples not yet in Redis, {provider: deque}; the monitor flushes them
+_pending = {}
+_pending_lock = threading.Lock()
+
+
+def _client():
+    global _redis
+    if _redis is None:
+        _redis = redis.Redis.from_url(
+            settings.REDIS_URL, socket_timeout=0.1, socket_connect_timeout=0.1
+        )
+    return _redis
+
+
+def _broker_client():
+    global _broker
+    if _broker is None:
+        _broker = redis.Redis.from_url(
+            settings.CELERY_BROKER_URL, socket_timeout=1, socket_connect_timeout=1
+        )
+    return _broker
+
+
+def record_send(provider, success, latency):
+    """
+    Record the outcome of one provider call for the health snapshot.
+
+    Samples are buffered in process and the monitor thread pushes them
+    to a capped Redis list per provider every HEALTH_REFRESH_SECONDS, so
+    web and worker processes share one view of recent sends without a
+    Redis round trip per send. Never raises.
+    """
+    sample = f"{time.time():.0f}:{int(success)}:{latency * 1000:.1f}"
+    with _pending_lock:
+        samples = _pending.get(provider)
+        if samples is None:
+            samples = _pending[provider] = collections.deque(
+                maxlen=settings.HEALTH_STATS_SAMPLE_SIZE
+            )
+        samples.append(sample)
+    monitor._ensure_started()
+
+
+def flush_sends():
+    """Push the buffered send samples to Redis"""
+    with _pending_lock:
+        if not _pending:
+            return
+        pending = dict(_pending)
+        _pending.clear()
+    try:
+        pipe = _client().pipeline(transaction=False)
+        for provider, samples in pending.items():
+            key = SEND_STATS_KEY.format(provider=provider)
+            # Pushed oldest first, so the list stays newest first
+            pipe.lpush(key, *samples)
+            pipe.ltrim(key, 0, settings.HEALTH_STATS_SAMPLE_SIZE - 1)
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.debug("Could not record send stats: %s", e)
+
+
+class HealthMonitor:
+    """
+    Keeps a health/saturation snapshot refreshed in a background thread.
+
+    Probes only read the last snapshot, so they cost O(1) no matter how
+    expensive the underlying checks are. The same thread flushes send
+    samples; processes that never serve a probe (Celery workers) only
+    flush and don't collect.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._snapshot = None
+        self._collecting = False
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def snapshot(self):
+        """Latest snapshot, or None until the first refresh has finished"""
+        if not self._collecting:
+            self._collecting = True
+            self._wake.set()
+        self._ensure_started()
+        return self._snapshot
+
+    def is_ready(self, snapshot):
+        if snapshot is None:
+            return False
+        if time.time() - snapshot['generated_at'] > self.interval * 3:
+            return False
+        return (
+            snapshot['database']['status'] == 'connected'
+            and snapshot['broker']['status'] == 'connected'
+        )
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name='health-monitor', daemon=True
+                )
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            flush_sends()
+            if self._collecting:
+                try:
+                    self._snapshot = self.collect()
+                except Exception as e:
+                    logger.error("Health snapshot failed: %s", e)
+            # Woken early by the first snapshot() in a flush-only process
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def collect(self):
+        started = time.time()
+        broker = self._broker_state()
+        snapshot = {
+            "generated_at": started,
+            "database": self._database_state(),
+            "broker": broker,
+            # Celery retries broker connections for a long time, so only
+            # ping workers when the broker is known to be up
+            "workers": (
+                self._worker_state() if broker['status'] == 'connected'
+                else {"status": "unknown", "count": 0}
+            ),
+            "providers": self._provider_state(),
+        }
+        snapshot["collect_ms"] = round((time.time() - started) * 1000, 1)
+        return snapshot
+
+    def _database_state(self):
+        state = {"vendor": connection.vendor}
+        try:
+            connection.close_if_unusable_or_obsolete()
+            connection.ensure_connection()
+            state["status"] = "connected"
+        except Exception as e:
+            state["status"] = f"error: {e}"
+        pool = getattr(connection, 'pool', None)
+        if pool is not None:
+            state["pool"] = pool.get_stats()
+        if settings.DB_REPLICAS:
+            state["replicas"] = lag_monitor.lags()
+        return state
+
+    def _broker_state(self):
+        broker_url = settings.CELERY_BROKER_URL
+        if not broker_url.startswith(('redis://', 'rediss://')):
+            return {"status": "unknown", "error": "queue depth needs a Redis broker"}
+
+        try:
+            pipe = _broker_client().pipeline(transaction=False)
+            for queue in settings.HEALTH_QUEUES:
+                pipe.llen(queue)
+                # kombu LPUSHes, so the oldest message is at the tail
+                pipe.lindex(queue, -1)
+            results = pipe.execute()
+        except redis.RedisError as e:
+            return {"status": f"error: {e}"}
+
+        now = time.time()
+        queues = {}
+        for i, queue in enumerate(settings.HEALTH_QUEUES):
+            depth, oldest = results[2 * i], results[2 * i + 1]
+            queues[queue] = {
+                "depth": depth,
+                "oldest_task_age": self._message_age(oldest, now),
+            }
+        return {"status": "connected", "queues": queues}
+
+    @staticmethod
+    def _message_age(raw, now):
+        if not raw:
+            return None
+        try:
+            enqueued_at = json.loads(raw)['headers'].get('enqueued_at')
+        except (ValueError, KeyError, TypeError):
+            return None
+        return round(now - enqueued_at, 3) if enqueued_at else None
+
+    def _worker_state(self):
+        try:
+            replies = current_app.control.ping(timeout=1.0)
+        except Exception as e:
+            return {"status": f"error: {e}", "count": 0}
+        return {"status": "ok", "count": len(replies)}
+
+    def _provider_state(self):
+        cutoff = time.time() - settings.HEALTH_STATS_WINDOW_SECONDS
+        providers = {}
+        try:
+            client = _client()
+            keys = list(client.scan_iter(SEND_STATS_KEY.format(provider='*')))
+            pipe = client.pipeline(transaction=False)
+            for key in keys:
+                pipe.lrange(key, 0, -1)
+            samples = pipe.execute()
+        except redis.RedisError as e:
+            return {"error": str(e)}
+
+        for key, entries in zip(keys, samples):
+            provider = key.decode().rsplit(':', 1)[-1]
+            outcomes = []
+            latencies = []
+            for entry in entries:
+                ts, ok, latency = entry.decode().split(':')
+                if float(ts) < cutoff:
+                    break  # newest first
+                outcomes.append(ok == '1')
+                latencies.append(float(latency))
+            if not outcomes:
+                continue
+            latencies.sort()
+            providers[provider] = {
+                "sends": len(outcomes),
+                "success_rate": round(sum(outcomes) / len(outcomes), 4),
+                "p95_latency_ms": latencies[int(0.95 * (len(latencies) - 1))],
+            }
+        return providers
+
+
+monitor = HealthMonitor(interval=settings.HEALTH_REFRESH_SECONDS)
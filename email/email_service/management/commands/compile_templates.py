@@ -0,0 +1,27 @@
+from django.core.management import BaseCommand
+from email_service.compiler import compile_template
+from email_service.models import EmailTemplate
+
+
+class Command(BaseCommand):
+    help = "Compile stored templates (inlined CSS, minified HTML, plaintext)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all', action='store_true',
+            help="Recompile every template, not only uncompiled ones"
+        )
+
+    def handle(self, *args, **options):
+        templates = EmailTemplate.objects.all()
+        if not options['all']:
+            templates = templates.filter(compiled_html__isnull=True)
+
+        count = 0
+        for template in templates.iterator():
+            template.compiled_html, template.compiled_text = compile_template(
+                template.html_content, template.text_content
+            )
+            template.save(update_fields=['compiled_html', 'compiled_text'])
+            count += 1
+        self.stdout.write(self.style.SUCCESS(f"Compiled {count} templates"))
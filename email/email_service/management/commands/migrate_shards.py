@@ -0,0 +1,24 @@
+from django.core.management import BaseCommand, call_command
+from django.conf import settings
+
+
+class Command(BaseCommand):
+    help = "Run migrations on the default database and every EmailLog shard"
+
+    def add_arguments(self, parser):
+        parser.add_argument('app_label', nargs='?')
+        parser.add_argument('migration_name', nargs='?')
+
+    def handle(self, *args, app_label=None, migration_name=None, **options):
+        aliases = list(dict.fromkeys(['default', *settings.EMAIL_LOG_SHARDS]))
+        positional = [arg for arg in (app_label, migration_name) if arg]
+        for alias in aliases:
+            self.stdout.write(self.style.MIGRATE_HEADING(f"Database {alias}:"))
+            call_command(
+                'migrate', *positional,
+                database=alias,
+                verbosity=options['verbosity'],
+                interactive=False,
+                stdout=self.stdout,
+                stderr=self.stderr,
+            )
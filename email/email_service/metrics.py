@@ -0,0 +1,106 @@
+"""
+Prometheus metrics for the email pipeline.
+
+Web processes expose them at /metrics. Celery workers run one exporter
+in the main process that aggregates all prefork children; that needs
+PROMETHEUS_MULTIPROC_DIR set (to an empty, writable directory) in the
+worker's environment before it starts.
+"""
+import glob
+import logging
+import os
+import time
+
+from celery.signals import task_prerun, worker_init, worker_process_shutdown
+from django.conf import settings
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+    start_http_server,
+)
+
+logger = logging.getLogger(__name__)
+
+TEMPLATE_RENDER_SECONDS = Histogram(
+    'email_template_render_seconds',
+    'Time spent resolving and rendering email templates',
+    buckets=(.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1),
+)
+LOG_WRITE_SECONDS = Histogram(
+    'email_log_write_seconds',
+    'Time spent writing EmailLog rows',
+    ['operation'],
+    buckets=(.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1),
+)
+PROVIDER_REQUEST_SECONDS = Histogram(
+    'email_provider_request_seconds',
+    'Latency of provider send calls',
+    ['provider', 'outcome'],
+    buckets=(.01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30),
+)
+QUEUE_WAIT_SECONDS = Histogram(
+    'email_queue_wait_seconds',
+    'Time between enqueueing a task and a worker starting it',
+    ['task'],
+    buckets=(.005, .01, .05, .1, .5, 1, 5, 10, 30, 60, 300, 900),
+)
+TASK_RETRIES = Counter(
+    'email_task_retries_total',
+    'Email task retries',
+    ['service_name'],
+)
+EMAILS = Counter(
+    'emails_total',
+    'Emails by calling service and status',
+    ['service_name', 'status'],
+)
+
+
+def _multiprocess_enabled():
+    return 'PROMETHEUS_MULTIPROC_DIR' in os.environ
+
+
+def render_latest():
+    """Current metrics in the Prometheus text format"""
+    registry = REGISTRY
+    if _multiprocess_enabled():
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+@task_prerun.connect
+def observe_queue_wait(task=None, **kwargs):
+    enqueued_at = getattr(task.request, 'enqueued_at', None)
+    if enqueued_at:
+        QUEUE_WAIT_SECONDS.labels(task.name).observe(
+            max(0.0, time.time() - enqueued_at)
+        )
+
+
+@worker_init.connect
+def start_worker_exporter(**kwargs):
+    """Serve aggregated metrics for all prefork children"""
+    if not _multiprocess_enabled():
+        logger.warning(
+            "PROMETHEUS_MULTIPROC_DIR is not set, worker metrics are disabled"
+        )
+        return
+    # Files left by a previous run would be summed into the new one
+    for path in glob.glob(os.path.join(os.environ['PROMETHEUS_MULTIPROC_DIR'], '*.db')):
+        os.remove(path)
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    start_http_server(settings.METRICS_WORKER_PORT, registry=registry)
+    logger.info("Worker metrics exporter listening on :%s", settings.METRICS_WORKER_PORT)
+
+
+@worker_process_shutdown.connect
+def mark_child_dead(pid=None, **kwargs):
+    if _multiprocess_enabled():
+        multiprocess.mark_process_dead(pid or os.getpid())
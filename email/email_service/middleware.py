@@ -1,36 +1,130 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
 from django.http import JsonResponse
 from django.conf import settings
+from .quotas import SlidingWindowQuota
+import hmac
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Identity assigned to callers using the legacy shared INTERNAL_API_KEY
+SHARED_KEY_IDENTITY = '*'
+
+HEALTH_PATHS = ('/health', '/health/ready')
+
+
+def load_service_keys():
+    """
+    Build the (api_key, service) table from settings.
+
+    Per-service keys come from INTERNAL_API_KEYS and must belong to a
+    service in ALLOWED_SERVICES. The legacy shared INTERNAL_API_KEY is
+    still accepted under SHARED_KEY_IDENTITY.
+    """
+    keys = []
+    for service, api_key in settings.INTERNAL_API_KEYS.items():
+        if service not in settings.ALLOWED_SERVICES:
+            logger.warning("Ignoring API key for unknown service %s", service)
+            continue
+        keys.append((api_key.encode(), service))
+    if settings.INTERNAL_API_KEY:
+        keys.append((settings.INTERNAL_API_KEY.encode(), SHARED_KEY_IDENTITY))
+    return keys
+
+
 class InternalAPIKeyMiddleware:
-    """Validate internal API key for service-to-service communication"""
-    
+    """
+    Validate internal API keys for service-to-service communication
+    and enforce per-service quotas on the send and upload endpoints.
+
+    The resolved service identity is exposed as ``request.internal_service``.
+    Works in both WSGI and ASGI stacks without a sync/async switch.
+    """
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response):
         self.get_response = get_response
-    
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        self.keys = load_service_keys()
+        self.protected_prefixes = tuple(settings.INTERNAL_API_PATH_PREFIXES)
+        self.limited_prefixes = tuple(settings.RATE_LIMITED_PATH_PREFIXES)
+        self.quota = SlidingWindowQuota(
+            window_seconds=settings.RATE_LIMIT_WINDOW_SECONDS,
+            sync_interval=settings.RATE_LIMIT_SYNC_INTERVAL,
+            redis_url=settings.REDIS_URL,
+        )
+
     def __call__(self, request):
-        # Skip for health check
-        if request.path.endswith('/health'):
-            return self.get_response(request)
-        
-        # Check API key for API endpoints
-        if request.path.startswith('/api/'):
-            api_key = request.headers.get('X-API-Key')
-            
-            if not api_key:
-                logger.warning(f"Missing API key for request: {request.path}")
-                return JsonResponse({
-                    "success": False,
-                    "error": "Missing X-API-Key header"
-                }, status=401)
-            
-            if api_key != settings.INTERNAL_API_KEY:
-                logger.warning(f"Invalid API key attempt: {request.path}")
-                return JsonResponse({
-                    "success": False,
-                    "error": "Invalid API key"
-                }, status=401)
-        
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        rejection = self.check(request)
+        if rejection is not None:
+            return rejection
         return self.get_response(request)
+
+    async def __acall__(self, request):
+        rejection = self.check(request)
+        if rejection is not None:
+            return rejection
+        return await self.get_response(request)
+
+    def check(self, request):
+        """Authenticate and rate limit, returns an error response or None"""
+        # Skip for health checks
+        if request.path.endswith(HEALTH_PATHS):
+            return None
+
+        # Check API key for API endpoints
+        if not request.path.startswith(self.protected_prefixes):
+            return None
+
+        api_key = request.headers.get('X-API-Key')
+
+        if not api_key:
+            logger.warning("Missing API key for request: %s", request.path)
+            return JsonResponse({
+                "success": False,
+                "error": "Missing X-API-Key header"
+            }, status=401)
+
+        service = self.identify(api_key)
+        if service is None:
+            logger.warning("Invalid API key attempt: %s", request.path)
+            return JsonResponse({
+                "success": False,
+                "error": "Invalid API key"
+            }, status=401)
+
+        request.internal_service = service
+        if request.path.startswith(self.limited_prefixes):
+            return self.limit(service)
+        return None
+
+    def limit(self, service):
+        """Count a request against the service's quota, 429 once it's used up"""
+        limit = settings.SERVICE_RATE_LIMITS.get(
+            service, settings.RATE_LIMIT_PER_HOUR
+        )
+        allowed, retry_after = self.quota.hit(service, limit)
+        if allowed:
+            return None
+        logger.warning("Quota exceeded for service %s", service)
+        response = JsonResponse({
+            "success": False,
+            "error": "Rate limit exceeded",
+            "retry_after": retry_after
+        }, status=429)
+        response['Retry-After'] = str(retry_after)
+        return response
+
+    def identify(self, api_key):
+        """Resolve an API key to its service, in constant time"""
+        candidate = api_key.encode()
+        service = None
+        # Compare against every key so timing doesn't reveal which matched
+        for key, identity in self.keys:
+            if hmac.compare_digest(candidate, key):
+                service = identity
+        return service
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.7 on 2026-10-19 09:09
+
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('email_service', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EmailAttachment',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('sha256', models.CharField(max_length=64, unique=True)),
+                ('filename', models.CharField(max_length=255)),
+                ('content_type', models.CharField(max_length=255)),
+                ('size', models.BigIntegerField()),
+                ('storage_name', models.CharField(max_length=255)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'db_table': 'email_attachments',
+            },
+        ),
+        migrations.AddField(
+            model_name='emaillog',
+            name='attachments',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
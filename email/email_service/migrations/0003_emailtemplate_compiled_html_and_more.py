@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-19 09:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('email_service', '0002_emailattachment_emaillog_attachments'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='emailtemplate',
+            name='compiled_html',
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='emailtemplate',
+            name='compiled_text',
+            field=models.TextField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.7 on 2026-10-19 09:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('email_service', '0003_emailtemplate_compiled_html_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='emaillog',
+            name='click_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='emaillog',
+            name='clicked_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='emaillog',
+            name='open_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='emaillog',
+            name='opened_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
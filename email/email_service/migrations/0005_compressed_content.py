@@ -0,0 +1,60 @@
+# Generated by Django 5.2.7 on 2026-10-19 09:22
+
+import email_service.fields
+from django.db import migrations, models
+
+
+def keep_plain_column(name, field):
+    """
+    Rename a field to ``<name>_plain`` in the model state only, so it
+    keeps reading the existing column
+    """
+    return migrations.SeparateDatabaseAndState(state_operations=[
+        migrations.RenameField(model_name='emaillog', old_name=name, new_name=f'{name}_plain'),
+        migrations.AlterField(model_name='emaillog', name=f'{name}_plain', field=field),
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('email_service', '0004_emaillog_tracking'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CompressionDictionary',
+            fields=[
+                ('dict_id', models.PositiveBigIntegerField(primary_key=True, serialize=False)),
+                ('template_name', models.CharField(db_index=True, max_length=100)),
+                ('data', models.BinaryField()),
+                ('sample_count', models.PositiveIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'db_table': 'email_compression_dictionaries',
+            },
+        ),
+        # The compressed content goes into new nullable columns, which
+        # PostgreSQL adds without rewriting email_logs. Existing rows
+        # stay in the old columns, read through *_plain, until the
+        # compress_email_logs task moves them over in batches.
+        keep_plain_column('body_html', models.TextField(blank=True, db_column='body_html', editable=False, null=True)),
+        keep_plain_column('body_text', models.TextField(blank=True, db_column='body_text', editable=False, null=True)),
+        keep_plain_column('template_data', models.JSONField(blank=True, db_column='template_data', editable=False, null=True)),
+        migrations.AddField(
+            model_name='emaillog',
+            name='body_html',
+            field=email_service.fields.CompressedTextField(blank=True, db_column='body_html_zstd', dictionary_key='template_name', null=True, plain_field='body_html_plain'),
+        ),
+        migrations.AddField(
+            model_name='emaillog',
+            name='body_text',
+            field=email_service.fields.CompressedTextField(blank=True, db_column='body_text_zstd', dictionary_key='template_name', null=True, plain_field='body_text_plain'),
+        ),
+        migrations.AddField(
+            model_name='emaillog',
+            name='template_data',
+            field=email_service.fields.CompressedJSONField(blank=True, db_column='template_data_zstd', dictionary_key='template_name', null=True, plain_field='template_data_plain'),
+        ),
+    ]
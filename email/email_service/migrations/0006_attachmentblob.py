@@ -0,0 +1,103 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def split_blobs(apps, schema_editor):
+    """One blob per existing attachment, which until now was unique by sha256"""
+    AttachmentBlob = apps.get_model('email_service', 'AttachmentBlob')
+    EmailAttachment = apps.get_model('email_service', 'EmailAttachment')
+    db = schema_editor.connection.alias
+    for attachment in EmailAttachment.objects.using(db).iterator():
+        AttachmentBlob.objects.using(db).create(
+            sha256=attachment.sha256,
+            size=attachment.size,
+            storage_name=attachment.storage_name,
+        )
+        attachment.blob_id = attachment.sha256
+        attachment.save(using=db, update_fields=['blob'])
+
+
+def join_blobs(apps, schema_editor):
+    AttachmentBlob = apps.get_model('email_service', 'AttachmentBlob')
+    EmailAttachment = apps.get_model('email_service', 'EmailAttachment')
+    db = schema_editor.connection.alias
+    blobs = AttachmentBlob.objects.using(db).in_bulk()
+    seen = set()
+    for attachment in EmailAttachment.objects.using(db).order_by('created_at').iterator():
+        if attachment.blob_id in seen:
+            # sha256 was unique: keep only the first upload of each blob
+            attachment.delete(using=db)
+            continue
+        seen.add(attachment.blob_id)
+        blob = blobs[attachment.blob_id]
+        attachment.sha256 = blob.sha256
+        attachment.size = blob.size
+        attachment.storage_name = blob.storage_name
+        attachment.save(using=db, update_fields=['sha256', 'size', 'storage_name'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('email_service', '0005_compressed_content'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AttachmentBlob',
+            fields=[
+                ('sha256', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('size', models.BigIntegerField()),
+                ('storage_name', models.CharField(max_length=255)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'db_table': 'email_attachment_blobs',
+            },
+        ),
+        migrations.AddField(
+            model_name='emailattachment',
+            name='blob',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='uploads', to='email_service.attachmentblob'),
+        ),
+        # Uploads from before ownership was recorded belong to nobody
+        migrations.AddField(
+            model_name='emailattachment',
+            name='service_name',
+            field=models.CharField(default='', max_length=100),
+            preserve_default=False,
+        ),
+        migrations.AlterField(
+            model_name='emailattachment',
+            name='sha256',
+            field=models.CharField(max_length=64, null=True),
+        ),
+        migrations.AlterField(
+            model_name='emailattachment',
+            name='size',
+            field=models.BigIntegerField(null=True),
+        ),
+        migrations.AlterField(
+            model_name='emailattachment',
+            name='storage_name',
+            field=models.CharField(max_length=255, null=True),
+        ),
+        migrations.RunPython(split_blobs, join_blobs, hints={'model_name': 'emailattachment'}),
+        migrations.AlterField(
+            model_name='emailattachment',
+            name='blob',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='uploads', to='email_service.attachmentblob'),
+        ),
+        migrations.RemoveField(
+            model_name='emailattachment',
+            name='sha256',
+        ),
+        migrations.RemoveField(
+            model_name='emailattachment',
+            name='size',
+        ),
+        migrations.RemoveField(
+            model_name='emailattachment',
+            name='storage_name',
+        ),
+    ]
@@ -1,6 +1,8 @@
 from django.db import models
 import uuid
 
+from .fields import CompressedJSONField, CompressedTextField
+
 class EmailStatus(models.TextChoices):
     QUEUED = 'queued', 'Queued'
     SENT = 'sent', 'Sent'
@@ -19,14 +21,33 @@ class EmailLog(models.Model):
     cc = models.JSONField(blank=True, null=True)
     bcc = models.JSONField(blank=True, null=True)
     
-    # Email content
+    # Email content, zstd-compressed and decompressed on access
     subject = models.CharField(max_length=500)
-    body_html = models.TextField(blank=True, null=True)
-    body_text = models.TextField(blank=True, null=True)
+    body_html = CompressedTextField(
+        blank=True, null=True, db_column='body_html_zstd',
+        dictionary_key='template_name', plain_field='body_html_plain'
+    )
+    body_text = CompressedTextField(
+        blank=True, null=True, db_column='body_text_zstd',
+        dictionary_key='template_name', plain_field='body_text_plain'
+    )
     
     # Template info
     template_name = models.CharField(max_length=100, blank=True, null=True)
-    template_data = models.JSONField(blank=True, null=True)
+    template_data = CompressedJSONField(
+        blank=True, null=True, db_column='template_data_zstd',
+        dictionary_key='template_name', plain_field='template_data_plain'
+    )
+    
+    # Content of rows written before compression, in the original
+    # columns. compress_email_logs moves it into the fields above; the
+    # columns are dropped once it has finished on every shard.
+    body_html_plain = models.TextField(blank=True, null=True, db_column='body_html', editable=False)
+    body_text_plain = models.TextField(blank=True, null=True, db_column='body_text', editable=False)
+    template_data_plain = models.JSONField(blank=True, null=True, db_column='template_data', editable=False)
+    
+    # EmailAttachment ids, content stays in blob storage
+    attachments = models.JSONField(blank=True, null=True)
     
     # Metadata
     service_name = models.CharField(max_length=100)
@@ -48,6 +69,12 @@ class EmailLog(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     sent_at = models.DateTimeField(blank=True, null=True)
     failed_at = models.DateTimeField(blank=True, null=True)
+    opened_at = models.DateTimeField(blank=True, null=True)
+    clicked_at = models.DateTimeField(blank=True, null=True)
+    
+    # Engagement, applied in batches from the tracking stream
+    open_count = models.PositiveIntegerField(default=0)
+    click_count = models.PositiveIntegerField(default=0)
     
     # Error handling
     error_message = models.TextField(blank=True, null=True)
@@ -74,6 +101,11 @@ class EmailTemplate(models.Model):
     html_content = models.TextField()
     text_content = models.TextField(blank=True, null=True)
     
+    # Precomputed at save time: CSS inlined + minified HTML, and
+    # text_content or a plaintext version generated from the HTML
+    compiled_html = models.TextField(blank=True, null=True)
+    compiled_text = models.TextField(blank=True, null=True)
+    
     # Metadata
     description = models.TextField(blank=True, null=True)
     is_active = models.BooleanField(default=True)
@@ -89,3 +121,70 @@ class EmailTemplate(models.Model):
     def __str__(self):
         return self.name
 
+
+class AttachmentBlob(models.Model):
+    """Attachment content, stored once per unique sha256"""
+    sha256 = models.CharField(max_length=64, primary_key=True)
+    size = models.BigIntegerField()
+    
+    # Name of the blob in the "attachments" storage
+    storage_name = models.CharField(max_length=255)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        db_table = 'email_attachment_blobs'
+    
+    def __str__(self):
+        return f"{self.sha256[:12]} ({self.size} bytes)"
+
+
+class EmailAttachment(models.Model):
+    """One upload: its own name, type and owner over a shared blob"""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    
+    blob = models.ForeignKey(
+        AttachmentBlob, on_delete=models.PROTECT, related_name='uploads'
+    )
+    filename = models.CharField(max_length=255)
+    content_type = models.CharField(max_length=255)
+    # Service identity of the API key that uploaded it; only it may send it
+    service_name = models.CharField(max_length=100)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        db_table = 'email_attachments'
+    
+    def __str__(self):
+        return f"{self.filename} ({self.blob_id[:12]})"
+    
+    @property
+    def sha256(self):
+        return self.blob_id
+    
+    @property
+    def size(self):
+        return self.blob.size
+    
+    @property
+    def storage_name(self):
+        return self.blob.storage_name
+
+
+class CompressionDictionary(models.Model):
+    """zstd dictionary trained on one template's emails"""
+    # The id zstd writes into every frame compressed with it
+    dict_id = models.PositiveBigIntegerField(primary_key=True)
+    
+    template_name = models.CharField(max_length=100, db_index=True)
+    data = models.BinaryField()
+    sample_count = models.PositiveIntegerField()
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        db_table = 'email_compression_dictionaries'
+    
+    def __str__(self):
+        return f"{self.template_name} ({self.dict_id})"
@@ -0,0 +1,167 @@
+import logging
+import math
+import threading
+import time
+
+import redis
+
+logger = logging.getLogger(__name__)
+
+
+class _Window:
+    """Counters for one service in the current and previous window"""
+    __slots__ = ('index', 'current', 'previous', 'pending', 'active')
+
+    def __init__(self, index):
+        self.index = index
+        self.current = 0
+        self.previous = 0
+        self.pending = 0
+        self.active = False
+
+
+class SlidingWindowQuota:
+    """
+    Sliding-window request quota per service.
+
+    Every hit is decided from in-process counters (a lock and a few float
+    ops), using the usual two-bucket approximation of a sliding window:
+    ``previous * (1 - elapsed_fraction) + current``. A background thread
+    pushes local hits to Redis every ``sync_interval`` and reads the
+    cluster-wide totals back in the same pipeline, one round trip for all
+    services, so all processes converge on the shared count and requests
+    never wait on Redis. If Redis is unreachable the quota keeps working
+    per process.
+    """
+
+    def __init__(self, window_seconds, sync_interval, redis_url,
+                 key_prefix='email:quota'):
+        self.window = window_seconds
+        self.sync_interval = sync_interval
+        self.redis_url = redis_url
+        self.key_prefix = key_prefix
+        self._lock = threading.Lock()
+        self._windows = {}
+        # (service, index, delta) for windows that rolled before a sync
+        self._leftovers = []
+        self._redis = None
+        self._thread = None
+
+    def hit(self, service, limit):
+        """
+        Count one request for ``service``.
+
+        Returns ``(allowed, retry_after_seconds)``.
+        """
+        if self._thread is None:
+            self._ensure_started()
+        now = time.time()
+        index = int(now // self.window)
+
+        with self._lock:
+            state = self._windows.get(service)
+            if state is None:
+                state = self._windows[service] = _Window(index)
+            if state.index != index:
+                if state.pending:
+                    self._leftovers.append((service, state.index, state.pending))
+                state.previous = state.current if index == state.index + 1 else 0
+                state.current = 0
+                state.pending = 0
+                state.index = index
+
+            elapsed = (now - index * self.window) / self.window
+            estimate = state.previous * (1 - elapsed) + state.current
+            allowed = estimate < limit
+            if allowed:
+                state.current += 1
+                state.pending += 1
+            state.active = True
+
+        if allowed:
+            return True, 0
+        return False, self._retry_after(state, limit, elapsed)
+
+    def _retry_after(self, state, limit, elapsed):
+        """Seconds until the sliding estimate drops below ``limit``"""
+        if state.current >= limit:
+            # Wait for the next window, then for this window's weight to
+            # decay enough.
+            wait = (1 - elapsed) + (1 - limit / state.current)
+        elif state.previous:
+            wait = (1 - (limit - state.current) / state.previous) - elapsed
+        else:
+            wait = 1 - elapsed
+        return max(1, math.ceil(wait * self.window))
+
+    def _key(self, service, index):
+        return f'{self.key_prefix}:{service}:{index}'
+
+    def _client(self):
+        if self._redis is None:
+            self._redis = redis.Redis.from_url(
+                self.redis_url,
+                socket_timeout=1.0,
+                socket_connect_timeout=1.0,
+            )
+        return self._redis
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name='quota-sync', daemon=True
+                )
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.sync_interval)
+            self.sync()
+
+    def sync(self):
+        """
+        Push pending hits to Redis and read the shared totals back for
+        every service hit since the last sync.
+        """
+        with self._lock:
+            leftovers, self._leftovers = self._leftovers, []
+            due = []
+            for service, state in self._windows.items():
+                if state.active:
+                    due.append((service, state, state.index, state.pending))
+                    state.pending = 0
+                    state.active = False
+        if not leftovers and not due:
+            return
+
+        try:
+            pipe = self._client().pipeline(transaction=False)
+            for service, index, delta in leftovers:
+                pipe.incrby(self._key(service, index), delta)
+                pipe.expire(self._key(service, index), self.window * 2)
+            for service, _, index, delta in due:
+                pipe.incrby(self._key(service, index), delta)
+                pipe.expire(self._key(service, index), self.window * 2)
+                pipe.get(self._key(service, index - 1))
+            results = pipe.execute()[2 * len(leftovers):]
+        except redis.RedisError as e:
+            logger.warning("Quota sync failed: %s", e)
+            with self._lock:
+                # Retried on the next sync
+                self._leftovers[:0] = leftovers
+                for service, state, index, delta in due:
+                    if state.index == index:
+                        state.pending += delta
+                    elif delta:
+                        self._leftovers.append((service, index, delta))
+                    state.active = True
+            return
+
+        with self._lock:
+            for i, (service, state, index, delta) in enumerate(due):
+                current, _, previous = results[3 * i:3 * i + 3]
+                if state.index == index:
+                    # Hits counted while the pipeline was in flight stay pending
+                    state.current = int(current) + state.pending
+                    state.previous = int(previous or 0)
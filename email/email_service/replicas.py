@@ -0,0 +1,144 @@
+"""
+Read replica selection.
+
+Replication lag is sampled in a background thread. Reads go to a
+replica only while its lag is under DB_REPLICA_MAX_LAG_SECONDS, and a
+caller's reads stay on the primary for READ_YOUR_WRITES_SECONDS after
+one of its own writes.
+"""
+import itertools
+import logging
+import threading
+import time
+
+import redis
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+STICKY_KEY = 'email:rw:{service}'
+
+_LAG_SQL = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+    END
+"""
+
+_redis = None
+
+
+def _client():
+    global _redis
+    if _redis is None:
+        _redis = redis.Redis.from_url(
+            settings.REDIS_URL, socket_timeout=0.1, socket_connect_timeout=0.1
+        )
+    return _redis
+
+
+def mark_write(service):
+    """Pin the service's reads to the primary for the stickiness window"""
+    if not service or not settings.DB_REPLICAS:
+        return
+    try:
+        _client().set(
+            STICKY_KEY.format(service=service), 1,
+            ex=settings.READ_YOUR_WRITES_SECONDS
+        )
+    except redis.RedisError as e:
+        logger.warning("Could not mark write for %s: %s", service, e)
+
+
+def is_sticky(service):
+    """Whether the service wrote recently; assumes so if Redis is down"""
+    if not service:
+        return False
+    try:
+        return bool(_client().exists(STICKY_KEY.format(service=service)))
+    except redis.RedisError:
+        return True
+
+
+class ReplicaMonitor:
+    """Keeps the replication lag of every replica refreshed in a thread"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._lags = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._next = itertools.count()
+
+    def lags(self):
+        """Seconds behind the primary per replica, None if unreachable"""
+        self._ensure_started()
+        return dict(self._lags)
+
+    def healthy(self):
+        self._ensure_started()
+        max_lag = settings.DB_REPLICA_MAX_LAG_SECONDS
+        return [
+            alias for alias in settings.DB_REPLICAS
+            if self._lags.get(alias) is not None and self._lags[alias] <= max_lag
+        ]
+
+    def pick(self):
+        """A replica within the lag threshold (round robin), or None"""
+        candidates = self.healthy()
+        if not candidates:
+            return None
+        return candidates[next(self._next) % len(candidates)]
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name='replica-monitor', daemon=True
+                )
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            for alias in settings.DB_REPLICAS:
+                self._lags[alias] = self._measure(alias)
+            time.sleep(self.interval)
+
+    def _measure(self, alias):
+        conn = connections[alias]
+        try:
+            conn.close_if_unusable_or_obsolete()
+            if conn.vendor != 'postgresql':
+                conn.ensure_connection()
+                return 0.0
+            with conn.cursor() as cursor:
+                cursor.execute(_LAG_SQL)
+                lag = cursor.fetchone()[0]
+            # No transaction replayed yet: lag is unknown
+            return float(lag) if lag is not None else None
+        except Exception as e:
+            logger.warning("Replica %s lag check failed: %s", alias, e)
+            conn.close()
+            return None
+
+
+lag_monitor = ReplicaMonitor(interval=settings.DB_REPLICA_LAG_CHECK_SECONDS)
+
+
+def read_db(alias='default', service=None):
+    """
+    Alias to read ``alias``'s data from on behalf of ``service``.
+
+    Only the default database has replicas. Falls back to the primary
+    when every replica lags or the service wrote recently.
+    """
+    if alias != 'default' or not settings.DB_REPLICAS:
+        return alias
+    replica = lag_monitor.pick()
+    if replica is None or is_sticky(service):
+        return alias
+    return replica
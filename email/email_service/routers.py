@@ -0,0 +1,118 @@
+"""
+EmailLog sharding and replica routing.
+
+Rows of email_logs live on one of settings.EMAIL_LOG_SHARDS, chosen
+from the row's shard key: service_name through EMAIL_LOG_SHARD_ROUTES,
+or a stable hash of user_id. Every other model stays on the default
+database. Read replicas (settings.DB_REPLICAS) mirror default and are
+picked per read by ``replicas.read_db``.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from django.conf import settings
+from django.db import connections
+import threading
+import zlib
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def email_log_shards():
+    return list(settings.EMAIL_LOG_SHARDS)
+
+
+def shard_for(service_name=None, user_id=None):
+    """Database alias holding the EmailLog rows for a shard key"""
+    shards = settings.EMAIL_LOG_SHARDS
+    if settings.EMAIL_LOG_SHARD_KEY == 'user_id':
+        if not user_id:
+            return shards[0]
+        return shards[zlib.crc32(str(user_id).encode()) % len(shards)]
+    return settings.EMAIL_LOG_SHARD_ROUTES.get(service_name, shards[0])
+
+
+def shards_for(service_name=None, user_id=None):
+    """Shards a query has to visit: one if the shard key is known, else all"""
+    if settings.EMAIL_LOG_SHARD_KEY == 'user_id':
+        key = user_id
+    else:
+        key = service_name
+    if key:
+        return [shard_for(service_name, user_id)]
+    return email_log_shards()
+
+
+def _run_on(fn, alias):
+    try:
+        return fn(alias)
+    finally:
+        # Hand the pooled connection back; the thread is reused
+        connections[alias].close()
+
+
+def fan_out(fn, aliases):
+    """Call fn(alias) for every alias in parallel, results in alias order"""
+    global _executor
+    if len(aliases) == 1:
+        return [fn(aliases[0])]
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=len(settings.EMAIL_LOG_SHARDS) * 4,
+                    thread_name_prefix='email-shard'
+                )
+    return list(_executor.map(partial(_run_on, fn), aliases))
+
+
+def _is_email_log(app_label, model_name):
+    return app_label == 'email_service' and model_name == 'emaillog'
+
+
+class EmailLogShardRouter:
+    """
+    Route EmailLog instances to their shard and keep the email_logs
+    table off databases that aren't shards (and everything else off
+    the shards).
+
+    Queries without an instance can't be routed here; callers pick the
+    shard with ``.using(shard_for(...))``.
+    """
+
+    def _db_for_instance(self, model, hints):
+        if not _is_email_log(model._meta.app_label, model._meta.model_name):
+            return None
+        instance = hints.get('instance')
+        if instance is None:
+            return None
+        return instance._state.db or shard_for(instance.service_name, instance.user_id)
+
+    def db_for_read(self, model, **hints):
+        return self._db_for_instance(model, hints)
+
+    def db_for_write(self, model, **hints):
+        return self._db_for_instance(model, hints)
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        shards = settings.EMAIL_LOG_SHARDS
+        if _is_email_log(app_label, model_name):
+            return db in shards
+        if db != 'default' and db in shards:
+            return False
+        return None
+
+
+class ReplicaRouter:
+    """Replicas mirror the default database: never migrate them"""
+
+    def allow_relation(self, obj1, obj2, **hints):
+        group = {'default', *settings.DB_REPLICAS}
+        if obj1._state.db in group and obj2._state.db in group:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in settings.DB_REPLICAS:
+            return False
+        return None
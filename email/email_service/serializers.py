@@ -1,5 +1,7 @@
 from rest_framework import serializers
-from .models import EmailLog, EmailTemplate
+from django.conf import settings
+from .compiler import compile_template
+from .models import EmailAttachment, EmailLog, EmailTemplate
 
 class SendEmailSerializer(serializers.Serializer):
     """Serializer for sending emails"""
@@ -22,6 +24,13 @@ class SendEmailSerializer(serializers.Serializer):
         allow_null=True,
         allow_empty=True
     )
+    attachments = serializers.ListField(
+        child=serializers.UUIDField(),
+        required=False,
+        allow_null=True,
+        allow_empty=True,
+        max_length=settings.ATTACHMENT_MAX_COUNT
+    )
     service_name = serializers.CharField(max_length=100)
     user_id = serializers.CharField(max_length=100, required=False, allow_blank=True, allow_null=True)
     send_async = serializers.BooleanField(default=True)
@@ -41,6 +50,10 @@ class SendEmailSerializer(serializers.Serializer):
 
 class EmailLogSerializer(serializers.ModelSerializer):
     """Serializer for EmailLog model"""
+    # Compressed columns; reading them decompresses
+    body_html = serializers.CharField(read_only=True, allow_null=True)
+    body_text = serializers.CharField(read_only=True, allow_null=True)
+    template_data = serializers.JSONField(read_only=True, allow_null=True)
     
     class Meta:
         model = EmailLog
@@ -55,6 +68,7 @@ class EmailLogSerializer(serializers.ModelSerializer):
             'body_text',
             'template_name',
             'template_data',
+            'attachments',
             'service_name',
             'user_id',
             'provider',
@@ -64,6 +78,10 @@ class EmailLogSerializer(serializers.ModelSerializer):
             'updated_at',
             'sent_at',
             'failed_at',
+            'opened_at',
+            'clicked_at',
+            'open_count',
+            'click_count',
             'error_message',
             'retry_count'
         ]
@@ -98,6 +116,23 @@ class EmailLogListSerializer(serializers.ModelSerializer):
         read_only_fields = fields
 
 
+class EmailAttachmentSerializer(serializers.ModelSerializer):
+    """Serializer for uploaded attachments"""
+    
+    class Meta:
+        model = EmailAttachment
+        fields = [
+            'id',
+            'filename',
+            'content_type',
+            'size',
+            'sha256',
+            'service_name',
+            'created_at'
+        ]
+        read_only_fields = fields
+
+
 class EmailTemplateSerializer(serializers.ModelSerializer):
     """Serializer for EmailTemplate model"""
     
@@ -116,6 +151,25 @@ class EmailTemplateSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ['id', 'created_at', 'updated_at']
     
+    def create(self, validated_data):
+        validated_data.update(self._compiled(validated_data))
+        return super().create(validated_data)
+    
+    def update(self, instance, validated_data):
+        if 'html_content' in validated_data or 'text_content' in validated_data:
+            validated_data.update(self._compiled({
+                'html_content': validated_data.get('html_content', instance.html_content),
+                'text_content': validated_data.get('text_content', instance.text_content),
+            }))
+        return super().update(instance, validated_data)
+    
+    def _compiled(self, data):
+        """Inline CSS, minify and derive plaintext once, at save time"""
+        compiled_html, compiled_text = compile_template(
+            data['html_content'], data.get('text_content')
+        )
+        return {'compiled_html': compiled_html, 'compiled_text': compiled_text}
+    
     def validate_name(self, value):
         """Ensure template name is unique (case-insensitive)"""
         if self.instance:
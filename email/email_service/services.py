@@ -1,9 +1,27 @@
 from django.core.mail import EmailMultiAlternatives
 from django.template.loader import render_to_string
 from django.conf import settings
+from core.logging import log_context
+from .attachments import (
+    iter_mime,
+    load_attachments,
+    send_sendgrid_streamed,
+    send_smtp_streamed,
+)
+from .health import record_send
+from .metrics import (
+    EMAILS,
+    LOG_WRITE_SECONDS,
+    PROVIDER_REQUEST_SECONDS,
+    TEMPLATE_RENDER_SECONDS,
+)
 from .models import EmailLog, EmailStatus, EmailTemplate
+from .routers import shard_for
+from .tracking import add_tracking
 from datetime import datetime
 import logging
+import time
+import uuid
 
 logger = logging.getLogger(__name__)
 
@@ -21,20 +39,30 @@ class EmailService:
         bcc: list = None,
         service_name: str = "unknown",
         user_id: str = None,
-        to_name: str = None
+        to_name: str = None,
+        attachments: list = None
     ):
-        """Send email using configured provider"""
+        """
+        Send email using configured provider
+        
+        ``attachments`` is a list of EmailAttachment ids; their blobs are
+        streamed from storage at send time.
+        """
+        attachment_rows = load_attachments(attachments)
         
         # Render template if provided
         if template_name:
             if template_data is None:
                 template_data = {}
+            render_started = time.perf_counter()
             try:
                 # Try to get from database first
                 try:
                     template_obj = EmailTemplate.objects.get(name=template_name, is_active=True)
-                    body_html = template_obj.html_content
-                    body_text = template_obj.text_content
+                    # Compiled at save time; templates saved before
+                    # compilation existed fall back to the raw content
+                    body_html = template_obj.compiled_html or template_obj.html_content
+                    body_text = template_obj.compiled_text or template_obj.text_content
                     
                     # Replace variables in template
                     for key, value in template_data.items():
@@ -52,11 +80,20 @@ class EmailService:
                     body_html = render_to_string(f'emails/{template_name}.html', template_data)
                     
             except Exception as e:
-                logger.error(f"Template rendering failed: {str(e)}")
+                logger.error("Template rendering failed: %s", e)
                 raise
+            TEMPLATE_RENDER_SECONDS.observe(time.perf_counter() - render_started)
+        
+        # The id is known up front so tracking links can reference it
+        email_id = uuid.uuid4()
+        shard = shard_for(service_name, user_id)
+        if body_html and settings.TRACKING_BASE_URL:
+            body_html = add_tracking(body_html, email_id, shard)
         
         # Create email log
-        email_log = EmailLog.objects.create(
+        write_started = time.perf_counter()
+        email_log = EmailLog.objects.using(shard).create(
+            id=email_id,
             to_email=to_email,
             to_name=to_name,
             subject=subject,
@@ -64,6 +101,7 @@ class EmailService:
             body_text=body_text,
             template_name=template_name,
             template_data=template_data,
+            attachments=[str(a.id) for a in attachment_rows] or None,
             cc=cc,
             bcc=bcc,
             service_name=service_name,
@@ -71,53 +109,81 @@ class EmailService:
             provider=settings.EMAIL_PROVIDER,
             status=EmailStatus.QUEUED
         )
+        LOG_WRITE_SECONDS.labels('create').observe(time.perf_counter() - write_started)
         
-        try:
+        with log_context(email_id=email_log.id):
             # Route to appropriate provider
             provider = settings.EMAIL_PROVIDER.lower()
+            started = time.perf_counter()
             
-            if provider == 'sendgrid':
-                message_id = EmailService._send_sendgrid(
-                    to_email, subject, body_html, body_text, cc, bcc, to_name
-                )
-            elif provider == 'ses':
-                message_id = EmailService._send_ses(
-                    to_email, subject, body_html, body_text, cc, bcc, to_name
-                )
-            elif provider == 'smtp':
-                message_id = EmailService._send_smtp(
-                    to_email, subject, body_html, body_text, cc, bcc, to_name
+            try:
+                if provider == 'sendgrid':
+                    message_id = EmailService._send_sendgrid(
+                        to_email, subject, body_html, body_text, cc, bcc, to_name,
+                        attachment_rows
+                    )
+                elif provider == 'ses':
+                    message_id = EmailService._send_ses(
+                        to_email, subject, body_html, body_text, cc, bcc, to_name,
+                        attachment_rows
+                    )
+                elif provider == 'smtp':
+                    message_id = EmailService._send_smtp(
+                        to_email, subject, body_html, body_text, cc, bcc, to_name,
+                        attachment_rows
+                    )
+                else:
+                    raise ValueError(f"Unsupported email provider: {provider}")
+                
+                elapsed = time.perf_counter() - started
+                record_send(provider, True, elapsed)
+                PROVIDER_REQUEST_SECONDS.labels(provider, 'success').observe(elapsed)
+                
+                # Update log
+                email_log.status = EmailStatus.SENT
+                email_log.sent_at = datetime.now()
+                email_log.provider_message_id = message_id
+                write_started = time.perf_counter()
+                # Only the status columns: content was compressed on create
+                email_log.save(update_fields=[
+                    'status', 'sent_at', 'provider_message_id', 'updated_at'
+                ])
+                LOG_WRITE_SECONDS.labels('update').observe(time.perf_counter() - write_started)
+                EMAILS.labels(service_name, EmailStatus.SENT).inc()
+                
+                logger.info(
+                    "Email sent successfully to %s via %s", to_email, provider,
+                    extra={"sampled": True}
                 )
-            else:
-                raise ValueError(f"Unsupported email provider: {provider}")
-            
-            # Update log
-            email_log.status = EmailStatus.SENT
-            email_log.sent_at = datetime.now()
-            email_log.provider_message_id = message_id
-            email_log.save()
-            
-            logger.info(f"Email sent successfully to {to_email} via {provider}")
-            
-            return {
-                "success": True,
-                "email_id": str(email_log.id),
-                "message_id": message_id
-            }
-            
-        except Exception as e:
-            email_log.status = EmailStatus.FAILED
-            email_log.failed_at = datetime.now()
-            email_log.error_message = str(e)
-            email_log.retry_count += 1
-            email_log.save()
-            
-            logger.error(f"Email send failed to {to_email}: {str(e)}")
-            raise e
+                
+                return {
+                    "success": True,
+                    "email_id": str(email_log.id),
+                    "message_id": message_id
+                }
+                
+            except Exception as e:
+                elapsed = time.perf_counter() - started
+                record_send(provider, False, elapsed)
+                PROVIDER_REQUEST_SECONDS.labels(provider, 'failure').observe(elapsed)
+                
+                email_log.status = EmailStatus.FAILED
+                email_log.failed_at = datetime.now()
+                email_log.error_message = str(e)
+                email_log.retry_count += 1
+                write_started = time.perf_counter()
+                email_log.save(update_fields=[
+                    'status', 'failed_at', 'error_message', 'retry_count', 'updated_at'
+                ])
+                LOG_WRITE_SECONDS.labels('update').observe(time.perf_counter() - write_started)
+                EMAILS.labels(service_name, EmailStatus.FAILED).inc()
+                
+                logger.error("Email send failed to %s: %s", to_email, e)
+                raise e
     
     @staticmethod
-    def _send_smtp(to_email, subject, body_html, body_text, cc, bcc, to_name):
-        """Send via SMTP (Django default)"""
+    def _build_message(to_email, subject, body_html, body_text, cc, bcc, to_name):
+        """Build the Django message used by the SMTP and raw SES paths"""
         from_email = f"{settings.DEFAULT_FROM_NAME} <{settings.DEFAULT_FROM_EMAIL}>"
         to = [f"{to_name} <{to_email}>" if to_name else to_email]
         
@@ -132,17 +198,39 @@ class EmailService:
         
         if body_html:
             email.attach_alternative(body_html, "text/html")
+        return email
+    
+    @staticmethod
+    def _send_smtp(to_email, subject, body_html, body_text, cc, bcc, to_name,
+                   attachments=None):
+        """Send via SMTP (Django default)"""
+        email = EmailService._build_message(
+            to_email, subject, body_html, body_text, cc, bcc, to_name
+        )
+        
+        if attachments:
+            return send_smtp_streamed(email, attachments)
         
         email.send()
         return f"smtp-{to_email}-{datetime.now().timestamp()}"
     
     @staticmethod
-    def _send_sendgrid(to_email, subject, body_html, body_text, cc, bcc, to_name):
+    def _send_sendgrid(to_email, subject, body_html, body_text, cc, bcc, to_name,
+                       attachments=None):
         """Send via SendGrid API"""
+        if attachments:
+            return EmailService._send_sendgrid_streamed(
+                to_email, subject, body_html, body_text, cc, bcc, to_name,
+                attachments
+            )
+        
         from sendgrid import SendGridAPIClient
         from sendgrid.helpers.mail import Mail, Email, To, Content, Cc, Bcc
         
-        sg = SendGridAPIClient(api_key=settings.SENDGRID_API_KEY)
+        sg = SendGridAPIClient(
+            api_key=settings.SENDGRID_API_KEY,
+            host=settings.SENDGRID_API_HOST
+        )
         
         from_email = Email(settings.DEFAULT_FROM_EMAIL, settings.DEFAULT_FROM_NAME)
         to_email_obj = To(to_email, to_name)
@@ -182,7 +270,39 @@ class EmailService:
         return message_id
     
     @staticmethod
-    def _send_ses(to_email, subject, body_html, body_text, cc, bcc, to_name):
+    def _send_sendgrid_streamed(to_email, subject, body_html, body_text, cc, bcc,
+                                to_name, attachments):
+        """Send via SendGrid with attachment contents streamed into the request"""
+        to = {"email": to_email}
+        if to_name:
+            to["name"] = to_name
+        personalization = {"to": [to]}
+        if cc:
+            personalization["cc"] = [{"email": address} for address in cc]
+        if bcc:
+            personalization["bcc"] = [{"email": address} for address in bcc]
+        
+        content = []
+        if body_text:
+            content.append({"type": "text/plain", "value": body_text})
+        if body_html:
+            content.append({"type": "text/html", "value": body_html})
+        
+        payload = {
+            "personalizations": [personalization],
+            "from": {
+                "email": settings.DEFAULT_FROM_EMAIL,
+                "name": settings.DEFAULT_FROM_NAME
+            },
+            "subject": subject,
+            "content": content
+        }
+        message_id = send_sendgrid_streamed(payload, attachments)
+        return message_id or f"sendgrid-{datetime.now().timestamp()}"
+    
+    @staticmethod
+    def _send_ses(to_email, subject, body_html, body_text, cc, bcc, to_name,
+                  attachments=None):
         """Send via AWS SES"""
         import boto3
         from botocore.exceptions import ClientError
@@ -191,10 +311,28 @@ class EmailService:
         ses_client = boto3.client(
             'ses',
             region_name=settings.AWS_SES_REGION,
+            endpoint_url=settings.AWS_SES_ENDPOINT_URL,
             aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
             aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY
         )
         
+        if attachments:
+            # SendRawEmail takes the message as one blob (SES caps it at
+            # 40 MB), so this path assembles it from the streamed parts
+            email = EmailService._build_message(
+                to_email, subject, body_html, body_text, cc, bcc, to_name
+            )
+            try:
+                response = ses_client.send_raw_email(
+                    Source=email.from_email,
+                    Destinations=email.recipients(),
+                    RawMessage={'Data': b''.join(iter_mime(email, attachments))}
+                )
+                return response['MessageId']
+            except ClientError as e:
+                logger.error("SES error: %s", e.response['Error']['Message'])
+                raise Exception(f"SES error: {e.response['Error']['Message']}")
+        
         # Prepare destination
         destination = {
             'ToAddresses': [to_email]
@@ -239,6 +377,6 @@ class EmailService:
             return response['MessageId']
             
         except ClientError as e:
-            logger.error(f"SES error: {e.response['Error']['Message']}")
+            logger.error("SES error: %s", e.response['Error']['Message'])
             raise Exception(f"SES error: {e.response['Error']['Message']}")
 
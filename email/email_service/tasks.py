@@ -1,9 +1,22 @@
 from celery import shared_task
+from celery.signals import before_task_publish
 from datetime import datetime, timedelta
 import logging
+import time
+
+from core.logging import log_context
+from .metrics import TASK_RETRIES
 
 logger = logging.getLogger(__name__)
 
+
+@before_task_publish.connect
+def stamp_enqueue_time(headers=None, **kwargs):
+    """Record publish time so queue age can be read off the broker"""
+    if headers is not None:
+        headers.setdefault('enqueued_at', time.time())
+
+
 @shared_task(bind=True, max_retries=3)
 def send_email_task(self, **kwargs):
     """
@@ -18,39 +31,50 @@ def send_email_task(self, **kwargs):
     # Import here to avoid circular imports
     from .services import EmailService
     
-    try:
-        logger.info(f"Processing email task to {kwargs.get('to_email')}")
-        result = EmailService.send_email(**kwargs)
-        logger.info(f"Email task completed: {result}")
-        return result
-    except Exception as exc:
-        logger.error(f"Email task failed: {str(exc)}")
-        # Retry after 60 seconds, max 3 times
-        raise self.retry(exc=exc, countdown=60)
+    with log_context(task_id=self.request.id, user_id=kwargs.get('user_id')):
+        try:
+            logger.debug("Processing email task to %s", kwargs.get('to_email'))
+            result = EmailService.send_email(**kwargs)
+            logger.info("Email task completed: %s", result, extra={'sampled': True})
+            return result
+        except Exception as exc:
+            logger.error("Email task failed: %s", exc)
+            if self.request.retries < self.max_retries:
+                TASK_RETRIES.labels(kwargs.get('service_name', 'unknown')).inc()
+            # Retry after 60 seconds, max 3 times
+            raise self.retry(exc=exc, countdown=60)
 
 
 @shared_task
-def retry_failed_emails():
+def retry_failed_emails(database=None):
     """
     Retry failed emails (runs every 5 minutes via Celery Beat)
     
     This task automatically retries failed emails that:
     - Failed in the last 24 hours
     - Have been retried less than 3 times
+    
+    Without ``database`` it queues one run per EmailLog shard.
     """
     # Import here to avoid circular imports
     from .models import EmailLog, EmailStatus
+    from .routers import email_log_shards
+    
+    if database is None:
+        for alias in email_log_shards():
+            retry_failed_emails.delay(database=alias)
+        return {"shards": email_log_shards()}
     
     # Get failed emails from last 24 hours with retry_count < 3
     twenty_four_hours_ago = datetime.now() - timedelta(hours=24)
     
-    failed_emails = EmailLog.objects.filter(
+    failed_emails = EmailLog.objects.using(database).filter(
         status=EmailStatus.FAILED,
         retry_count__lt=3,
         created_at__gte=twenty_four_hours_ago
     )
     
-    logger.info(f"Found {failed_emails.count()} failed emails to retry")
+    logger.info("Found %s failed emails to retry on %s", failed_emails.count(), database)
     
     retried_count = 0
     for email_log in failed_emails:
@@ -64,15 +88,16 @@ def retry_failed_emails():
                 body_text=email_log.body_text,
                 template_name=email_log.template_name,
                 template_data=email_log.template_data,
+                attachments=email_log.attachments,
                 cc=email_log.cc,
                 bcc=email_log.bcc,
                 service_name=email_log.service_name,
                 user_id=email_log.user_id
             )
-            logger.info(f"Retrying email {email_log.id}")
+            logger.info("Retrying email %s", email_log.id)
             retried_count += 1
         except Exception as e:
-            logger.error(f"Failed to queue retry for email {email_log.id}: {str(e)}")
+            logger.error("Failed to queue retry for email %s: %s", email_log.id, e)
     
     return {
         "retried_count": retried_count,
@@ -81,24 +106,102 @@ def retry_failed_emails():
 
 
 @shared_task
-def cleanup_old_emails():
+def cleanup_old_emails(database=None):
     """
     Clean up old email logs (runs daily via Celery Beat)
     
-    Deletes email logs older than 90 days
+    Deletes email logs older than 90 days. Without ``database`` it
+    queues one run per EmailLog shard.
     """
     # Import here to avoid circular imports
     from .models import EmailLog
+    from .routers import email_log_shards
+    
+    if database is None:
+        for alias in email_log_shards():
+            cleanup_old_emails.delay(database=alias)
+        return {"shards": email_log_shards()}
     
     ninety_days_ago = datetime.now() - timedelta(days=90)
     
-    old_emails = EmailLog.objects.filter(created_at__lt=ninety_days_ago)
+    old_emails = EmailLog.objects.using(database).filter(created_at__lt=ninety_days_ago)
     count = old_emails.count()
     
     old_emails.delete()
     
-    logger.info(f"Cleaned up {count} old email logs")
+    logger.info("Cleaned up %s old email logs on %s", count, database)
     
     return {
         "deleted_count": count
     }
+
+
+@shared_task
+def apply_tracking_events():
+    """
+    Apply buffered open/click hits from the tracking stream
+    (runs every few seconds via Celery Beat)
+    """
+    # Import here to avoid circular imports
+    from .tracking import consume
+    
+    applied = consume()
+    if applied:
+        logger.info("Applied %s tracking events", applied)
+    return {"applied": applied}
+
+
+@shared_task
+def compress_email_logs(database=None, after=None):
+    """
+    Background migration: move EmailLog content stored before
+    compression from the plain columns into the compressed ones, one
+    batch per run. Each run queues the next batch until the shard is
+    done.
+    
+    Without ``database`` it queues one run per EmailLog shard.
+    """
+    # Import here to avoid circular imports
+    from .compression import compress_batch
+    from .routers import email_log_shards
+    
+    if database is None:
+        for alias in email_log_shards():
+            compress_email_logs.delay(database=alias)
+        return {"shards": email_log_shards()}
+    
+    compressed, last = compress_batch(database, after)
+    if last is not None:
+        compress_email_logs.delay(database=database, after=str(last))
+    else:
+        logger.info("Finished compressing email logs on %s", database)
+    return {"compressed": compressed, "done": last is None}
+
+
+@shared_task
+def train_compression_dictionaries(force=False):
+    """
+    Train a compression dictionary for every active template that has
+    none yet, or for all of them with ``force`` (runs daily via Celery
+    Beat)
+    """
+    # Import here to avoid circular imports
+    from .compression import train_dictionary
+    from .models import CompressionDictionary, EmailTemplate
+    
+    names = EmailTemplate.objects.filter(is_active=True).values_list('name', flat=True)
+    if not force:
+        names = names.exclude(
+            name__in=CompressionDictionary.objects.values('template_name')
+        )
+    
+    trained = []
+    for name in names:
+        dictionary = train_dictionary(name)
+        if dictionary is not None:
+            logger.info(
+                "Trained compression dictionary %s for %s from %s samples",
+                dictionary.dict_id, name, dictionary.sample_count
+            )
+            trained.append(name)
+    return {"trained": trained}
@@ -1,3 +1,1228 @@
-from django.test import TestCase
+import base64
+import email
+import email.policy
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from types import SimpleNamespace
+from unittest import skipUnless
+from unittest import mock
+from zoneinfo import ZoneInfo
 
-# Create your tests here.
+import redis
+import zstandard
+from django.conf import settings
+from django.core import mail
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.mail import EmailMessage
+from django.core.mail.backends.smtp import EmailBackend as SMTPBackend
+from django.db import connections
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.http import http_date
+from rest_framework.renderers import JSONRenderer
+
+from core.renderers import ORJSONRenderer
+from . import attachments, compression, health, quotas, replicas, routers, tracking
+from .models import AttachmentBlob, CompressionDictionary, EmailLog, EmailTemplate
+from .services import EmailService
+
+API_KEY = 'test-key'
+
+
+class FakeRedis:
+    """The string and list commands the quotas, health monitor and replicas use"""
+
+    def __init__(self):
+        self.data = {}
+        self.calls = []
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    def incrby(self, key, amount):
+        self.data[key] = int(self.data.get(key, 0)) + amount
+        return self.data[key]
+
+    def expire(self, key, seconds):
+        return key in self.data
+
+    def get(self, key):
+        value = self.data.get(key)
+        return None if value is None else str(value).encode()
+
+    def set(self, key, value, ex=None):
+        self.data[key] = value
+        return True
+
+    def exists(self, key):
+        return int(key in self.data)
+
+    def lpush(self, key, *values):
+        items = self.data.setdefault(key, [])
+        for value in values:
+            items.insert(0, value.encode() if isinstance(value, str) else value)
+        return len(items)
+
+    def ltrim(self, key, start, end):
+        self.data[key] = self.data.get(key, [])[start:end + 1]
+
+    def lrange(self, key, start, end):
+        # scan_iter hands keys back as bytes
+        items = self.data.get(key.decode() if isinstance(key, bytes) else key, [])
+        return items[start:] if end == -1 else items[start:end + 1]
+
+    def llen(self, key):
+        return len(self.data.get(key, []))
+
+    def lindex(self, key, index):
+        items = self.data.get(key, [])
+        return items[index] if -len(items) <= index < len(items) else None
+
+    def scan_iter(self, match):
+        prefix = match.rstrip('*')
+        return [key.encode() for key in self.data if key.startswith(prefix)]
+
+
+class FakePipeline:
+
+    def __init__(self, client):
+        self.client = client
+        self.commands = []
+
+    def __getattr__(self, name):
+        def queue(*args):
+            self.commands.append((name, args))
+        return queue
+
+    def execute(self):
+        self.client.calls.append(self.commands)
+        return [getattr(self.client, name)(*args) for name, args in self.commands]
+
+
+API_SETTINGS = override_settings(
+    INTERNAL_API_KEYS={'auth-service': API_KEY},
+    SERVICE_RATE_LIMITS={'auth-service': 10 ** 6},
+    RATE_LIMIT_SYNC_INTERVAL=3600,
+)
+
+
+class APIRequests:
+    """Requests signed with auth-service's key"""
+
+    def get(self, url, **headers):
+        return self.client.get(url, HTTP_X_API_KEY=API_KEY, **headers)
+
+    def post(self, url, data, **headers):
+        return self.client.post(
+            url, json.dumps(data), content_type='application/json',
+            HTTP_X_API_KEY=API_KEY, **headers
+        )
+
+
+@API_SETTINGS
+class APITestCase(APIRequests, TestCase):
+    pass
+
+
+def make_template(name, **fields):
+    return EmailTemplate.objects.create(
+        name=name,
+        subject=f'{name} subject',
+        html_content=f'<p>{name}</p>',
+        text_content=name,
+        **fields
+    )
+
+
+class TemplateListViewTests(APITestCase):
+
+    def setUp(self):
+        make_template('welcome')
+        make_template('reset')
+        make_template('retired', is_active=False)
+
+    def test_list_leaves_out_content(self):
+        response = self.get('/email/templates')
+        self.assertEqual(response.status_code, 200)
+        data = response.json()['data']
+        self.assertEqual([row['name'] for row in data], ['reset', 'welcome'])
+        self.assertNotIn('html_content', data[0])
+
+    def test_include_content_lists_bodies(self):
+        response = self.get('/email/templates?include=content')
+        self.assertEqual(response.status_code, 200)
+        data = response.json()['data']
+        self.assertEqual([row['name'] for row in data], ['reset', 'welcome'])
+        self.assertEqual(data[0]['html_content'], '<p>reset</p>')
+
+
+class TemplateConditionalGetTests(APITestCase):
+
+    def setUp(self):
+        self.welcome = make_template('welcome')
+        self.reset = make_template('reset')
+
+    def assert_not_modified(self, url, **headers):
+        response = self.get(url, **headers)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        return response
+
+    def test_list_revalidates_until_a_template_changes(self):
+        first = self.get('/email/templates')
+        self.assertEqual(first.status_code, 200)
+        etag = first['ETag']
+        self.assert_not_modified('/email/templates', HTTP_IF_NONE_MATCH=etag)
+
+        self.reset.subject = 'Reset your password'
+        self.reset.save()
+        changed = self.get('/email/templates', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed['ETag'], etag)
+        self.assert_not_modified('/email/templates', HTTP_IF_NONE_MATCH=changed['ETag'])
+
+    def test_list_etag_changes_when_a_template_is_replaced(self):
+        etag = self.get('/email/templates')['ETag']
+        # Same count and newest updated_at, different ids
+        updated_at = self.reset.updated_at
+        self.reset.delete()
+        EmailTemplate.objects.filter(pk=make_template('reset').pk).update(
+            updated_at=updated_at
+        )
+        response = self.get('/email/templates', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_list_etag_depends_on_include(self):
+        etag = self.get('/email/templates')['ETag']
+        response = self.get('/email/templates?include=content', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_list_ignores_if_modified_since(self):
+        response = self.get('/email/templates')
+        self.assertNotIn('Last-Modified', response)
+        self.welcome.delete()
+        response = self.get(
+            '/email/templates', HTTP_IF_MODIFIED_SINCE=http_date(timezone.now().timestamp())
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['data']), 1)
+
+    def test_detail_revalidates_until_the_template_changes(self):
+        url = f'/email/templates/{self.welcome.id}'
+        first = self.get(url)
+        self.assertEqual(first.status_code, 200)
+        self.assert_not_modified(url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assert_not_modified(url, HTTP_IF_MODIFIED_SINCE=first['Last-Modified'])
+
+        self.welcome.subject = 'Welcome aboard'
+        self.welcome.save()
+        changed = self.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(changed.status_code, 200)
+        self.assertEqual(changed.json()['data']['subject'], 'Welcome aboard')
+
+    def test_if_none_match_takes_precedence_over_if_modified_since(self):
+        url = f'/email/templates/{self.welcome.id}'
+        future = http_date((timezone.now() + timedelta(days=1)).timestamp())
+        self.assert_not_modified(url, HTTP_IF_MODIFIED_SINCE=future)
+        response = self.get(url, HTTP_IF_NONE_MATCH='"stale"', HTTP_IF_MODIFIED_SINCE=future)
+        self.assertEqual(response.status_code, 200)
+
+
+class ORJSONRendererTests(SimpleTestCase):
+
+    def test_renders_like_drf_json_renderer(self):
+        data = {
+            'id': uuid.UUID('6f1c2a4e-8d3b-4f7a-9c1e-2b5d8e0f3a71'),
+            'utc': datetime(2026, 1, 2, 3, 4, 5, 678901, tzinfo=ZoneInfo('UTC')),
+            'london': datetime(2026, 1, 2, 3, 4, 5, tzinfo=ZoneInfo('Europe/London')),
+            'berlin': datetime(2026, 7, 2, 3, 4, 5, 120000, tzinfo=ZoneInfo('Europe/Berlin')),
+            'naive': datetime(2026, 1, 2, 3, 4, 5),
+            'amount': Decimal('12.50'),
+            'rows': [{'price': Decimal('0.1'), 'day': date(2026, 1, 2)}],
+            'text': 'h\u00e9llo',
+        }
+        self.assertEqual(ORJSONRenderer().render(data), JSONRenderer().render(data))
+
+
+class SlidingWindowQuotaTests(SimpleTestCase):
+    window = 100
+
+    def setUp(self):
+        self.quota = quotas.SlidingWindowQuota(
+            window_seconds=self.window, sync_interval=3600, redis_url='redis://unused'
+        )
+        self.redis = self.quota._redis = FakeRedis()
+        # Window 10 starts at 1000
+        self.now = 1000.0
+        clock = SimpleNamespace(time=lambda: self.now, sleep=time.sleep)
+        patch = mock.patch.object(quotas, 'time', clock)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def hits(self, count, limit, service='auth-service'):
+        return [self.quota.hit(service, limit) for _ in range(count)]
+
+    def test_allows_up_to_the_limit_then_rejects(self):
+        self.now = 1010.0
+        self.assertEqual(self.hits(3, limit=3), [(True, 0)] * 3)
+        # Rest of this window, then all of the next: this one weighs 3/3
+        self.assertEqual(self.quota.hit('auth-service', 3), (False, 90))
+
+    def test_previous_window_weighs_by_remaining_overlap(self):
+        self.hits(4, limit=4)
+        self.now = 1110.0
+        # 4 * 0.9 + 0 < 4, then 4 * 0.9 + 1 >= 4
+        self.assertEqual(self.quota.hit('auth-service', 4), (True, 0))
+        allowed, retry_after = self.quota.hit('auth-service', 4)
+        self.assertFalse(allowed)
+        # Until 4 * (1 - elapsed) + 1 < 4, i.e. elapsed > 0.25
+        self.assertEqual(retry_after, 15)
+
+    def test_skipped_window_forgets_the_previous_count(self):
+        self.hits(4, limit=4)
+        self.now = 1210.0
+        self.assertEqual(self.hits(4, limit=4), [(True, 0)] * 4)
+
+    def test_services_are_counted_separately(self):
+        self.hits(2, limit=2)
+        self.assertEqual(self.quota.hit('project-service', 2), (True, 0))
+        self.assertFalse(self.quota.hit('auth-service', 2)[0])
+
+    def test_hits_never_wait_on_redis(self):
+        self.hits(50, limit=100)
+        self.assertEqual(self.redis.calls, [])
+
+    def test_sync_merges_other_processes_hits(self):
+        self.redis.data[self.quota._key('auth-service', 9)] = 40
+        self.redis.data[self.quota._key('auth-service', 10)] = 5
+        self.hits(2, limit=100)
+
+        self.quota.sync()
+        self.assertEqual(self.redis.data[self.quota._key('auth-service', 10)], 7)
+        state = self.quota._windows['auth-service']
+        self.assertEqual((state.current, state.previous, state.pending), (7, 40, 0))
+
+        # All services go out in one pipeline, idle ones are skipped
+        self.hits(1, limit=100, service='project-service')
+        self.quota.sync()
+        self.quota.sync()
+        self.assertEqual(len(self.redis.calls), 2)
+        self.assertEqual(
+            {args[0] for _, args in self.redis.calls[1]},
+            {self.quota._key('project-service', 10), self.quota._key('project-service', 9)}
+        )
+
+    def test_sync_pushes_hits_left_in_a_rolled_window(self):
+        self.hits(3, limit=100)
+        self.now = 1110.0
+        self.hits(1, limit=100)
+        self.quota.sync()
+        self.assertEqual(self.redis.data[self.quota._key('auth-service', 10)], 3)
+        self.assertEqual(self.redis.data[self.quota._key('auth-service', 11)], 1)
+        self.assertEqual(self.quota._windows['auth-service'].previous, 3)
+
+    def test_failed_sync_keeps_hits_pending(self):
+        self.hits(3, limit=100)
+        with mock.patch.object(self.redis, 'pipeline', side_effect=redis.ConnectionError):
+            self.quota.sync()
+        self.assertEqual(self.quota._windows['auth-service'].pending, 3)
+        self.quota.sync()
+        self.assertEqual(self.redis.data[self.quota._key('auth-service', 10)], 3)
+
+
+@override_settings(
+    INTERNAL_API_KEYS={'auth-service': API_KEY, 'billing-service': 'billing-key'},
+    INTERNAL_API_KEY='shared-key',
+    SERVICE_RATE_LIMITS={'auth-service': 1},
+    RATE_LIMIT_SYNC_INTERVAL=3600,
+)
+class InternalAPIKeyMiddlewareTests(TestCase):
+
+    def post(self, url, api_key=API_KEY):
+        return self.client.post(url, HTTP_X_API_KEY=api_key)
+
+    def test_keys_resolve_to_their_service(self):
+        response = self.client.get('/email/templates', HTTP_X_API_KEY=API_KEY)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.wsgi_request.internal_service, 'auth-service')
+        response = self.client.get('/email/templates', HTTP_X_API_KEY='shared-key')
+        self.assertEqual(response.wsgi_request.internal_service, '*')
+
+    def test_unknown_keys_are_rejected(self):
+        self.assertEqual(self.client.get('/email/templates').status_code, 401)
+        for api_key in ('wrong-key', 'billing-key'):
+            response = self.client.get('/email/templates', HTTP_X_API_KEY=api_key)
+            # billing-service isn't in ALLOWED_SERVICES
+            self.assertEqual(response.status_code, 401)
+
+    def test_reads_are_not_rate_limited(self):
+        for _ in range(3):
+            response = self.client.get('/email/templates', HTTP_X_API_KEY=API_KEY)
+            self.assertEqual(response.status_code, 200)
+
+    def test_uploads_are_rate_limited_per_service(self):
+        # No file: a 400, but it still counts
+        self.assertEqual(self.post('/email/attachments').status_code, 400)
+        response = self.post('/email/attachments')
+        self.assertEqual(response.status_code, 429)
+        self.assertGreater(int(response['Retry-After']), 0)
+        self.assertEqual(self.post('/email/send').status_code, 429)
+        # The shared key is its own service with the default limit
+        self.assertEqual(self.post('/email/attachments', 'shared-key').status_code, 400)
+
+
+def broker_message(enqueued_at=None):
+    """A kombu message body as the Redis transport stores it"""
+    headers = {'task': 'email_service.tasks.send_email_task'}
+    if enqueued_at is not None:
+        headers['enqueued_at'] = enqueued_at
+    return json.dumps({'body': '', 'headers': headers, 'properties': {}})
+
+
+@override_settings(
+    CELERY_BROKER_URL='redis://broker:6379/0',
+    HEALTH_QUEUES=['celery', 'priority'],
+    HEALTH_STATS_WINDOW_SECONDS=300,
+    HEALTH_STATS_SAMPLE_SIZE=4,
+)
+class HealthMonitorTests(SimpleTestCase):
+
+    def setUp(self):
+        self.monitor = health.HealthMonitor(interval=5)
+        self.broker = FakeRedis()
+        self.redis = FakeRedis()
+        patches = [
+            mock.patch.object(health, '_broker_client', return_value=self.broker),
+            mock.patch.object(health, '_client', return_value=self.redis),
+            mock.patch.object(health, '_pending', {}),
+            # record_send starts the monitor thread otherwise
+            mock.patch.object(health.monitor, '_ensure_started'),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_queue_depth_and_oldest_task_age(self):
+        now = time.time()
+        # kombu LPUSHes: the oldest message ends up at the tail
+        self.broker.lpush('celery', broker_message(now - 30))
+        self.broker.lpush('celery', broker_message(now - 2))
+
+        state = self.monitor._broker_state()
+        self.assertEqual(state['status'], 'connected')
+        self.assertEqual(state['queues']['celery']['depth'], 2)
+        self.assertAlmostEqual(state['queues']['celery']['oldest_task_age'], 30, delta=1)
+        self.assertEqual(state['queues']['priority'], {'depth': 0, 'oldest_task_age': None})
+
+    def test_messages_without_a_publish_time_have_no_age(self):
+        for raw in (broker_message(), 'not json', json.dumps({'body': ''})):
+            self.assertIsNone(health.HealthMonitor._message_age(raw, time.time()))
+
+    def test_publishes_are_stamped_with_their_enqueue_time(self):
+        from .tasks import stamp_enqueue_time
+
+        headers = {}
+        stamp_enqueue_time(headers=headers)
+        self.assertAlmostEqual(headers['enqueued_at'], time.time(), delta=1)
+        # A retry keeps the original time
+        headers = {'enqueued_at': 1.0}
+        stamp_enqueue_time(headers=headers)
+        self.assertEqual(headers['enqueued_at'], 1.0)
+
+    def test_broker_down_skips_the_worker_ping(self):
+        with mock.patch.object(self.broker, 'pipeline', side_effect=redis.ConnectionError('down')), \
+                mock.patch.object(health.current_app.control, 'ping') as ping:
+            snapshot = self.monitor.collect()
+        ping.assert_not_called()
+        self.assertEqual(snapshot['broker']['status'], 'error: down')
+        self.assertEqual(snapshot['workers'], {'status': 'unknown', 'count': 0})
+
+    def test_worker_count_is_the_number_of_ping_replies(self):
+        replies = [{'celery@a': {'ok': 'pong'}}, {'celery@b': {'ok': 'pong'}}]
+        with mock.patch.object(health.current_app.control, 'ping', return_value=replies):
+            self.assertEqual(self.monitor._worker_state(), {'status': 'ok', 'count': 2})
+        with mock.patch.object(health.current_app.control, 'ping', side_effect=OSError('boom')):
+            self.assertEqual(self.monitor._worker_state(), {'status': 'error: boom', 'count': 0})
+
+    def test_sends_are_buffered_until_flushed(self):
+        for success, latency in [(True, 0.1), (False, 0.3), (True, 0.2)]:
+            health.record_send('smtp', success, latency)
+        self.assertEqual(self.redis.data, {})
+        health.monitor._ensure_started.assert_called()
+
+        health.flush_sends()
+        samples = self.redis.lrange('email:health:sends:smtp', 0, -1)
+        # Newest first
+        self.assertEqual([sample.decode().split(':')[1:] for sample in samples], [
+            ['1', '200.0'], ['0', '300.0'], ['1', '100.0'],
+        ])
+
+        health.flush_sends()
+        self.assertEqual(len(self.redis.calls), 1)
+
+    def test_provider_stats_cover_the_newest_samples_in_the_window(self):
+        self.redis.lpush('email:health:sends:ses', f'{time.time() - 600:.0f}:0:999.0')
+        for i in range(5):
+            health.record_send('ses', i != 0, (i + 1) / 10)
+        health.flush_sends()
+
+        # The sample list is capped at HEALTH_STATS_SAMPLE_SIZE
+        self.assertEqual(self.redis.llen('email:health:sends:ses'), 4)
+        self.assertEqual(self.monitor._provider_state(), {
+            'ses': {'sends': 4, 'success_rate': 1.0, 'p95_latency_ms': 400.0},
+        })
+
+
+def make_log(**fields):
+    fields = {
+        'to_email': 'user@example.com',
+        'subject': 'Welcome',
+        'service_name': 'auth-service',
+        'provider': 'smtp',
+        **fields,
+    }
+    # Saved from an instance, so the shard router places it
+    log = EmailLog(**fields)
+    log.save()
+    return log
+
+
+def welcome_html(i):
+    return (
+        f'<html><body><h1>Welcome {i}</h1><p>Thanks for joining, '
+        f'user{i}@example.com. Your plan is {i % 3}.</p></body></html>'
+    )
+
+
+class CompressedFieldTests(TestCase):
+
+    def setUp(self):
+        patch = mock.patch.object(
+            compression, 'dictionaries', compression.DictionaryCache(refresh_seconds=300)
+        )
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def test_content_is_stored_compressed(self):
+        data = {'name': 'Ada', 'items': [1, 2.5, None], 'nested': {'ok': True}}
+        log = make_log(body_html=welcome_html(1), body_text='Welcome 1', template_data=data)
+
+        raw = EmailLog.objects.values_list('body_html', 'body_text', 'template_data').get()
+        self.assertTrue(all(compression.is_compressed(value) for value in raw))
+        log = EmailLog.objects.get(pk=log.pk)
+        self.assertEqual(log.body_html, welcome_html(1))
+        self.assertEqual(log.body_text, 'Welcome 1')
+        self.assertEqual(log.template_data, data)
+
+    def test_columns_decompress_on_first_access(self):
+        pk = make_log(body_html=welcome_html(1), body_text='Welcome 1').pk
+        log = EmailLog.objects.get(pk=pk)
+        self.assertIsInstance(log.__dict__['body_html'], bytes)
+
+        with mock.patch.object(compression, 'decompress', wraps=compression.decompress) as decompress:
+            self.assertEqual(log.body_html, welcome_html(1))
+            self.assertEqual(log.body_html, welcome_html(1))
+        decompress.assert_called_once()
+        self.assertIsInstance(log.__dict__['body_text'], bytes)
+
+    def test_saving_an_unread_row_writes_the_bytes_back(self):
+        pk = make_log(body_html=welcome_html(1)).pk
+        before = EmailLog.objects.values_list('body_html', flat=True).get()
+
+        log = EmailLog.objects.get(pk=pk)
+        log.status = 'sent'
+        with mock.patch.object(compression, 'compress') as compress, \
+                mock.patch.object(compression, 'decompress') as decompress:
+            log.save()
+        compress.assert_not_called()
+        decompress.assert_not_called()
+        self.assertEqual(EmailLog.objects.values_list('body_html', flat=True).get(), before)
+
+    def test_rows_from_before_compression_read_the_plain_columns(self):
+        pk = make_log(
+            body_html_plain=welcome_html(1), body_text_plain='Welcome 1',
+            template_data_plain={'name': 'Ada'},
+        ).pk
+        log = EmailLog.objects.get(pk=pk)
+        self.assertEqual(log.body_html, welcome_html(1))
+        self.assertEqual(log.body_text, 'Welcome 1')
+        self.assertEqual(log.template_data, {'name': 'Ada'})
+
+
+@override_settings(EMAIL_COMPRESSION_BATCH_SIZE=2)
+class CompressBatchTests(TestCase):
+
+    def setUp(self):
+        patch = mock.patch.object(
+            compression, 'dictionaries', compression.DictionaryCache(refresh_seconds=300)
+        )
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def test_moves_plain_rows_in_batches(self):
+        old = [
+            make_log(body_html_plain=welcome_html(i), template_data_plain={'i': i})
+            for i in range(3)
+        ]
+        make_log(body_html=welcome_html(9))
+        updated_at = dict(EmailLog.objects.values_list('pk', 'updated_at'))
+
+        compressed, last = compression.compress_batch('default')
+        self.assertEqual(compressed, 2)
+        self.assertIsNotNone(last)
+        self.assertEqual(compression.compress_batch('default', after=last), (1, None))
+        self.assertEqual(compression.compress_batch('default'), (0, None))
+
+        for i, log in enumerate(old):
+            raw = EmailLog.objects.values_list(
+                'body_html', 'body_html_plain', 'template_data_plain'
+            ).get(pk=log.pk)
+            self.assertTrue(compression.is_compressed(raw[0]))
+            self.assertEqual(raw[1:], (None, None))
+            log = EmailLog.objects.get(pk=log.pk)
+            self.assertEqual((log.body_html, log.body_text, log.template_data),
+                             (welcome_html(i), None, {'i': i}))
+        self.assertEqual(dict(EmailLog.objects.values_list('pk', 'updated_at')), updated_at)
+
+
+@override_settings(EMAIL_COMPRESSION_LEVEL=3)
+class DictionaryCacheTests(TestCase):
+
+    def setUp(self):
+        self.cache = compression.DictionaryCache(refresh_seconds=300)
+        patch = mock.patch.object(compression, 'dictionaries', self.cache)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def train(self, template_name, offset=0, created_at=None):
+        samples = [welcome_html(i).encode() for i in range(offset, offset + 300)]
+        trained = zstandard.train_dictionary(4096, samples)
+        row = CompressionDictionary.objects.create(
+            dict_id=trained.dict_id(), template_name=template_name,
+            data=trained.as_bytes(), sample_count=len(samples),
+        )
+        if created_at:
+            CompressionDictionary.objects.filter(pk=row.pk).update(created_at=created_at)
+        return row
+
+    def test_templates_use_their_newest_dictionary(self):
+        self.train('welcome', created_at=timezone.now() - timedelta(days=1))
+        newest = self.train('welcome', offset=1000)
+
+        self.assertEqual(self.cache.for_template('welcome').dict_id(), newest.dict_id)
+        self.assertIsNone(self.cache.for_template('reset'))
+
+    def test_frames_name_their_dictionary(self):
+        dictionary = self.train('welcome')
+        data = welcome_html(7).encode()
+        compressed = compression.compress(data, 'welcome')
+        self.assertEqual(zstandard.get_frame_parameters(compressed).dict_id, dictionary.dict_id)
+        self.assertLess(len(compressed), len(compression.compress(data)))
+
+        # A fresh process loads the dictionary by the id in the frame
+        cache = compression.DictionaryCache(refresh_seconds=300)
+        with mock.patch.object(compression, 'dictionaries', cache):
+            self.assertEqual(compression.decompress(compressed), data)
+        with self.assertRaises(LookupError):
+            cache.by_id(dictionary.dict_id + 1)
+
+    def test_dictionaries_are_reloaded_after_refresh_seconds(self):
+        self.assertIsNone(self.cache.for_template('welcome'))
+        dictionary = self.train('welcome')
+        with self.assertNumQueries(0):
+            self.assertIsNone(self.cache.for_template('welcome'))
+
+        later = time.monotonic() + 301
+        with mock.patch.object(compression, 'time', SimpleNamespace(monotonic=lambda: later)):
+            self.assertEqual(self.cache.for_template('welcome').dict_id(), dictionary.dict_id)
+
+    def test_uncompressed_bytes_pass_through(self):
+        self.assertEqual(compression.decompress(b'plain'), b'plain')
+
+
+IN_MEMORY_ATTACHMENTS = override_settings(STORAGES={
+    **settings.STORAGES,
+    'attachments': {'BACKEND': 'django.core.files.storage.InMemoryStorage'},
+})
+
+
+def upload(name, content, content_type='application/octet-stream', service='auth-service'):
+    return attachments.store_upload(
+        SimpleUploadedFile(name, content, content_type=content_type), service
+    )
+
+
+class RecordingSMTP:
+    """Answers an SMTP transaction and keeps what was sent after DATA"""
+
+    def __init__(self):
+        self.envelope = []
+        self.data = b''
+
+    def ehlo_or_helo_if_needed(self):
+        pass
+
+    def mail(self, sender):
+        self.envelope.append(('MAIL', sender))
+        return 250, b'OK'
+
+    def rcpt(self, recipient):
+        self.envelope.append(('RCPT', recipient))
+        return 250, b'OK'
+
+    def docmd(self, command):
+        self.envelope.append((command,))
+        return 354, b'Go ahead'
+
+    def send(self, data):
+        self.data += data
+
+    def getreply(self):
+        return 250, b'Queued'
+
+
+class RecordingBackend(SMTPBackend):
+
+    def __init__(self, smtp):
+        super().__init__()
+        self.smtp = smtp
+
+    def open(self):
+        self.connection = self.smtp
+
+    def close(self):
+        self.connection = None
+
+
+@IN_MEMORY_ATTACHMENTS
+class AttachmentStorageTests(TestCase):
+
+    def test_identical_uploads_share_one_blob(self):
+        first = upload('a.txt', b'same bytes')
+        second = upload('b.txt', b'same bytes', service='billing-service')
+
+        self.assertNotEqual(first.pk, second.pk)
+        self.assertEqual(first.blob_id, second.blob_id)
+        self.assertEqual(AttachmentBlob.objects.count(), 1)
+        self.assertEqual((second.filename, second.service_name), ('b.txt', 'billing-service'))
+        with attachments.get_storage().open(first.storage_name) as blob:
+            self.assertEqual(blob.read(), b'same bytes')
+
+    def test_losing_the_blob_race_deletes_the_extra_copy(self):
+        content = b'raced'
+        sha256 = upload('a.txt', content).sha256
+        storage = attachments.get_storage()
+        # Another process saved the blob under a different name first
+        AttachmentBlob.objects.filter(pk=sha256).update(storage_name='elsewhere')
+        storage.delete(f'{sha256[:2]}/{sha256}')
+
+        blob = attachments._store_blob(SimpleUploadedFile('a.txt', content), sha256)
+        self.assertEqual(blob.storage_name, 'elsewhere')
+        self.assertFalse(storage.exists(f'{sha256[:2]}/{sha256}'))
+
+    @override_settings(ATTACHMENT_MAX_SIZE=4)
+    def test_rejects_oversized_uploads(self):
+        with self.assertRaises(attachments.AttachmentTooLarge):
+            upload('big.bin', b'12345')
+        self.assertFalse(AttachmentBlob.objects.exists())
+
+
+@IN_MEMORY_ATTACHMENTS
+class StreamedSendTests(TestCase):
+
+    def setUp(self):
+        # Crosses the base64 read chunk (57 * 1024 bytes) several times
+        self.pdf = os.urandom(200_000)
+        self.files = [
+            upload('résumé.pdf', self.pdf, 'application/pdf'),
+            upload('say "hi".txt', b'.\r\nhi\r\n', 'text/plain'),
+        ]
+
+    def message(self):
+        return EmailMessage(
+            subject='Report',
+            body='First line\n.\n.hidden\n..two\nLast line\n',
+            from_email='no-reply@example.com',
+            to=['user@example.com'],
+            cc=['cc@example.com'],
+        )
+
+    def test_smtp_data_is_dot_stuffed_mime(self):
+        smtp = RecordingSMTP()
+        message_id = attachments.send_smtp_streamed(
+            self.message(), self.files, connection=RecordingBackend(smtp)
+        )
+
+        self.assertEqual(smtp.envelope, [
+            ('MAIL', 'no-reply@example.com'),
+            ('RCPT', 'user@example.com'),
+            ('RCPT', 'cc@example.com'),
+            ('DATA',),
+        ])
+        self.assertTrue(smtp.data.endswith(b'\r\n.\r\n'))
+        data = smtp.data[:-len(b'.\r\n')]
+        # A lone "." would end DATA early
+        self.assertNotIn(b'.', data.split(b'\r\n'))
+        self.assertIn(b'\r\n..hidden\r\n...two\r\n', data)
+        self.assertIn(b"filename*=utf-8''r%C3%A9sum%C3%A9.pdf", data)
+
+        parsed = email.message_from_bytes(
+            re.sub(rb'(?m)^\.', b'', data), policy=email.policy.default
+        )
+        self.assertEqual(parsed['Message-ID'], message_id)
+        self.assertEqual(parsed['Subject'], 'Report')
+        self.assertEqual(parsed.get_content_type(), 'multipart/mixed')
+        body, pdf, text = parsed.iter_parts()
+        self.assertEqual(body.get_content(), 'First line\r\n.\r\n.hidden\r\n..two\r\nLast line\r\n')
+        self.assertEqual(pdf.get_filename(), 'résumé.pdf')
+        self.assertEqual(pdf.get_content(), self.pdf)
+        self.assertEqual(text.get_filename(), 'say "hi".txt')
+        self.assertEqual(text.get_payload(decode=True), b'.\r\nhi\r\n')
+
+    @override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
+    def test_other_backends_get_the_message_built_in_memory(self):
+        message_id = attachments.send_smtp_streamed(self.message(), self.files)
+
+        sent, = mail.outbox
+        self.assertEqual(sent.extra_headers['Message-ID'], message_id)
+        self.assertEqual(
+            [(name, content) for name, content, _ in sent.attachments],
+            [('résumé.pdf', self.pdf), ('say "hi".txt', '.\r\nhi\r\n')],
+        )
+
+    def test_sendgrid_body_is_json(self):
+        payload = {'personalizations': [{'to': [{'email': 'user@example.com'}]}], 'subject': 'Report'}
+        body = json.loads(b''.join(attachments.iter_sendgrid_body(payload, self.files)))
+
+        self.assertEqual(body['subject'], 'Report')
+        self.assertEqual(
+            [(a['filename'], a['type'], a['disposition']) for a in body['attachments']],
+            [('résumé.pdf', 'application/pdf', 'attachment'),
+             ('say "hi".txt', 'text/plain', 'attachment')],
+        )
+        self.assertEqual(base64.b64decode(body['attachments'][0]['content']), self.pdf)
+        self.assertEqual(base64.b64decode(body['attachments'][1]['content']), b'.\r\nhi\r\n')
+
+
+@IN_MEMORY_ATTACHMENTS
+class SendEmailAttachmentTests(APITestCase):
+
+    def send(self, attachment_ids):
+        return self.post('/email/send', {
+            'to_email': 'user@example.com',
+            'subject': 'Report',
+            'body_text': 'See attached',
+            'service_name': 'auth-service',
+            'attachments': attachment_ids,
+            'send_async': False,
+        })
+
+    def test_services_may_send_their_own_uploads(self):
+        own = upload('a.txt', b'mine')
+        with mock.patch.object(
+            EmailService, 'send_email', return_value={'success': True}
+        ) as send_email:
+            response = self.send([str(own.pk), str(own.pk)])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(send_email.call_args.kwargs['attachments'], [str(own.pk)])
+
+    def test_uploads_of_other_services_are_unknown(self):
+        own = upload('a.txt', b'mine')
+        foreign = upload('b.txt', b'theirs', service='billing-service')
+        with mock.patch.object(EmailService, 'send_email') as send_email:
+            response = self.send([str(own.pk), str(foreign.pk)])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['errors'], {'attachments': ['Unknown attachment id']})
+        send_email.assert_not_called()
+
+
+TRACKING_SETTINGS = override_settings(
+    TRACKING_SECRET='tracking-secret',
+    TRACKING_BASE_URL='https://mail.example.com',
+    EMAIL_LOG_SHARDS=['default', 'shard1'],
+)
+EMAIL_ID = '6f1c2a7e-8a46-4b9c-9a3e-2d5e4c1b0a99'
+
+
+@TRACKING_SETTINGS
+class TrackingTokenTests(SimpleTestCase):
+
+    def test_tokens_round_trip(self):
+        token = tracking.make_token(EMAIL_ID, 'shard1', 'https://example.com/a?b=1&c=é')
+        self.assertEqual(
+            tracking.parse_token(token), (EMAIL_ID, 'shard1', 'https://example.com/a?b=1&c=é')
+        )
+        self.assertEqual(
+            tracking.parse_token(tracking.make_token(EMAIL_ID, 'default')),
+            (EMAIL_ID, 'default', None),
+        )
+
+    def test_rejects_tampered_and_foreign_tokens(self):
+        token = tracking.make_token(EMAIL_ID, 'default', 'https://example.com/')
+        payload = tracking._b64decode(token)[:-tracking._SIG_BYTES]
+        forged = tracking._b64encode(payload.replace(b'example', b'evil-ex') + b'0' * 10)
+        self.assertIsNone(tracking.parse_token(forged))
+        self.assertIsNone(tracking.parse_token(token[:-2]))
+        for bad in ('', 'not a token', '!!!!'):
+            self.assertIsNone(tracking.parse_token(bad))
+        with override_settings(TRACKING_SECRET='another-secret'):
+            self.assertIsNone(tracking.parse_token(token))
+
+    def test_rejects_unknown_shards(self):
+        payload = tracking.uuid.UUID(EMAIL_ID).bytes + bytes([7])
+        token = tracking._b64encode(payload + tracking._sign(payload))
+        self.assertIsNone(tracking.parse_token(token))
+
+    def test_no_tokens_are_valid_without_a_secret(self):
+        with override_settings(TRACKING_SECRET=''):
+            token = tracking.make_token(EMAIL_ID, 'default')
+            self.assertIsNone(tracking.parse_token(token))
+
+
+@TRACKING_SETTINGS
+class AddTrackingTests(SimpleTestCase):
+
+    def links(self, body_html):
+        return [
+            tracking.parse_token(token)
+            for token in re.findall(r'https://mail\.example\.com/t/c/([\w-]+)', body_html)
+        ]
+
+    def test_rewrites_links_and_adds_the_pixel(self):
+        body = (
+            '<html><body>'
+            '<a href="https://example.com/a?x=1&amp;y=2">a</a>'
+            "<a class='b' href='http://example.com/b'>b</a>"
+            '<a href=https://example.com/c>c</a>'
+            '<a href="mailto:help@example.com">help</a>'
+            '<a href="https://mail.example.com/unsubscribe">stop</a>'
+            '</body></html>'
+        )
+        tracked = tracking.add_tracking(body, EMAIL_ID, 'shard1')
+
+        self.assertEqual(self.links(tracked), [
+            (EMAIL_ID, 'shard1', 'https://example.com/a?x=1&y=2'),
+            (EMAIL_ID, 'shard1', 'http://example.com/b'),
+            (EMAIL_ID, 'shard1', 'https://example.com/c'),
+        ])
+        self.assertIn('href="mailto:help@example.com"', tracked)
+        self.assertIn('href="https://mail.example.com/unsubscribe"', tracked)
+        pixel = re.search(r'<img src="https://mail\.example\.com/t/o/([\w-]+)\.gif"[^>]*></body>', tracked)
+        self.assertEqual(tracking.parse_token(pixel.group(1)), (EMAIL_ID, 'shard1', None))
+
+    def test_pixel_is_appended_without_a_body_tag_and_added_once(self):
+        tracked = tracking.add_tracking('<p>Hi</p>', EMAIL_ID, 'default')
+        self.assertTrue(tracked.startswith('<p>Hi</p><img '))
+        self.assertEqual(tracking.add_tracking(tracked, EMAIL_ID, 'default'), tracked)
+
+
+@TRACKING_SETTINGS
+class TrackingHitTests(SimpleTestCase):
+
+    def setUp(self):
+        patch = mock.patch.object(tracking.buffer, 'add')
+        self.add = patch.start()
+        self.addCleanup(patch.stop)
+
+    def test_opens_are_counted_on_get_only(self):
+        path = f"o/{tracking.make_token(EMAIL_ID, 'shard1')}.gif"
+        status, headers, body = tracking.hit(path)
+        self.assertEqual((status, body), (200, tracking.PIXEL))
+        self.assertIn((b'content-type', b'image/gif'), headers)
+        self.assertEqual(tracking.hit(path, 'HEAD')[2], b'')
+        self.add.assert_called_once_with(tracking.OPEN, EMAIL_ID, 'shard1')
+
+    def test_clicks_redirect_to_the_signed_url(self):
+        token = tracking.make_token(EMAIL_ID, 'default', 'https://example.com/ü?a=1')
+        status, headers, _ = tracking.hit(f'c/{token}')
+        self.assertEqual(status, 302)
+        self.assertIn((b'location', b'https://example.com/%C3%BC?a=1'), headers)
+        self.add.assert_called_once_with(tracking.CLICK, EMAIL_ID, 'default')
+
+    def test_bad_requests(self):
+        open_token = tracking.make_token(EMAIL_ID, 'default')
+        self.assertEqual(tracking.hit(f'c/{open_token}')[0], 404)
+        self.assertEqual(tracking.hit('c/forged')[0], 404)
+        self.assertEqual(tracking.hit('x/anything')[0], 404)
+        self.assertEqual(tracking.hit(f'o/{open_token}.gif', 'POST')[0], 405)
+        # Pixels answer even for bad tokens, but count nothing
+        self.assertEqual(tracking.hit('o/forged.gif')[0], 200)
+        self.add.assert_not_called()
+
+
+class ApplyTrackingEventsTests(TestCase):
+
+    def event(self, kind, log, ms):
+        return {b'k': kind.encode(), b'id': str(log.pk).encode(), b's': b'default', b't': str(ms).encode()}
+
+    def test_folds_events_into_counts_and_first_hits(self):
+        base = int(time.time() * 1000) - 60000
+        sent = make_log(status='sent')
+        failed = make_log(status='failed')
+        opened = make_log(status='opened', opened_at=timezone.now() - timedelta(days=1))
+
+        tracking.apply_events([
+            self.event(tracking.CLICK, sent, base + 300),
+            self.event(tracking.OPEN, sent, base + 200),
+            self.event(tracking.OPEN, sent, base + 100),
+            self.event(tracking.OPEN, failed, base),
+            self.event(tracking.OPEN, opened, base),
+            # Deleted since it was sent
+            self.event(tracking.OPEN, SimpleNamespace(pk=uuid.uuid4()), base),
+        ])
+
+        sent.refresh_from_db()
+        self.assertEqual((sent.status, sent.open_count, sent.click_count), ('clicked', 2, 1))
+        self.assertEqual(sent.opened_at, tracking._as_datetime(base + 100))
+        self.assertEqual(sent.clicked_at, tracking._as_datetime(base + 300))
+
+        failed.refresh_from_db()
+        self.assertEqual((failed.status, failed.open_count), ('failed', 1))
+
+        opened_at = opened.opened_at
+        opened.refresh_from_db()
+        self.assertEqual((opened.status, opened.open_count, opened.opened_at), ('opened', 1, opened_at))
+
+    def test_a_click_without_an_open_counts_as_opened(self):
+        log = make_log(status='delivered')
+        ms = int(time.time() * 1000)
+        tracking.apply_events([self.event(tracking.CLICK, log, ms)])
+        log.refresh_from_db()
+        self.assertEqual((log.status, log.open_count, log.click_count), ('clicked', 0, 1))
+        self.assertEqual(log.opened_at, tracking._as_datetime(ms))
+
+
+SHARDS = override_settings(
+    EMAIL_LOG_SHARDS=['default', 'shard1'],
+    EMAIL_LOG_SHARD_KEY='service_name',
+    EMAIL_LOG_SHARD_ROUTES={'billing-service': 'shard1'},
+    DB_REPLICAS=['replica1'],
+)
+
+
+@SHARDS
+class EmailLogShardRoutingTests(SimpleTestCase):
+
+    def test_services_route_to_their_shard(self):
+        self.assertEqual(routers.shard_for('billing-service'), 'shard1')
+        self.assertEqual(routers.shard_for('auth-service'), 'default')
+        self.assertEqual(routers.shards_for('billing-service'), ['shard1'])
+        self.assertEqual(routers.shards_for(user_id='42'), ['default', 'shard1'])
+
+    @override_settings(EMAIL_LOG_SHARD_KEY='user_id')
+    def test_users_hash_across_shards(self):
+        placed = {user_id: routers.shard_for(user_id=user_id) for user_id in map(str, range(100))}
+        self.assertEqual(set(placed.values()), {'default', 'shard1'})
+        # Stable, and the service is ignored
+        self.assertEqual(routers.shard_for('billing-service', '7'), placed['7'])
+        self.assertEqual(routers.shards_for('auth-service', '7'), [placed['7']])
+        self.assertEqual(routers.shard_for(), 'default')
+        self.assertEqual(routers.shards_for('billing-service'), ['default', 'shard1'])
+
+    def test_router_places_email_logs_by_shard_key(self):
+        router = routers.EmailLogShardRouter()
+        log = EmailLog(service_name='billing-service')
+        self.assertEqual(router.db_for_write(EmailLog, instance=log), 'shard1')
+        # Loaded rows stay where they were read from
+        log._state.db = 'default'
+        self.assertEqual(router.db_for_read(EmailLog, instance=log), 'default')
+        self.assertIsNone(router.db_for_read(EmailLog))
+        self.assertIsNone(router.db_for_write(EmailTemplate, instance=EmailTemplate()))
+
+    def test_email_logs_migrate_only_on_shards(self):
+        router = routers.EmailLogShardRouter()
+        self.assertTrue(router.allow_migrate('shard1', 'email_service', 'emaillog'))
+        self.assertTrue(router.allow_migrate('default', 'email_service', 'emaillog'))
+        self.assertFalse(router.allow_migrate('replica1', 'email_service', 'emaillog'))
+        self.assertFalse(router.allow_migrate('shard1', 'email_service', 'emailtemplate'))
+        self.assertIsNone(router.allow_migrate('default', 'email_service', 'emailtemplate'))
+
+    def test_fan_out_queries_every_shard_in_parallel(self):
+        connections = {'default': mock.Mock(), 'shard1': mock.Mock()}
+        barrier = threading.Barrier(2, timeout=5)
+
+        def query(alias):
+            # Both shards are in flight at once, or this times out
+            barrier.wait()
+            return alias, threading.current_thread().name
+
+        with mock.patch.object(routers, 'connections', connections):
+            results = routers.fan_out(query, ['shard1', 'default'])
+        self.assertEqual([alias for alias, _ in results], ['shard1', 'default'])
+        self.assertTrue(all(name.startswith('email-shard') for _, name in results))
+        # Pooled connections go back after each call
+        connections['default'].close.assert_called_once()
+        connections['shard1'].close.assert_called_once()
+
+    def test_fan_out_to_one_shard_runs_inline(self):
+        self.assertEqual(
+            routers.fan_out(lambda alias: threading.current_thread(), ['shard1']),
+            [threading.current_thread()],
+        )
+
+
+@skipUnless('shard1' in settings.DATABASES, 'set EMAIL_LOG_SHARD_URLS=shard1=... to run')
+@API_SETTINGS
+@override_settings(
+    EMAIL_LOG_SHARDS=['default', 'shard1'],
+    EMAIL_LOG_SHARD_KEY='service_name',
+    EMAIL_LOG_SHARD_ROUTES={'billing-service': 'shard1'},
+)
+class EmailLogShardDatabaseTests(APIRequests, TransactionTestCase):
+    """Against a real second shard; fan_out reads from other threads"""
+    databases = '__all__'
+
+    def setUp(self):
+        self.billing = make_log(service_name='billing-service', subject='Invoice')
+        self.auth = make_log(service_name='auth-service', subject='Welcome')
+
+    def test_rows_are_written_to_their_shard(self):
+        self.assertEqual(self.billing._state.db, 'shard1')
+        self.assertTrue(EmailLog.objects.using('shard1').filter(pk=self.billing.pk).exists())
+        self.assertFalse(EmailLog.objects.using('default').filter(pk=self.billing.pk).exists())
+        self.assertEqual(self.auth._state.db, 'default')
+
+        # Saving a loaded row keeps it on its shard
+        self.billing.status = 'sent'
+        self.billing.save()
+        self.assertEqual(EmailLog.objects.using('shard1').get(pk=self.billing.pk).status, 'sent')
+
+    def test_reads_without_a_shard_key_visit_every_shard(self):
+        history = self.get('/email/history').json()
+        self.assertEqual(history['pagination']['total'], 2)
+        self.assertEqual([row['subject'] for row in history['data']], ['Welcome', 'Invoice'])
+
+        history = self.get('/email/history?service_name=billing-service').json()
+        self.assertEqual([row['subject'] for row in history['data']], ['Invoice'])
+
+        status = self.get(f'/email/status/{self.billing.pk}').json()
+        self.assertEqual(status['data']['subject'], 'Invoice')
+
+
+@override_settings(
+    DB_REPLICAS=['replica1', 'replica2'],
+    DB_REPLICA_MAX_LAG_SECONDS=5.0,
+    READ_YOUR_WRITES_SECONDS=10,
+)
+class ReplicaRoutingTests(SimpleTestCase):
+
+    def setUp(self):
+        self.monitor = replicas.ReplicaMonitor(interval=1)
+        self.redis = FakeRedis()
+        patches = [
+            mock.patch.object(replicas, 'lag_monitor', self.monitor),
+            mock.patch.object(replicas, '_client', return_value=self.redis),
+            mock.patch.object(self.monitor, '_ensure_started'),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_reads_rotate_over_replicas_within_the_lag_limit(self):
+        self.monitor._lags = {'replica1': 0.5, 'replica2': 0.0}
+        self.assertEqual(
+            [replicas.read_db('default', 'auth-service') for _ in range(4)],
+            ['replica1', 'replica2', 'replica1', 'replica2'],
+        )
+
+        self.monitor._lags = {'replica1': 30.0, 'replica2': None}
+        self.assertEqual(replicas.read_db('default', 'auth-service'), 'default')
+        self.monitor._lags = {'replica1': 30.0, 'replica2': 5.0}
+        self.assertEqual(replicas.read_db('default', 'auth-service'), 'replica2')
+
+    def test_only_the_default_database_has_replicas(self):
+        self.monitor._lags = {'replica1': 0.0, 'replica2': 0.0}
+        self.assertEqual(replicas.read_db('shard1', 'auth-service'), 'shard1')
+        with override_settings(DB_REPLICAS=[]):
+            self.assertEqual(replicas.read_db('default', 'auth-service'), 'default')
+
+    def test_reads_stay_on_the_primary_after_a_write(self):
+        self.monitor._lags = {'replica1': 0.0, 'replica2': 0.0}
+        with mock.patch.object(self.redis, 'set', wraps=self.redis.set) as set_key:
+            replicas.mark_write('auth-service')
+        set_key.assert_called_once_with('email:rw:auth-service', 1, ex=10)
+
+        self.assertEqual(replicas.read_db('default', 'auth-service'), 'default')
+        self.assertIn(replicas.read_db('default', 'billing-service'), ['replica1', 'replica2'])
+        self.assertIn(replicas.read_db('default'), ['replica1', 'replica2'])
+
+    def test_redis_outage_keeps_reads_on_the_primary(self):
+        self.monitor._lags = {'replica1': 0.0, 'replica2': 0.0}
+        down = redis.ConnectionError('down')
+        with mock.patch.object(self.redis, 'exists', side_effect=down), \
+                mock.patch.object(self.redis, 'set', side_effect=down):
+            replicas.mark_write('auth-service')
+            self.assertEqual(replicas.read_db('default', 'auth-service'), 'default')
+
+    def test_unreachable_replicas_have_no_lag(self):
+        broken = mock.Mock(vendor='postgresql')
+        broken.cursor.side_effect = Exception('connection refused')
+        with mock.patch.object(replicas, 'connections', {'replica1': broken}):
+            self.assertIsNone(self.monitor._measure('replica1'))
+        broken.close.assert_called_once()
+
+    def test_replicas_are_never_migrated(self):
+        router = routers.ReplicaRouter()
+        self.assertFalse(router.allow_migrate('replica1', 'email_service', 'emaillog'))
+        self.assertIsNone(router.allow_migrate('default', 'email_service', 'emaillog'))
+        primary, replica, shard = (SimpleNamespace(_state=SimpleNamespace(db=db))
+                                   for db in ('default', 'replica1', 'shard1'))
+        self.assertTrue(router.allow_relation(primary, replica))
+        self.assertIsNone(router.allow_relation(primary, shard))
+
+
+@skipUnless('replica1' in settings.DATABASES, 'set DB_REPLICA_URLS=replica1=... to run')
+@API_SETTINGS
+@override_settings(DB_REPLICAS=['replica1'], EMAIL_LOG_SHARDS=['default'])
+class ReplicaDatabaseTests(APIRequests, TransactionTestCase):
+    """Against a real replica alias (a test mirror of default)"""
+    databases = '__all__'
+
+    def setUp(self):
+        self.monitor = replicas.ReplicaMonitor(interval=1)
+        patches = [
+            mock.patch.object(replicas, 'lag_monitor', self.monitor),
+            mock.patch.object(replicas, '_client', return_value=FakeRedis()),
+            mock.patch.object(self.monitor, '_ensure_started'),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        # Django closes no pool for a mirror, which would keep the test
+        # database from being dropped
+        self.addCleanup(connections['replica1'].close_pool)
+        make_log(subject='Welcome')
+
+    def history_reads(self):
+        """Queries a history request ran on (primary, replica)"""
+        with CaptureQueriesContext(connections['default']) as primary, \
+                CaptureQueriesContext(connections['replica1']) as replica:
+            response = self.get('/email/history?service_name=auth-service')
+        self.assertEqual([row['subject'] for row in response.json()['data']], ['Welcome'])
+        return len(primary), len(replica)
+
+    def test_reads_use_the_replica_until_the_caller_writes(self):
+        self.assertEqual(self.monitor._measure('replica1'), 0.0)
+        self.monitor._lags['replica1'] = self.monitor._measure('replica1')
+        primary, replica = self.history_reads()
+        self.assertEqual(primary, 0)
+        self.assertGreater(replica, 0)
+
+        replicas.mark_write('auth-service')
+        primary, replica = self.history_reads()
+        self.assertGreater(primary, 0)
+        self.assertEqual(replica, 0)
+
+    def test_lagging_replicas_are_skipped(self):
+        self.monitor._lags['replica1'] = settings.DB_REPLICA_MAX_LAG_SECONDS + 1
+        primary, replica = self.history_reads()
+        self.assertGreater(primary, 0)
+        self.assertEqual(replica, 0)
@@ -0,0 +1,368 @@
+"""
+Open and click tracking.
+
+Tracking URLs carry a compact signed token (email id, shard and, for
+clicks, the target URL), so the pixel and the redirect are answered
+from memory without touching the database. Hits are buffered in
+process and shipped to a Redis stream in pipelined batches; the
+``apply_tracking_events`` task folds them into EmailLog.
+"""
+from collections import deque
+from datetime import datetime, timezone
+import base64
+import hashlib
+import hmac
+import html
+import logging
+import os
+import re
+import socket
+import threading
+import time
+import uuid
+
+import redis
+from django.conf import settings
+from django.db import transaction
+from django.utils.encoding import iri_to_uri
+
+logger = logging.getLogger(__name__)
+
+STREAM_KEY = 'email:tracking:events'
+CONSUMER_GROUP = 'tracking-appliers'
+
+OPEN = 'o'
+CLICK = 'c'
+
+PIXEL = base64.b64decode(
+    'R0lGODlhAQABAIAAAAAAAP///yH5BAEAAAAALAAAAAABAAEAAAIBRAA7'
+)
+_SIG_BYTES = 10
+
+_NO_CACHE = [
+    (b'cache-control', b'no-store, no-cache, must-revalidate, private'),
+    (b'expires', b'0'),
+]
+
+_HREF = re.compile(r'''(<a\b[^>]*?\bhref=)(["']?)(https?://[^"'\s>]+)\2''', re.IGNORECASE)
+_BODY_END = re.compile(r'</body\s*>', re.IGNORECASE)
+
+
+# --------------------------------------------
+# Tokens
+# --------------------------------------------
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+
+def _sign(payload):
+    key = settings.TRACKING_SECRET.encode()
+    return hmac.new(key, payload, hashlib.sha256).digest()[:_SIG_BYTES]
+
+
+def make_token(email_id, shard, url=None):
+    """Signed token for an email (and a click target)"""
+    payload = (
+        uuid.UUID(str(email_id)).bytes
+        + bytes([settings.EMAIL_LOG_SHARDS.index(shard)])
+        + (url.encode() if url else b'')
+    )
+    return _b64encode(payload + _sign(payload))
+
+
+def parse_token(token):
+    """Return (email_id, shard, url) for a valid token, else None"""
+    if not settings.TRACKING_SECRET:
+        # Tracking is off; don't accept tokens signed with an empty key
+        return None
+    try:
+        data = _b64decode(token)
+    except (ValueError, TypeError):
+        return None
+    payload, signature = data[:-_SIG_BYTES], data[-_SIG_BYTES:]
+    if len(payload) < 17 or not hmac.compare_digest(signature, _sign(payload)):
+        return None
+    try:
+        shard = settings.EMAIL_LOG_SHARDS[payload[16]]
+        url = payload[17:].decode() or None
+    except (IndexError, UnicodeDecodeError):
+        return None
+    return str(uuid.UUID(bytes=payload[:16])), shard, url
+
+
+# --------------------------------------------
+# Render-time rewriting
+# --------------------------------------------
+
+def add_tracking(body_html, email_id, shard):
+    """Route http(s) links through the click endpoint and add the pixel"""
+    base = settings.TRACKING_BASE_URL
+
+    def rewrite(match):
+        url = html.unescape(match.group(3))
+        if url.startswith(base):
+            return match.group(0)
+        token = make_token(email_id, shard, url)
+        return f'{match.group(1)}"{base}/t/c/{token}"'
+
+    body_html = _HREF.sub(rewrite, body_html)
+    if f'{base}/t/o/' in body_html:
+        return body_html
+
+    pixel = (
+        f'<img src="{base}/t/o/{make_token(email_id, shard)}.gif" '
+        'width="1" height="1" alt="" style="display:block;border:0">'
+    )
+    body_html, found = _BODY_END.subn(lambda m: pixel + m.group(0), body_html, count=1)
+    return body_html if found else body_html + pixel
+
+
+# --------------------------------------------
+# Hit buffering
+# --------------------------------------------
+
+_redis = None
+
+
+def _client():
+    global _redis
+    if _redis is None:
+        _redis = redis.Redis.from_url(
+            settings.REDIS_URL, socket_timeout=1.0, socket_connect_timeout=1.0
+        )
+    return _redis
+
+
+class EventBuffer:
+    """
+    In-process hit buffer drained to the Redis stream by a thread.
+
+    Appending is a deque append, so request handlers never wait on
+    Redis. When Redis is unreachable the oldest hits beyond
+    max_pending are dropped.
+    """
+
+    def __init__(self, flush_interval, batch_size, max_pending):
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.events = deque(maxlen=max_pending)
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def add(self, kind, email_id, shard):
+        if self._thread is None:
+            self._ensure_started()
+        if len(self.events) == self.events.maxlen:
+            self.dropped += 1
+        self.events.append((kind, email_id, shard, int(time.time() * 1000)))
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name='tracking-flusher', daemon=True
+                )
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            while self.events:
+                if not self.flush():
+                    break
+
+    def flush(self):
+        """Ship one batch, returns False if Redis refused it"""
+        batch = []
+        while self.events and len(batch) < self.batch_size:
+            batch.append(self.events.popleft())
+        if not batch:
+            return True
+        pipe = _client().pipeline(transaction=False)
+        for kind, email_id, shard, ts in batch:
+            pipe.xadd(
+                STREAM_KEY,
+                {'k': kind, 'id': email_id, 's': shard, 't': ts},
+                maxlen=settings.TRACKING_STREAM_MAXLEN,
+                approximate=True,
+            )
+        try:
+            pipe.execute()
+            return True
+        except redis.RedisError as e:
+            logger.warning("Tracking flush failed, %s events kept: %s", len(batch), e)
+            self.events.extendleft(reversed(batch))
+            return False
+
+
+buffer = EventBuffer(
+    flush_interval=settings.TRACKING_FLUSH_INTERVAL,
+    batch_size=settings.TRACKING_BATCH_SIZE,
+    max_pending=settings.TRACKING_MAX_PENDING,
+)
+
+
+def hit(path, method='GET'):
+    """
+    Answer a tracking request for ``path`` (relative to /t/).
+
+    Returns (status, headers, body) with raw header byte pairs.
+    """
+    if method not in ('GET', 'HEAD'):
+        return 405, [(b'allow', b'GET, HEAD')], b''
+    kind, _, token = path.partition('/')
+
+    if kind == OPEN and token.endswith('.gif'):
+        parsed = parse_token(token[:-4])
+        # Scanners probe with HEAD; only count real fetches
+        if parsed is not None and method == 'GET':
+            buffer.add(OPEN, parsed[0], parsed[1])
+        headers = [(b'content-type', b'image/gif')] + _NO_CACHE
+        return 200, headers, PIXEL if method == 'GET' else b''
+
+    if kind == CLICK:
+        parsed = parse_token(token)
+        if parsed is not None and parsed[2]:
+            if method == 'GET':
+                buffer.add(CLICK, parsed[0], parsed[1])
+            location = iri_to_uri(parsed[2]).encode('latin-1')
+            return 302, [(b'location', location)] + _NO_CACHE, b''
+
+    return 404, [(b'content-type', b'text/plain')], b'Not found'
+
+
+class TrackingApp:
+    """ASGI wrapper answering /t/ hits before the request reaches Django"""
+
+    prefix = '/t/'
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not scope['path'].startswith(self.prefix):
+            return await self.app(scope, receive, send)
+        status, headers, body = hit(scope['path'][len(self.prefix):], scope['method'])
+        headers.append((b'content-length', str(len(body)).encode()))
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': body})
+
+
+# --------------------------------------------
+# Consumer
+# --------------------------------------------
+
+def _ensure_group(client):
+    try:
+        client.xgroup_create(STREAM_KEY, CONSUMER_GROUP, id='0', mkstream=True)
+    except redis.ResponseError as e:
+        if 'BUSYGROUP' not in str(e):
+            raise
+
+
+def consume(max_batches=50, reclaim_idle_ms=60000):
+    """
+    Apply pending stream events to EmailLog in batches.
+
+    Entries left unacknowledged by a crashed consumer for longer than
+    reclaim_idle_ms are claimed first. Returns the number applied.
+    """
+    client = _client()
+    _ensure_group(client)
+    consumer = f"{socket.gethostname()}-{os.getpid()}"
+    count = settings.TRACKING_BATCH_SIZE
+
+    applied = 0
+    _, entries, *_ = client.xautoclaim(
+        STREAM_KEY, CONSUMER_GROUP, consumer,
+        min_idle_time=reclaim_idle_ms, start_id='0-0', count=count
+    )
+    # Entries deleted while pending come back empty
+    entries = [(entry_id, entry) for entry_id, entry in entries if entry]
+    for _ in range(max_batches):
+        if not entries:
+            response = client.xreadgroup(
+                CONSUMER_GROUP, consumer, {STREAM_KEY: '>'}, count=count
+            )
+            entries = response[0][1] if response else []
+            if not entries:
+                break
+        apply_events(entry for _, entry in entries)
+        ids = [entry_id for entry_id, _ in entries]
+        pipe = client.pipeline(transaction=False)
+        pipe.xack(STREAM_KEY, CONSUMER_GROUP, *ids)
+        pipe.xdel(STREAM_KEY, *ids)
+        pipe.execute()
+        applied += len(ids)
+        entries = None
+    return applied
+
+
+def apply_events(events):
+    """
+    Fold raw stream entries into per-email counters and first-hit
+    transitions, one locked read and one bulk update per shard.
+    """
+    per_shard = {}
+    for event in events:
+        kind = event[b'k'].decode()
+        email_id = event[b'id'].decode()
+        shard = event[b's'].decode()
+        ts = int(event[b't'])
+        stats = per_shard.setdefault(shard, {}).setdefault(
+            email_id, {'opens': 0, 'clicks': 0, 'first_open': None, 'first_click': None}
+        )
+        if kind == OPEN:
+            stats['opens'] += 1
+            stats['first_open'] = min(ts, stats['first_open'] or ts)
+        elif kind == CLICK:
+            stats['clicks'] += 1
+            stats['first_click'] = min(ts, stats['first_click'] or ts)
+
+    for shard, rows in per_shard.items():
+        _apply_shard(shard, rows)
+
+
+def _as_datetime(ms):
+    return datetime.fromtimestamp(ms / 1000, tz=timezone.utc) if ms else None
+
+
+def _apply_shard(shard, rows):
+    from django.utils import timezone as dj_timezone
+    from .models import EmailLog, EmailStatus
+
+    opened_from = (EmailStatus.SENT, EmailStatus.DELIVERED)
+    clicked_from = (EmailStatus.SENT, EmailStatus.DELIVERED, EmailStatus.OPENED)
+    now = dj_timezone.now()
+
+    with transaction.atomic(using=shard):
+        logs = EmailLog.objects.using(shard).select_for_update().only(
+            'id', 'status', 'opened_at', 'clicked_at', 'open_count', 'click_count'
+        ).in_bulk(list(rows))
+        for email_id, log in logs.items():
+            stats = rows[str(email_id)]
+            log.open_count += stats['opens']
+            log.click_count += stats['clicks']
+            # A click implies the message was opened
+            first_seen = min(
+                ms for ms in (stats['first_open'], stats['first_click']) if ms
+            )
+            log.opened_at = log.opened_at or _as_datetime(first_seen)
+            if stats['clicks']:
+                log.clicked_at = log.clicked_at or _as_datetime(stats['first_click'])
+                if log.status in clicked_from:
+                    log.status = EmailStatus.CLICKED
+            elif log.status in opened_from:
+                log.status = EmailStatus.OPENED
+            log.updated_at = now
+        EmailLog.objects.using(shard).bulk_update(
+            logs.values(),
+            ['open_count', 'click_count', 'opened_at', 'clicked_at', 'status', 'updated_at'],
+            batch_size=500,
+        )
@@ -9,6 +9,7 @@ urlpatterns = [
     path('status/<uuid:email_id>', views.EmailStatusView.as_view(), name='email_status'),
     path('history', views.EmailHistoryView.as_view(), name='email_history'),
     path('stats', views.EmailStatsView.as_view(), name='email_stats'),
+    path('attachments', views.AttachmentUploadView.as_view(), name='attachment_upload'),
     
     # Template management
     path('templates', views.EmailTemplateListView.as_view(), name='template_list'),
@@ -16,4 +17,5 @@ urlpatterns = [
     
     # Health check
     path('health', views.HealthCheckView.as_view(), name='health_check'),
+    path('health/ready', views.ReadinessView.as_view(), name='readiness_check'),
 ]
@@ -1,24 +1,99 @@
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-from django.db import connection
-from .serializers import SendEmailSerializer, EmailLogSerializer, EmailTemplateSerializer
+from django.conf import settings
+from django.http import HttpResponse
+from django.views import View
+from asgiref.sync import sync_to_async
+from django.contrib.postgres.aggregates import StringAgg
+from django.db.models import Count, Max, TextField
+from django.db.models.functions import MD5, Cast
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from .serializers import (
+    SendEmailSerializer,
+    EmailAttachmentSerializer,
+    EmailLogSerializer,
+    EmailLogListSerializer,
+    EmailTemplateSerializer,
+    EmailTemplateListSerializer,
+)
+from core.renderers import ORJSONRenderer
+from core.serializers import serialize_values
+from collections import Counter
+from itertools import islice
+from operator import attrgetter, itemgetter
+from .attachments import AttachmentTooLarge, store_upload
+from .dispatch import apublish, arun_send
+from .health import monitor
+from .middleware import SHARED_KEY_IDENTITY
 from .services import EmailService
 from .tasks import send_email_task
-from .models import EmailLog, EmailTemplate
+from .tracking import hit
+from .metrics import EMAILS, render_latest
+from .models import EmailAttachment, EmailLog, EmailStatus, EmailTemplate
+from .replicas import mark_write, read_db
+from .routers import fan_out, shards_for
+import hashlib
+import heapq
 import logging
+import orjson
 
 logger = logging.getLogger(__name__)
 
+_renderer = ORJSONRenderer()
 
-class SendEmailView(APIView):
+
+def _make_etag(*parts):
+    """Build a strong ETag from the given version components"""
+    raw = ":".join(str(part) for part in parts)
+    return '"%s"' % hashlib.md5(raw.encode()).hexdigest()
+
+
+def _conditional(request, etag, last_modified, build_response):
+    """
+    Answer a conditional GET with 304 when the validators match,
+    otherwise build the full response. Both carry the ETag, and
+    Last-Modified unless it is None. If-None-Match, when sent, takes
+    precedence over If-Modified-Since (RFC 9110 13.2.2).
+    """
+    last_modified = int(last_modified.timestamp()) if last_modified else None
+    response = get_conditional_response(
+        request, etag=etag, last_modified=last_modified
+    )
+    if response is None:
+        response = build_response()
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def _caller(request):
+    """Service identity resolved by InternalAPIKeyMiddleware"""
+    return getattr(request, 'internal_service', None)
+
+
+def _json_response(data, status=200):
+    return HttpResponse(
+        _renderer.render(data),
+        status=status,
+        content_type='application/json'
+    )
+
+
+class SendEmailView(View):
     """
     Send email endpoint - called by other microservices
     
     POST /api/v1/email/send
+    
+    Async view: under ASGI a burst of sends (or a slow broker) no longer
+    holds a worker thread per request.
     """
     
-    def post(self, request):
+    async def post(self, request):
         """
         Send an email synchronously or asynchronously
         
@@ -35,12 +110,24 @@ class SendEmailView(APIView):
             "bcc": ["bcc@example.com"],
             "service_name": "auth-service",
             "user_id": "user-uuid",
+            "attachments": ["attachment-uuid"],
             "send_async": true
         }
+        
+        Attachments are uploaded first via POST /api/v1/email/attachments
+        and referenced here by id.
         """
-        serializer = SendEmailSerializer(data=request.data)
+        try:
+            payload = orjson.loads(request.body)
+        except orjson.JSONDecodeError as e:
+            return _json_response({
+                "success": False,
+                "error": f"JSON parse error - {e}"
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        serializer = SendEmailSerializer(data=payload)
         if not serializer.is_valid():
-            return Response(
+            return _json_response(
                 {"success": False, "errors": serializer.errors},
                 status=status.HTTP_400_BAD_REQUEST
             )
@@ -48,49 +135,108 @@ class SendEmailView(APIView):
         data = serializer.validated_data
         send_async = data.pop('send_async', True)
         
+        # The caller may only send on behalf of its own service
+        caller = getattr(request, 'internal_service', None)
+        if caller is not None:
+            if caller == SHARED_KEY_IDENTITY:
+                allowed = data['service_name'] in settings.ALLOWED_SERVICES
+            else:
+                allowed = data['service_name'] == caller
+            if not allowed:
+                logger.warning(
+                    "Service %s tried to send as %s", caller, data['service_name']
+                )
+                return _json_response({
+                    "success": False,
+                    "error": "service_name does not match API key"
+                }, status=status.HTTP_403_FORBIDDEN)
+        
+        attachment_ids = list(dict.fromkeys(
+            str(attachment_id) for attachment_id in data.get('attachments') or []
+        ))
+        if attachment_ids:
+            # Only the uploading service may send an attachment
+            found = await EmailAttachment.objects.filter(
+                id__in=attachment_ids, service_name=caller or ''
+            ).acount()
+            if found != len(attachment_ids):
+                return _json_response({
+                    "success": False,
+                    "errors": {"attachments": ["Unknown attachment id"]}
+                }, status=status.HTTP_400_BAD_REQUEST)
+        # Only ids travel through the broker, never file contents
+        data['attachments'] = attachment_ids or None
+        
         try:
+            # The caller's next reads should see this send
+            await sync_to_async(mark_write, thread_sensitive=False)(caller)
+            
             if send_async:
                 # Send via Celery (async)
-                task = send_email_task.delay(**data)
-                logger.info(f"Email queued with task ID: {task.id}")
-                return Response({
+                task = await apublish(send_email_task, data)
+                EMAILS.labels(data['service_name'], EmailStatus.QUEUED).inc()
+                logger.info(
+                    "Email queued with task ID: %s", task.id,
+                    extra={'sampled': True}
+                )
+                return _json_response({
                     "success": True,
                     "message": "Email queued for sending",
                     "task_id": task.id
                 }, status=status.HTTP_202_ACCEPTED)
             else:
                 # Send immediately (sync)
-                result = EmailService.send_email(**data)
-                return Response(result, status=status.HTTP_200_OK)
+                result = await arun_send(EmailService.send_email, data)
+                return _json_response(result, status=status.HTTP_200_OK)
                 
         except Exception as e:
-            logger.error(f"Email send error: {str(e)}")
-            return Response({
+            logger.error("Email send error: %s", e)
+            return _json_response({
                 "success": False,
                 "error": str(e)
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
-class EmailStatusView(APIView):
+class EmailStatusView(View):
     """
     Check email status by email_id
     
-    GET /api/v1/email/status/<email_id>
+    GET /api/v1/email/status/<email_id>?service_name=xxx&user_id=xxx
+    
+    The optional shard key parameters pick the shard directly,
+    otherwise every shard is asked in parallel.
     """
     
-    def get(self, request, email_id):
-        try:
-            email_log = EmailLog.objects.get(id=email_id)
-            serializer = EmailLogSerializer(email_log)
-            return Response({
-                "success": True,
-                "data": serializer.data
-            })
-        except EmailLog.DoesNotExist:
-            return Response({
+    async def get(self, request, email_id):
+        caller = _caller(request)
+        aliases = shards_for(
+            request.GET.get('service_name'), request.GET.get('user_id')
+        )
+        if len(aliases) == 1:
+            alias = await sync_to_async(read_db, thread_sensitive=False)(
+                aliases[0], caller
+            )
+            email_log = await EmailLog.objects.using(alias).filter(id=email_id).afirst()
+        else:
+            found = await sync_to_async(fan_out)(
+                lambda alias: EmailLog.objects.using(
+                    read_db(alias, caller)
+                ).filter(id=email_id).first(),
+                aliases
+            )
+            email_log = next((row for row in found if row is not None), None)
+        
+        if email_log is None:
+            return _json_response({
                 "success": False,
                 "error": "Email not found"
             }, status=status.HTTP_404_NOT_FOUND)
+        
+        serializer = EmailLogSerializer(email_log)
+        return _json_response({
+            "success": True,
+            "data": serializer.data
+        })
 
 
 class EmailHistoryView(APIView):
@@ -98,6 +244,10 @@ class EmailHistoryView(APIView):
     Get email history for a user or service
     
     GET /api/v1/email/history?user_id=xxx&service_name=xxx&status=xxx
+    GET /api/v1/email/history?...&fields=summary  (without bodies and template data)
+    
+    Bodies are stored compressed. The summary listing leaves them out,
+    so it never fetches or decompresses them.
     """
     
     def get(self, request):
@@ -106,6 +256,7 @@ class EmailHistoryView(APIView):
         service_name = request.query_params.get('service_name')
         email_status = request.query_params.get('status')
         to_email = request.query_params.get('to_email')
+        summary = request.query_params.get('fields') == 'summary'
         
         # Build query
         queryset = EmailLog.objects.all()
@@ -126,14 +277,43 @@ class EmailHistoryView(APIView):
         start = (page - 1) * page_size
         end = start + page_size
         
-        total = queryset.count()
-        emails = queryset[start:end]
+        if summary:
+            def fetch(rows):
+                return serialize_values(rows, EmailLogListSerializer)
+            created_at = itemgetter('created_at')
+        else:
+            # Instances: the compressed columns decompress as they're serialized
+            fetch = list
+            created_at = attrgetter('created_at')
+        
+        caller = _caller(request)
+        aliases = shards_for(service_name, user_id)
+        if len(aliases) == 1:
+            queryset = queryset.using(read_db(aliases[0], caller))
+            total = queryset.count()
+            emails = fetch(queryset[start:end])
+        else:
+            # Each shard returns its newest `end` rows; merging those is
+            # enough to cut the requested page
+            def query_shard(alias):
+                shard_queryset = queryset.using(read_db(alias, caller))
+                return shard_queryset.count(), fetch(shard_queryset[:end])
+            
+            results = fan_out(query_shard, aliases)
+            total = sum(count for count, _ in results)
+            merged = heapq.merge(
+                *(rows for _, rows in results),
+                key=created_at,
+                reverse=True
+            )
+            emails = list(islice(merged, start, end))
         
-        serializer = EmailLogSerializer(emails, many=True)
+        if not summary:
+            emails = EmailLogSerializer(emails, many=True).data
         
         return Response({
             "success": True,
-            "data": serializer.data,
+            "data": emails,
             "pagination": {
                 "total": total,
                 "page": page,
@@ -148,21 +328,54 @@ class EmailTemplateListView(APIView):
     List all email templates
     
     GET /api/v1/templates
+    GET /api/v1/templates?include=content  (with html/text bodies)
+    
+    Supports conditional GET via ETag. The collection version is
+    derived from the newest updated_at, the row count and a hash of the
+    ids, so polling an unchanged list costs one aggregate query and a
+    304. There is no Last-Modified: a deletion can't move it forward.
     """
     
     def get(self, request):
-        templates = EmailTemplate.objects.filter(is_active=True)
-        serializer = EmailTemplateSerializer(templates, many=True)
-        return Response({
-            "success": True,
-            "data": serializer.data
-        })
+        templates = EmailTemplate.objects.using(
+            read_db('default', _caller(request))
+        ).filter(is_active=True)
+        include_content = request.query_params.get('include') == 'content'
+        
+        version = templates.aggregate(
+            last_modified=Max('updated_at'),
+            count=Count('id'),
+            # A delete and a create in the same second leave the count
+            # and newest updated_at as they were, but not the ids
+            ids=MD5(StringAgg(Cast('id', TextField()), ',', order_by='id'))
+        )
+        etag = _make_etag(
+            'templates',
+            version['count'],
+            version['last_modified'] and version['last_modified'].isoformat(),
+            version['ids'],
+            'content' if include_content else 'summary'
+        )
+        
+        def build_response():
+            serializer_class = (
+                EmailTemplateSerializer if include_content
+                else EmailTemplateListSerializer
+            )
+            serializer = serializer_class(templates, many=True)
+            return Response({
+                "success": True,
+                "data": serializer.data
+            })
+        
+        return _conditional(request, etag, None, build_response)
     
     def post(self, request):
         """Create a new template"""
         serializer = EmailTemplateSerializer(data=request.data)
         if serializer.is_valid():
             serializer.save()
+            mark_write(_caller(request))
             return Response({
                 "success": True,
                 "data": serializer.data
@@ -182,17 +395,25 @@ class EmailTemplateDetailView(APIView):
     
     def get(self, request, template_id):
         try:
-            template = EmailTemplate.objects.get(id=template_id)
-            serializer = EmailTemplateSerializer(template)
-            return Response({
-                "success": True,
-                "data": serializer.data
-            })
+            template = EmailTemplate.objects.using(
+                read_db('default', _caller(request))
+            ).get(id=template_id)
         except EmailTemplate.DoesNotExist:
             return Response({
                 "success": False,
                 "error": "Template not found"
             }, status=status.HTTP_404_NOT_FOUND)
+        
+        etag = _make_etag(template.id, template.updated_at.isoformat())
+        
+        def build_response():
+            serializer = EmailTemplateSerializer(template)
+            return Response({
+                "success": True,
+                "data": serializer.data
+            })
+        
+        return _conditional(request, etag, template.updated_at, build_response)
     
     def put(self, request, template_id):
         try:
@@ -200,6 +421,7 @@ class EmailTemplateDetailView(APIView):
             serializer = EmailTemplateSerializer(template, data=request.data, partial=True)
             if serializer.is_valid():
                 serializer.save()
+                mark_write(_caller(request))
                 return Response({
                     "success": True,
                     "data": serializer.data
@@ -218,6 +440,7 @@ class EmailTemplateDetailView(APIView):
         try:
             template = EmailTemplate.objects.get(id=template_id)
             template.delete()
+            mark_write(_caller(request))
             return Response({
                 "success": True,
                 "message": "Template deleted"
@@ -229,39 +452,110 @@ class EmailTemplateDetailView(APIView):
             }, status=status.HTTP_404_NOT_FOUND)
 
 
+class AttachmentUploadView(APIView):
+    """
+    Upload an attachment once, then reference it by id when sending
+    
+    POST /api/v1/email/attachments (multipart, field "file")
+    
+    Every upload gets its own id, owned by the calling service. Identical
+    content is stored only once.
+    """
+    
+    def post(self, request):
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({
+                "success": False,
+                "error": "Missing file"
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            attachment = store_upload(upload, _caller(request) or '')
+        except AttachmentTooLarge as e:
+            return Response({
+                "success": False,
+                "error": str(e)
+            }, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        
+        serializer = EmailAttachmentSerializer(attachment)
+        return Response({
+            "success": True,
+            "data": serializer.data
+        }, status=status.HTTP_201_CREATED)
+
+
 class HealthCheckView(APIView):
     """
     Health check endpoint
     
     GET /api/v1/health
+    
+    Serves the snapshot kept by the background health monitor: DB pool
+    state, broker queue depth and oldest task age, live workers and
+    recent per-provider success rate / p95 latency.
     """
     
     def get(self, request):
-        # Check database connection
-        try:
-            connection.ensure_connection()
-            db_status = "connected"
-        except Exception as e:
-            db_status = f"error: {str(e)}"
-        
-        # Check Celery (optional)
-        celery_status = "unknown"
-        try:
-            from .tasks import send_email_task
-            # Try to inspect Celery
-            celery_status = "available"
-        except Exception:
-            celery_status = "unavailable"
+        snapshot = monitor.snapshot()
+        if snapshot is None:
+            return Response({
+                "status": "starting",
+                "service": "email-service",
+                "version": "1.0.0"
+            })
         
         return Response({
-            "status": "healthy",
+            "status": "healthy" if monitor.is_ready(snapshot) else "degraded",
             "service": "email-service",
-            "database": db_status,
-            "celery": celery_status,
-            "version": "1.0.0"
+            "version": "1.0.0",
+            **snapshot
         })
 
 
+class ReadinessView(APIView):
+    """
+    Readiness probe, 503 until the latest snapshot is fresh and healthy
+    
+    GET /api/v1/health/ready
+    """
+    
+    def get(self, request):
+        snapshot = monitor.snapshot()
+        if not monitor.is_ready(snapshot):
+            return Response(
+                {"ready": False},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE
+            )
+        return Response({"ready": True})
+
+
+def metrics_view(request):
+    """
+    Prometheus scrape endpoint
+    
+    GET /metrics
+    """
+    payload, content_type = render_latest()
+    return HttpResponse(payload, content_type=content_type)
+
+
+def tracking_view(request, path):
+    """
+    Open pixel and click redirect
+    
+    GET /t/o/<token>.gif, GET /t/c/<token>
+    
+    Under ASGI these are answered by TrackingApp before Django; this
+    view serves the same responses under WSGI/runserver.
+    """
+    status_code, headers, body = hit(path, request.method)
+    response = HttpResponse(body, status=status_code)
+    for name, value in headers:
+        response[name.decode()] = value.decode('latin-1')
+    return response
+
+
 class EmailStatsView(APIView):
     """
     Get email statistics
@@ -270,25 +564,34 @@ class EmailStatsView(APIView):
     """
     
     def get(self, request):
-        from django.db.models import Count
-        from .models import EmailStatus
+        fields = ('status', 'service_name', 'provider')
+        caller = _caller(request)
         
-        # Get counts by status
-        stats = EmailLog.objects.values('status').annotate(count=Count('id'))
+        def shard_stats(alias):
+            logs = EmailLog.objects.using(read_db(alias, caller))
+            return {
+                field: dict(logs.values_list(field).annotate(count=Count('id')))
+                for field in fields
+            }
         
-        # Get counts by service
-        by_service = EmailLog.objects.values('service_name').annotate(count=Count('id'))
+        # Aggregate every shard in parallel, then sum the counts
+        totals = {field: Counter() for field in fields}
+        for stats in fan_out(shard_stats, shards_for()):
+            for field, counts in stats.items():
+                totals[field].update(counts)
         
-        # Get counts by provider
-        by_provider = EmailLog.objects.values('provider').annotate(count=Count('id'))
+        def rows(field):
+            return [
+                {field: value, "count": count}
+                for value, count in totals[field].items()
+            ]
         
         return Response({
             "success": True,
             "data": {
-                "by_status": list(stats),
-                "by_service": list(by_service),
-                "by_provider": list(by_provider),
-                "total_emails": EmailLog.objects.count()
+                "by_status": rows('status'),
+                "by_service": rows('service_name'),
+                "by_provider": rows('provider'),
+                "total_emails": sum(totals['status'].values())
             }
         })
-
@@ -0,0 +1,124 @@
+"""
+Fan-out cost of notifying many users at once.
+
+Compares the per-user path (one Notification INSERT, one serializer
+call and one send_notification_task run per user) with the bulk path
+(bulk_notification_task per chunk: bulk_create plus one pipelined
+publish). Tasks run in process, so the numbers are DB + Redis + CPU
+without broker round trips. A subscriber on the Socket.IO channel
+counts the emits that actually reach Redis.
+
+The per-user path is timed on --baseline-users and extrapolated.
+Uses the database and Redis from core/.env; rows are deleted after.
+
+Usage (from the notification/ directory):
+    python -m benchmarks.bulk_fanout [--users 100000] [--baseline-users 2000]
+"""
+import argparse
+import os
+import threading
+import time
+import uuid
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+django.setup()
+
+import redis  # noqa: E402
+from django.conf import settings  # noqa: E402
+
+from notifications.emitter import CHANNEL  # noqa: E402
+from notifications.fanout import chunked  # noqa: E402
+from notifications.models import Notification  # noqa: E402
+from notifications.serializers import NotificationSerializer  # noqa: E402
+from notifications.tasks import bulk_notification_task, send_notification_task  # noqa: E402
+
+TITLE = 'benchmark:bulk_fanout'
+
+
+class EmitCounter:
+    """Counts messages published on the Socket.IO channel"""
+
+    def __init__(self):
+        self.count = 0
+        self.pubsub = redis.Redis.from_url(settings.REDIS_URL).pubsub(
+            ignore_subscribe_messages=True
+        )
+        self.pubsub.subscribe(CHANNEL)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        for message in self.pubsub.listen():
+            if message['type'] == 'message':
+                self.count += 1
+
+    def wait_for(self, expected, timeout=60.0):
+        deadline = time.perf_counter() + timeout
+        while self.count < expected and time.perf_counter() < deadline:
+            time.sleep(0.01)
+        return self.count
+
+
+def per_user(user_ids):
+    for user_id in user_ids:
+        notification = Notification.objects.create(
+            user_id=user_id, title=TITLE, message='hello'
+        )
+        data = NotificationSerializer(notification).data
+        send_notification_task.run(data, str(user_id))
+
+
+def bulk(user_ids, chunk_size):
+    batch_id = str(uuid.uuid4())
+    for chunk in chunked(user_ids, chunk_size):
+        bulk_notification_task.run(batch_id, TITLE, 'hello', chunk)
+
+
+def run(label, func, user_ids, counter, scale=1):
+    received_before = counter.count
+    started_cpu = time.process_time()
+    started = time.perf_counter()
+    func(user_ids)
+    elapsed = time.perf_counter() - started
+    cpu = time.process_time() - started_cpu
+    received = counter.wait_for(received_before + len(user_ids)) - received_before
+    per_user_us = elapsed / len(user_ids) * 1e6
+    print(f'{label:<28} {len(user_ids):>7} users  {elapsed:>8.2f}s  '
+          f'{len(user_ids) / elapsed:>9.0f} users/s  {per_user_us:>7.0f} us/user  '
+          f'cpu {cpu / len(user_ids) * 1e6:>5.0f} us/user  emits seen {received}')
+    if scale != 1:
+        print(f'{"":<28} ~{elapsed * scale:.0f}s extrapolated to {len(user_ids) * scale} users')
+    return elapsed / len(user_ids)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--baseline-users', type=int, default=2000)
+    parser.add_argument('--chunk-size', type=int, default=settings.BULK_NOTIFICATION_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    counter = EmitCounter()
+    try:
+        baseline_ids = [str(uuid.uuid4()) for _ in range(args.baseline_users)]
+        user_ids = [str(uuid.uuid4()) for _ in range(args.users)]
+
+        baseline = run(
+            'per-user task', per_user, baseline_ids, counter,
+            scale=args.users / args.baseline_users
+        )
+        fast = run(
+            f'bulk, chunks of {args.chunk_size}',
+            lambda ids: bulk(ids, args.chunk_size), user_ids, counter
+        )
+        print(f'celery tasks: {args.users} -> {-(-args.users // args.chunk_size)}')
+        print(f'speedup: {baseline / fast:.1f}x per user')
+    finally:
+        deleted, _ = Notification.objects.filter(title=TITLE).delete()
+        print(f'cleaned up {deleted} rows')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+"""
+Per-notification CPU and latency of a Socket.IO emit from outside the
+Socket.IO server.
+
+Compares:
+- legacy: what send_notification_task used to do, a fresh event loop
+  and AsyncRedisManager connection per notification
+- task: send_notification_task on the process-wide write-only emitter
+- direct: the emitter called inline (NOTIFICATION_DIRECT_EMIT)
+- batched: Emitter.send_many, --batch emits per pipeline
+
+CPU is the emitting thread's CPU time. Latency runs from the call to
+the message arriving at a subscriber on the Socket.IO channel. Uses the
+Redis from REDIS_URL.
+
+Usage (from the notification/ directory):
+    python -m benchmarks.emit_latency [--count 2000] [--batch 100]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import threading
+import time
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+django.setup()
+
+import orjson  # noqa: E402
+import redis  # noqa: E402
+import socketio  # noqa: E402
+from django.conf import settings  # noqa: E402
+
+from notifications.emitter import CHANNEL, get_emitter  # noqa: E402
+from notifications.tasks import send_notification_task  # noqa: E402
+
+
+class Arrivals:
+    """Records when each numbered emit reaches the channel"""
+
+    def __init__(self):
+        self.seen = {}
+        self.arrived = threading.Condition()
+        self.pubsub = redis.Redis.from_url(settings.REDIS_URL).pubsub(
+            ignore_subscribe_messages=True
+        )
+        self.pubsub.subscribe(CHANNEL)
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        for message in self.pubsub.listen():
+            if message['type'] == 'message':
+                received = time.perf_counter()
+                data = orjson.loads(message['data'])['data']
+                with self.arrived:
+                    self.seen[data['seq']] = received
+                    self.arrived.notify()
+
+    def wait_for(self, seqs, timeout=30.0):
+        with self.arrived:
+            self.arrived.wait_for(
+                lambda: all(seq in self.seen for seq in seqs), timeout
+            )
+
+
+def payload(seq):
+    return {
+        'seq': seq,
+        'id': '00000000-0000-0000-0000-000000000000',
+        'user_id': '11111111-1111-1111-1111-111111111111',
+        'title': 'benchmark',
+        'message': 'hello',
+        'is_read': False,
+        'created_at': '2026-01-01T00:00:00Z',
+    }
+
+
+ROOM = 'user_11111111-1111-1111-1111-111111111111'
+
+_legacy_server = None
+
+
+def legacy(batch):
+    global _legacy_server
+    if _legacy_server is None:
+        _legacy_server = socketio.AsyncServer(
+            client_manager=socketio.AsyncRedisManager(settings.REDIS_URL)
+        )
+    for data in batch:
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            # The connection can't outlive its loop
+            _legacy_server.manager._redis_connect()
+            loop.run_until_complete(
+                _legacy_server.emit('new_notification', data, room=ROOM)
+            )
+        finally:
+            loop.close()
+
+
+def task(batch):
+    for data in batch:
+        send_notification_task.run(data, ROOM[len('user_'):])
+
+
+def direct(batch):
+    emitter = get_emitter()
+    for data in batch:
+        emitter.send('new_notification', data, room=ROOM)
+
+
+def batched(batch):
+    get_emitter().send_many('new_notification', [(ROOM, data) for data in batch])
+
+
+def run(label, func, arrivals, start, count, batch_size):
+    cpu = 0.0
+    latencies = []
+    seq = start
+    while seq < start + count:
+        batch = [payload(n) for n in range(seq, min(seq + batch_size, start + count))]
+        cpu_started = time.thread_time()
+        started = time.perf_counter()
+        func(batch)
+        cpu += time.thread_time() - cpu_started
+        arrivals.wait_for([data['seq'] for data in batch])
+        latencies.extend(arrivals.seen[data['seq']] - started for data in batch)
+        seq += len(batch)
+    latencies.sort()
+    p95 = latencies[int(len(latencies) * 0.95)]
+    print(f'{label:<18} cpu {cpu / count * 1e6:>7.0f} us/notif   '
+          f'latency p50 {statistics.median(latencies) * 1e3:>6.2f} ms  '
+          f'p95 {p95 * 1e3:>6.2f} ms')
+    return start + count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--count', type=int, default=2000)
+    parser.add_argument('--batch', type=int, default=100)
+    args = parser.parse_args()
+
+    arrivals = Arrivals()
+    time.sleep(0.2)  # let the subscription settle
+    seq = 0
+    seq = run('legacy task', legacy, arrivals, seq, args.count, 1)
+    seq = run('emitter task', task, arrivals, seq, args.count, 1)
+    seq = run('direct emit', direct, arrivals, seq, args.count, 1)
+    run(f'send_many x{args.batch}', batched, arrivals, seq, args.count, args.batch)
+
+
+if __name__ == '__main__':
+    main()
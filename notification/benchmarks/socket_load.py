@@ -0,0 +1,241 @@
+"""
+How many Socket.IO connections a notification node holds, and how fast.
+
+Opens --clients simulated clients against a running server, each with
+its own user_id, over the websocket transport (Engine.IO 4 on wsproto,
+no polling; --deflate offers permessage-deflate like a browser).
+Clients answer pings and time every new_notification they
+receive. Reports:
+- connect rate: handshakes completed per second
+- connections/GB: connections divided by the server's RSS growth,
+  summed over the --pid processes and their children (the uvicorn
+  workers)
+- emit-to-receive latency: --emits notifications published through the
+  write-only emitter to random connected users, from the publish to
+  the client reading it
+
+One process holds ~28k connections per local address (ephemeral
+ports). Past that, bind several loopback addresses with --local-addrs
+127.0.0.2,127.0.0.3,... or run several copies. Raise `ulimit -n` on
+both sides. Uses the Redis from REDIS_URL, which must be the server's.
+
+Usage (from the notification/ directory):
+    python -m benchmarks.socket_load http://localhost:8000 --clients 20000 \
+        --pid $(pgrep -o -f 'uvicorn core.asgi') [--emits 2000]
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import random
+import statistics
+import time
+import uuid
+from urllib.parse import urlsplit
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+django.setup()
+
+import orjson  # noqa: E402
+from wsproto import ConnectionType, WSConnection  # noqa: E402
+from wsproto.extensions import PerMessageDeflate  # noqa: E402
+from wsproto.events import (  # noqa: E402
+    AcceptConnection, CloseConnection, Ping, RejectConnection, Request, TextMessage,
+)
+
+from notifications.emitter import get_emitter  # noqa: E402
+
+
+def with_children(pids):
+    """pids plus all their descendants, e.g. uvicorn's worker processes"""
+    found = []
+    while pids:
+        pid = pids.pop()
+        found.append(pid)
+        try:
+            with open(f'/proc/{pid}/task/{pid}/children') as children:
+                pids.extend(int(child) for child in children.read().split())
+        except FileNotFoundError:
+            pass
+    return found
+
+
+def rss(pids):
+    """Summed resident memory of pids in bytes, None without pids"""
+    if not pids:
+        return None
+    total = 0
+    for pid in pids:
+        with open(f'/proc/{pid}/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    total += int(line.split()[1]) * 1024
+    return total
+
+
+class Client:
+    """One Socket.IO client speaking Engine.IO 4 over a raw websocket"""
+
+    def __init__(self, user_id, latencies, deflate=False):
+        self.user_id = user_id
+        self.extensions = [PerMessageDeflate()] if deflate else []
+        self.latencies = latencies
+        self.ws = WSConnection(ConnectionType.CLIENT)
+        self.connected = asyncio.Event()
+        self.reader = self.writer = None
+        self.error = None
+        self.text = []
+
+    async def connect(self, host, port, path, local_addr=None):
+        self.reader, self.writer = await asyncio.open_connection(
+            host, port, local_addr=(local_addr, 0) if local_addr else None
+        )
+        self._send(Request(host=f'{host}:{port}', target=path, extensions=self.extensions))
+        asyncio.get_running_loop().create_task(self._read())
+        await self.connected.wait()
+        if self.error:
+            raise self.error
+
+    def _send(self, event):
+        self.writer.write(self.ws.send(event))
+
+    def _packet(self, packet):
+        if packet[0] == '0':  # Engine.IO open: join the default namespace
+            auth = orjson.dumps({'user_id': self.user_id}).decode()
+            self._send(TextMessage(data='40' + auth))
+        elif packet[0] == '2':  # ping
+            self._send(TextMessage(data='3'))
+        elif packet.startswith('40'):
+            self.connected.set()
+        elif packet.startswith('42'):
+            event, data = orjson.loads(packet[2:])[:2]
+            if event == 'new_notification' and 'sent_at' in data:
+                self.latencies.append(time.time() - data['sent_at'])
+        elif packet.startswith('44') or packet[0] == '1':
+            raise ConnectionError(f'rejected: {packet}')
+
+    async def _read(self):
+        try:
+            while data := await self.reader.read(65536):
+                self.ws.receive_data(data)
+                for event in self.ws.events():
+                    if isinstance(event, TextMessage):
+                        self.text.append(event.data)
+                        if event.message_finished:
+                            self._packet(''.join(self.text))
+                            self.text = []
+                    elif isinstance(event, Ping):
+                        self._send(event.response())
+                    elif isinstance(event, (CloseConnection, RejectConnection)):
+                        raise ConnectionError('closed by server')
+                    elif isinstance(event, AcceptConnection):
+                        pass
+            raise ConnectionError('connection closed')
+        except (OSError, ConnectionError) as e:
+            self.error = e
+        finally:
+            self.writer.close()
+            self.connected.set()
+
+
+async def open_clients(args, latencies):
+    url = urlsplit(args.url)
+    host, port = url.hostname, url.port or 80
+    path = '/socket.io/?EIO=4&transport=websocket'
+    local_addrs = itertools.cycle(args.local_addrs.split(',') if args.local_addrs else [None])
+    semaphore = asyncio.Semaphore(args.concurrency)
+    clients, failures = [], []
+
+    async def one():
+        client = Client(str(uuid.uuid4()), latencies, args.deflate)
+        async with semaphore:
+            try:
+                await asyncio.wait_for(
+                    client.connect(host, port, path, next(local_addrs)), args.timeout
+                )
+                clients.append(client)
+            except (OSError, ConnectionError, asyncio.TimeoutError) as e:
+                failures.append(e)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(args.clients)))
+    elapsed = time.perf_counter() - started
+    if failures:
+        print(f'{len(failures)} connections failed, first: {failures[0]!r}')
+    return clients, elapsed
+
+
+async def emit_to(clients, args, latencies):
+    """Publish --emits notifications to random users at --emit-rate/s"""
+    loop = asyncio.get_running_loop()
+    emitter = get_emitter()
+    interval = 1 / args.emit_rate
+    for seq in range(args.emits):
+        client = random.choice(clients)
+        data = {'seq': seq, 'sent_at': time.time()}
+        # Publishing is blocking Redis I/O, keep it off the client loop
+        await loop.run_in_executor(
+            None, emitter.send, 'new_notification', data, f'user_{client.user_id}'
+        )
+        await asyncio.sleep(interval)
+    deadline = time.monotonic() + args.timeout
+    while len(latencies) < args.emits and time.monotonic() < deadline:
+        await asyncio.sleep(0.1)
+
+
+async def run(args):
+    pids = with_children([int(pid) for pid in args.pid.split(',')] if args.pid else [])
+    latencies = []
+    rss_before = rss(pids)
+
+    clients, elapsed = await open_clients(args, latencies)
+    print(f'connected {len(clients)}/{args.clients} in {elapsed:.1f} s '
+          f'({len(clients) / elapsed:.0f} conn/s)')
+
+    await asyncio.sleep(args.settle)
+    rss_after = rss(pids)
+    if rss_before is not None and clients:
+        grown = max(rss_after - rss_before, 1)
+        print(f'server RSS +{grown / 2 ** 20:.0f} MiB: '
+              f'{grown / len(clients) / 1024:.1f} KiB/conn, '
+              f'{len(clients) / (grown / 2 ** 30):.0f} conn/GB')
+
+    if clients and args.emits:
+        await emit_to(clients, args, latencies)
+        if latencies:
+            latencies.sort()
+            p95 = latencies[int(len(latencies) * 0.95)]
+            p99 = latencies[int(len(latencies) * 0.99)]
+            print(f'emit-to-receive {len(latencies)}/{args.emits}: '
+                  f'p50 {statistics.median(latencies) * 1e3:.2f} ms  '
+                  f'p95 {p95 * 1e3:.2f} ms  p99 {p99 * 1e3:.2f} ms')
+        else:
+            print(f'emit-to-receive: none of {args.emits} arrived')
+
+    for client in clients:
+        client.writer.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('url', help='server base URL, e.g. http://localhost:8000')
+    parser.add_argument('--clients', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=500,
+                        help='handshakes in flight at once')
+    parser.add_argument('--pid', help='comma-separated server PIDs to measure RSS of')
+    parser.add_argument('--local-addrs', help='comma-separated local IPs to bind')
+    parser.add_argument('--deflate', action='store_true',
+                        help='offer permessage-deflate, as browsers do')
+    parser.add_argument('--emits', type=int, default=1000)
+    parser.add_argument('--emit-rate', type=float, default=500.0, help='emits per second')
+    parser.add_argument('--settle', type=float, default=2.0,
+                        help='seconds to wait before measuring RSS')
+    parser.add_argument('--timeout', type=float, default=30.0)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -2,11 +2,13 @@ import os
 import django
 import socketio
 from django.core.asgi import get_asgi_application
-from notifications.sio import sio
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "core.settings")
 django.setup()
 
+# Needs settings (REDIS_URL), so only after setup
+from notifications.sio import sio  # noqa: E402
+
 django_asgi_app = get_asgi_application()
 
 # Combine Django + Socket.IO
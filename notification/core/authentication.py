@@ -1,6 +1,10 @@
 # your_app/authentication.py
+from django.conf import settings
+from rest_framework.authentication import BaseAuthentication
+from rest_framework.exceptions import AuthenticationFailed
 from rest_framework_simplejwt.authentication import JWTAuthentication
 from rest_framework_simplejwt.exceptions import InvalidToken
+import hmac
 
 class SimpleUser:
     """
@@ -27,3 +31,32 @@ class CustomJWTAuthentication(JWTAuthentication):
             raise InvalidToken('Token contained no recognizable user identification')
         
         return SimpleUser(user_id)
+
+
+class ServiceUser(SimpleUser):
+    """
+    Another backend service, authenticated by its internal API key
+    """
+    def __init__(self, service):
+        super().__init__(None)
+        self.service = service
+    
+    def __str__(self):
+        return f"Service {self.service}"
+
+class InternalAPIKeyAuthentication(BaseAuthentication):
+    """
+    Authenticates service-to-service calls by the X-API-Key header
+    against settings.INTERNAL_API_KEYS
+    """
+    def authenticate(self, request):
+        api_key = request.headers.get('X-API-Key')
+        if not api_key:
+            return None
+        for service, key in settings.INTERNAL_API_KEYS.items():
+            if hmac.compare_digest(api_key.encode(), key.encode()):
+                return ServiceUser(service), None
+        raise AuthenticationFailed('Invalid API key')
+    
+    def authenticate_header(self, request):
+        return 'X-API-Key'
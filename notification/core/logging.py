@@ -0,0 +1,132 @@
+"""
+Non-blocking structured logging.
+
+Loggers hand records to ``QueuedHandler``, which only enqueues them; a
+``QueueListener`` thread does the formatting and the console/file I/O.
+Records carry the correlation fields bound with ``log_context()`` and
+can opt into sampling with ``extra={'sampled': True}``.
+"""
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from django.utils.module_loading import import_string
+import contextvars
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import weakref
+import orjson
+
+_context = contextvars.ContextVar('log_context', default={})
+
+
+@contextmanager
+def log_context(**fields):
+    """Attach correlation fields (email_id, task_id, user_id...) to records"""
+    bound = {key: str(value) for key, value in fields.items() if value is not None}
+    token = _context.set({**_context.get(), **bound})
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+class SampleFilter(logging.Filter):
+    """Keep only ``rate`` of the sub-WARNING records marked as sampled"""
+
+    def __init__(self, rate=1.0):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if getattr(record, 'sampled', False) and record.levelno < logging.WARNING:
+            return random.random() < self.rate
+        return True
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line, correlation fields inlined"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc)
+            .isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update(getattr(record, 'context', None) or {})
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return orjson.dumps(entry, default=str).decode()
+
+
+class TextFormatter(logging.Formatter):
+    """The previous verbose format, followed by any correlation fields"""
+
+    def __init__(self):
+        super().__init__('{levelname} {asctime} {module} {message}', style='{')
+
+    def format(self, record):
+        line = super().format(record)
+        context = getattr(record, 'context', None)
+        if context:
+            line += ' ' + ' '.join(f"{key}={value}" for key, value in context.items())
+        return line
+
+
+class QueuedHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that owns its downstream handlers and listener thread.
+
+    ``handlers`` is a list of handler configs ({'class': ..., **kwargs}).
+    Records are not formatted on the calling thread, and when the queue
+    is full they are dropped rather than blocking the caller. The
+    listener is restarted in forked children (Celery prefork, gunicorn).
+    """
+
+    def __init__(self, handlers, format='json', queue_size=10000):
+        super().__init__(queue.Queue(queue_size))
+        formatter = JSONFormatter() if format == 'json' else TextFormatter()
+        self.targets = []
+        for config in handlers:
+            config = dict(config)
+            target = import_string(config.pop('class'))(**config)
+            target.setFormatter(formatter)
+            self.targets.append(target)
+        self.dropped = 0
+        self._start()
+
+        ref = weakref.ref(self)
+        os.register_at_fork(after_in_child=lambda: ref() and ref()._restart())
+
+    def _start(self):
+        self.listener = logging.handlers.QueueListener(
+            self.queue, *self.targets, respect_handler_level=True
+        )
+        self.listener.start()
+
+    def _restart(self):
+        # The parent's listener thread doesn't survive fork
+        self.queue = queue.Queue(self.queue.maxsize)
+        self.dropped = 0
+        self._start()
+
+    def prepare(self, record):
+        # Defer message formatting to the listener, only capture context
+        record.context = _context.get()
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        if self.listener._thread is not None:
+            self.listener.stop()
+        for target in self.targets:
+            target.close()
+        super().close()
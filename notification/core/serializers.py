@@ -0,0 +1,23 @@
+from rest_framework import serializers
+
+
+def values_fields(serializer_class):
+    """Model field names rendered by a plain ModelSerializer"""
+    meta = serializer_class.Meta
+    if meta.fields == serializers.ALL_FIELDS:
+        return [field.name for field in meta.model._meta.concrete_fields]
+    return list(meta.fields)
+
+
+def serialize_values(queryset, serializer_class):
+    """
+    Fast path for list endpoints: build response rows straight from
+    ``QuerySet.values()`` instead of instantiating models and running
+    per-object serializer fields.
+
+    Only valid for serializers whose fields map 1:1 onto model columns
+    with no custom representation; the output is meant to be rendered by
+    ``core.renderers.ORJSONRenderer``, which formats datetimes and UUIDs
+    the same way DRF does.
+    """
+    return list(queryset.values(*values_fields(serializer_class)))
@@ -1,6 +1,8 @@
 from pathlib import Path
 from datetime import timedelta
 import environ
+import os
+import sys
 
 env = environ.Env()
 environ.Env.read_env()
@@ -46,6 +48,25 @@ TEMPLATES = [
 WSGI_APPLICATION = 'core.wsgi.application'
 
 # Database
+# Web and Celery worker processes each keep a psycopg 3 connection pool,
+# so requests and tasks no longer pay for a new Postgres connection. Beat
+# runs a handful of queries and keeps one persistent connection instead.
+# PROCESS_TYPE is detected from the command line and can be overridden.
+# The Socket.IO handlers use a separate async pool (notifications.db).
+def _detect_process_type():
+    if 'celery' in os.path.basename(sys.argv[0]) or 'celery' in sys.argv[:2]:
+        return 'beat' if 'beat' in sys.argv else 'worker'
+    return 'web'
+
+
+PROCESS_TYPE = env('PROCESS_TYPE', default=_detect_process_type())
+
+# Per-process defaults; a prefork worker child runs one task at a time
+DB_POOL_DEFAULTS = {
+    'web': {'min_size': 2, 'max_size': 10},
+    'worker': {'min_size': 1, 'max_size': 2},
+}
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.postgresql',
@@ -53,10 +74,43 @@ DATABASES = {
         'USER': env('DB_USER'),
         'PASSWORD': env('DB_PASS'),
         'HOST': env('DB_HOST'),
-        'PORT': env('DB_PORT')
+        'PORT': env('DB_PORT'),
+        # Validate connections (pooled ones on checkout) so restarts and
+        # failovers don't surface as request errors
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {},
     }
 }
 
+if PROCESS_TYPE == 'beat':
+    DATABASES['default']['CONN_MAX_AGE'] = env.int('DB_CONN_MAX_AGE', default=300)
+else:
+    DATABASES['default']['OPTIONS']['pool'] = {
+        'min_size': env.int('DB_POOL_MIN_SIZE', default=DB_POOL_DEFAULTS[PROCESS_TYPE]['min_size']),
+        'max_size': env.int('DB_POOL_MAX_SIZE', default=DB_POOL_DEFAULTS[PROCESS_TYPE]['max_size']),
+        'timeout': env.float('DB_POOL_TIMEOUT', default=10.0),
+        'max_idle': 300,
+        'max_lifetime': 1800,
+    }
+
+# Async pool used by the Socket.IO handlers in the web process
+SOCKETIO_DB_POOL_MIN_SIZE = env.int('SOCKETIO_DB_POOL_MIN_SIZE', default=1)
+SOCKETIO_DB_POOL_MAX_SIZE = env.int('SOCKETIO_DB_POOL_MAX_SIZE', default=10)
+
+# Socket.IO transports. Several uvicorn workers need "websocket" alone
+# unless the load balancer pins each client to one worker (polling
+# requests of one session must reach the same process).
+SOCKETIO_TRANSPORTS = env.list('SOCKETIO_TRANSPORTS', default=['polling', 'websocket'])
+# Seconds between server pings, and to wait for the pong. Keep the
+# interval under the load balancer's idle timeout.
+SOCKETIO_PING_INTERVAL = env.int('SOCKETIO_PING_INTERVAL', default=45)
+SOCKETIO_PING_TIMEOUT = env.int('SOCKETIO_PING_TIMEOUT', default=30)
+
+# Transaction-mode PgBouncer (server-side pooling) can't hold cursors
+# across transactions
+if env.bool('DB_PGBOUNCER', default=False):
+    DATABASES['default']['DISABLE_SERVER_SIDE_CURSORS'] = True
+
 # Internationalization
 LANGUAGE_CODE = 'en-us'
 TIME_ZONE = 'UTC'
@@ -76,6 +130,15 @@ REST_FRAMEWORK = {
     "DEFAULT_PERMISSION_CLASSES": (
         "rest_framework.permissions.IsAuthenticated",
     ),
+    "DEFAULT_RENDERER_CLASSES": (
+        "core.renderers.ORJSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ),
+    "DEFAULT_PARSER_CLASSES": (
+        "core.parsers.ORJSONParser",
+        "rest_framework.parsers.FormParser",
+        "rest_framework.parsers.MultiPartParser",
+    ),
 }
 
 SIMPLE_JWT = {
@@ -91,3 +154,99 @@ CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'UTC'
+
+CELERY_BEAT_SCHEDULE = {
+    'reconcile-unread-counts': {
+        'task': 'notifications.tasks.reconcile_unread_counts',
+        'schedule': 600.0,  # Every 10 minutes
+    },
+    'trim-inboxes': {
+        'task': 'notifications.tasks.trim_inboxes',
+        'schedule': 60.0,
+    },
+}
+
+# Redis carrying Socket.IO emits between workers and web processes
+REDIS_URL = env('REDIS_URL', default='redis://redis:6379/0')
+# Emit new notifications from the request itself instead of a Celery
+# task (lower latency; falls back to Celery if Redis refuses)
+NOTIFICATION_DIRECT_EMIT = env.bool('NOTIFICATION_DIRECT_EMIT', default=False)
+# Per-user stream of emitted notifications, replayed on reconnect
+NOTIFICATION_STREAM_MAXLEN = env.int('NOTIFICATION_STREAM_MAXLEN', default=200)
+NOTIFICATION_STREAM_TTL_SECONDS = env.int('NOTIFICATION_STREAM_TTL_SECONDS', default=7 * 24 * 3600)
+# Track which users have a socket connected, and don't publish emits
+# to users who don't. Their new notifications go to the optional
+# NOTIFICATION_OFFLINE_HANDLER instead: the dotted path of a callable
+# taking a list of (user_id, payload), e.g. one queueing an email digest.
+NOTIFICATION_PRESENCE = env.bool('NOTIFICATION_PRESENCE', default=True)
+NOTIFICATION_PRESENCE_HEARTBEAT_SECONDS = env.int('NOTIFICATION_PRESENCE_HEARTBEAT_SECONDS', default=30)
+NOTIFICATION_OFFLINE_HANDLER = env('NOTIFICATION_OFFLINE_HANDLER', default=None)
+# Bursts of new notifications to one user are sent as one
+# new_notifications list once no more arrive for the window, holding
+# none longer than the max delay. A window of 0 turns this off.
+NOTIFICATION_COALESCE_WINDOW_MS = env.int('NOTIFICATION_COALESCE_WINDOW_MS', default=200)
+NOTIFICATION_COALESCE_MAX_DELAY_MS = env.int('NOTIFICATION_COALESCE_MAX_DELAY_MS', default=1000)
+NOTIFICATION_COALESCE_STATS_SECONDS = env.int('NOTIFICATION_COALESCE_STATS_SECONDS', default=10)
+# Cached per-user unread counts, dropped after this long untouched
+NOTIFICATION_UNREAD_TTL_SECONDS = env.int('NOTIFICATION_UNREAD_TTL_SECONDS', default=30 * 24 * 3600)
+
+# Inbox page size (?page_size may ask for up to the max)
+NOTIFICATION_PAGE_SIZE = env.int('NOTIFICATION_PAGE_SIZE', default=20)
+NOTIFICATION_MAX_PAGE_SIZE = env.int('NOTIFICATION_MAX_PAGE_SIZE', default=100)
+
+# Most ids one mark-read request (REST or Socket.IO) may carry
+NOTIFICATION_MARK_READ_MAX_IDS = env.int('NOTIFICATION_MARK_READ_MAX_IDS', default=500)
+
+# Inbox limits: the newest NOTIFICATION_INBOX_MAX per user, and read
+# ones for NOTIFICATION_READ_RETENTION_DAYS. Enforced by trim_inboxes,
+# which handles a slice of users and deletes per run.
+NOTIFICATION_INBOX_MAX = env.int('NOTIFICATION_INBOX_MAX', default=1000)
+NOTIFICATION_READ_RETENTION_DAYS = env.int('NOTIFICATION_READ_RETENTION_DAYS', default=30)
+NOTIFICATION_TRIM_USERS_PER_RUN = env.int('NOTIFICATION_TRIM_USERS_PER_RUN', default=500)
+NOTIFICATION_TRIM_MAX_DELETES = env.int('NOTIFICATION_TRIM_MAX_DELETES', default=20000)
+NOTIFICATION_TRIM_CHUNK_SIZE = env.int('NOTIFICATION_TRIM_CHUNK_SIZE', default=500)
+
+# Service-to-service keys for the bulk endpoint: "auth-service=key1,..."
+INTERNAL_API_KEYS = env.dict('INTERNAL_API_KEYS', default={})
+
+# Bulk / broadcast fan-out: rows per bulk_create and per Celery task
+BULK_NOTIFICATION_CHUNK_SIZE = env.int('BULK_NOTIFICATION_CHUNK_SIZE', default=1000)
+BULK_NOTIFICATION_MAX_USERS = env.int('BULK_NOTIFICATION_MAX_USERS', default=100000)
+
+# Loggers only enqueue records; a listener thread formats and writes
+# them, so console I/O never blocks the Socket.IO event loop.
+LOG_LEVEL = env('LOG_LEVEL', default='INFO')
+LOG_FORMAT = env('LOG_FORMAT', default='json')  # json | text
+# Fraction of high-volume success lines (created/sent) kept
+LOG_SUCCESS_SAMPLE_RATE = env.float('LOG_SUCCESS_SAMPLE_RATE', default=1.0)
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'filters': {
+        'sample': {
+            '()': 'core.logging.SampleFilter',
+            'rate': LOG_SUCCESS_SAMPLE_RATE,
+        },
+    },
+    'handlers': {
+        'queue': {
+            '()': 'core.logging.QueuedHandler',
+            'format': LOG_FORMAT,
+            'filters': ['sample'],
+            'handlers': [
+                {'class': 'logging.StreamHandler'},
+            ],
+        },
+    },
+    'loggers': {
+        'django': {
+            'handlers': ['queue'],
+            'level': 'INFO',
+        },
+        'notifications': {
+            'handlers': ['queue'],
+            'level': LOG_LEVEL,
+        },
+    },
+}
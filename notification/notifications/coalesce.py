@@ -0,0 +1,134 @@
+"""
+Per-user coalescing of new_notification emits on the Socket.IO side.
+
+The first new_notification for a user room goes out at once and opens a
+window. Notifications arriving while it is open are held until
+NOTIFICATION_COALESCE_WINDOW_MS passes without another one, but never
+longer than NOTIFICATION_COALESCE_MAX_DELAY_MS after the window opened.
+Then they go out as one ``new_notifications`` event carrying a list (a
+lone one stays a plain new_notification), and the window starts over.
+A quiet user sees no added latency and a burst costs one emit and one
+re-render per window.
+
+Each worker coalesces for its own sockets. Running totals are added to
+the notif:coalesce:stats hash every NOTIFICATION_COALESCE_STATS_SECONDS:
+``notifications`` received, ``emits`` sent, and ``saved``.
+"""
+import asyncio
+import collections
+import logging
+import time
+
+import redis
+import socketio
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+STATS_KEY = 'notif:coalesce:stats'
+
+
+class _Window:
+    __slots__ = ('opened_at', 'held', 'timer')
+
+    def __init__(self, opened_at):
+        self.opened_at = opened_at
+        self.held = []
+        self.timer = None
+
+
+class CoalescingRedisManager(socketio.AsyncRedisManager):
+    """AsyncRedisManager that batches new_notification per user room"""
+
+    def __init__(self, url, **kwargs):
+        super().__init__(url, **kwargs)
+        self.window = settings.NOTIFICATION_COALESCE_WINDOW_MS / 1000
+        self.max_delay = settings.NOTIFICATION_COALESCE_MAX_DELAY_MS / 1000
+        self.windows = {}
+        # Pending _flush tasks; the loop only keeps weak references
+        self.flushes = set()
+        self.stats = collections.Counter()
+
+    def initialize(self):
+        super().initialize()
+        if self.window > 0:
+            self.server.start_background_task(self._report_stats)
+
+    async def _handle_emit(self, message):
+        room = message.get('room')
+        if (
+            self.window > 0
+            and message.get('event') == 'new_notification'
+            and message.get('callback') is None
+            and isinstance(room, str) and room.startswith('user_')
+        ):
+            # Nobody in the room on this worker: nothing to send or hold
+            if self.rooms.get('/', {}).get(room):
+                await self._coalesce(room, message['data'])
+            return
+        await super()._handle_emit(message)
+
+    async def _send(self, event, data, room):
+        # The local half of an emit; self.emit would publish it again
+        await socketio.AsyncManager.emit(self, event, data, namespace='/', room=room)
+        self.stats['emits'] += 1
+
+    async def _coalesce(self, room, data):
+        self.stats['notifications'] += 1
+        now = time.monotonic()
+        window = self.windows.get(room)
+        if window is None:
+            self.windows[room] = window = _Window(now)
+            self._schedule(room, window, now + self.window)
+            await self._send('new_notification', data, room)
+            return
+
+        window.held.append(data)
+        window.timer.cancel()
+        self._schedule(room, window, min(now + self.window, window.opened_at + self.max_delay))
+
+    def _schedule(self, room, window, deadline):
+        loop = asyncio.get_running_loop()
+        window.timer = loop.call_at(
+            loop.time() + max(deadline - time.monotonic(), 0),
+            self._start_flush, loop, room, window
+        )
+
+    def _start_flush(self, loop, room, window):
+        task = loop.create_task(self._flush(room, window))
+        self.flushes.add(task)
+        task.add_done_callback(self.flushes.discard)
+
+    async def _flush(self, room, window):
+        if self.windows.get(room) is not window:
+            return
+        held, window.held = window.held, []
+        if not held:
+            # Quiet for a whole window: the next one goes out at once
+            del self.windows[room]
+            return
+        now = time.monotonic()
+        window.opened_at = now
+        self._schedule(room, window, now + self.window)
+        if len(held) == 1:
+            await self._send('new_notification', held[0], room)
+        else:
+            await self._send('new_notifications', held, room)
+
+    async def _report_stats(self):
+        interval = settings.NOTIFICATION_COALESCE_STATS_SECONDS
+        while True:
+            await asyncio.sleep(interval)
+            stats, self.stats = self.stats, collections.Counter()
+            if not stats:
+                continue
+            saved = stats['notifications'] - stats['emits']
+            try:
+                async with self.redis.pipeline(transaction=False) as pipe:
+                    pipe.hincrby(STATS_KEY, 'notifications', stats['notifications'])
+                    pipe.hincrby(STATS_KEY, 'emits', stats['emits'])
+                    pipe.hincrby(STATS_KEY, 'saved', saved)
+                    await pipe.execute()
+            except redis.RedisError as e:
+                logger.warning("Coalescing stats update failed: %s", e)
+                self.stats.update(stats)
@@ -0,0 +1,188 @@
+"""
+Per-user unread counters in Redis.
+
+notif:unread:{user_id} holds the user's unread count. Reads initialise
+a missing counter from Postgres. Creates and read-marks only adjust
+counters that exist, so users nobody is looking at cost nothing. Every
+change is pushed to the user's sockets as an ``unread_count`` event.
+Counters expire after NOTIFICATION_UNREAD_TTL_SECONDS untouched, and
+``reconcile`` repairs drift against Postgres.
+
+Counter errors are logged, never raised: the counts are a cache.
+"""
+import logging
+import uuid
+
+import redis
+import redis.asyncio
+from django.conf import settings
+from django.db.models import Count
+
+logger = logging.getLogger(__name__)
+
+UNREAD_KEY = 'notif:unread:{user_id}'
+
+# Adjust an existing counter (never below zero); nil if there is none
+_ADJUST = """
+if redis.call('EXISTS', KEYS[1]) == 0 then return false end
+local count = redis.call('INCRBY', KEYS[1], ARGV[1])
+if count < 0 then
+    count = 0
+    redis.call('SET', KEYS[1], 0)
+end
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return count
+"""
+
+# Overwrite a counter only if nobody changed it since it was read
+_COMPARE_AND_SET = """
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then return 0 end
+redis.call('SET', KEYS[1], ARGV[2], 'KEEPTTL')
+return 1
+"""
+
+_redis = None
+_async_redis = None
+
+
+def unread_key(user_id):
+    return UNREAD_KEY.format(user_id=user_id)
+
+
+def _client():
+    global _redis
+    if _redis is None:
+        _redis = redis.Redis.from_url(
+            settings.REDIS_URL, socket_timeout=1.0, socket_connect_timeout=1.0
+        )
+    return _redis
+
+
+def _async_client():
+    global _async_redis
+    if _async_redis is None:
+        _async_redis = redis.asyncio.Redis.from_url(
+            settings.REDIS_URL, socket_timeout=1.0, socket_connect_timeout=1.0
+        )
+    return _async_redis
+
+
+def _count_from_db(user_id):
+    from .models import Notification
+    return Notification.objects.filter(user_id=user_id, is_read=False).count()
+
+
+def _push(counts):
+    from .emitter import get_emitter
+    get_emitter().send_to_users(
+        "unread_count",
+        [(user_id, {"count": count}) for user_id, count in counts.items()]
+    )
+
+
+def get(user_id):
+    """The user's unread count, loaded from Postgres if not cached"""
+    client = _client()
+    try:
+        count = client.get(unread_key(user_id))
+        if count is not None:
+            return int(count)
+    except redis.RedisError as e:
+        logger.warning("Unread counter read failed: %s", e)
+        return _count_from_db(user_id)
+
+    count = _count_from_db(user_id)
+    try:
+        ttl = settings.NOTIFICATION_UNREAD_TTL_SECONDS
+        if not client.set(unread_key(user_id), count, ex=ttl, nx=True):
+            # Initialised concurrently, and maybe adjusted since
+            count = int(client.get(unread_key(user_id)))
+    except (redis.RedisError, TypeError) as e:
+        logger.warning("Unread counter init failed: %s", e)
+    return count
+
+
+def adjust_many(deltas):
+    """Apply {user_id: delta} to existing counters and push the new counts"""
+    if not deltas:
+        return
+    ttl = settings.NOTIFICATION_UNREAD_TTL_SECONDS
+    try:
+        adjust = _client().register_script(_ADJUST)
+        pipe = _client().pipeline(transaction=False)
+        for user_id, delta in deltas.items():
+            adjust(keys=[unread_key(user_id)], args=[delta, ttl], client=pipe)
+        results = pipe.execute()
+        _push({
+            user_id: count
+            for user_id, count in zip(deltas, results) if count is not None
+        })
+    except redis.RedisError as e:
+        logger.warning("Unread counter update failed: %s", e)
+
+
+async def aget(user_id):
+    """get() for the Socket.IO handlers, counting through the async pool"""
+    from . import db
+
+    client = _async_client()
+    try:
+        count = await client.get(unread_key(user_id))
+        if count is not None:
+            return int(count)
+        count = await db.count_unread(user_id)
+        ttl = settings.NOTIFICATION_UNREAD_TTL_SECONDS
+        if not await client.set(unread_key(user_id), count, ex=ttl, nx=True):
+            count = int(await client.get(unread_key(user_id)))
+        return count
+    except (redis.RedisError, TypeError) as e:
+        logger.warning("Unread counter read failed: %s", e)
+        return await db.count_unread(user_id)
+
+
+async def aadjust(user_id, delta):
+    """Adjust an existing counter, returns the new count or None"""
+    try:
+        adjust = _async_client().register_script(_ADJUST)
+        count = await adjust(
+            keys=[unread_key(user_id)],
+            args=[delta, settings.NOTIFICATION_UNREAD_TTL_SECONDS]
+        )
+        return None if count is None else int(count)
+    except redis.RedisError as e:
+        logger.warning("Unread counter update failed: %s", e)
+        return None
+
+
+def reconcile(batch_size=500):
+    """
+    Compare every cached counter with Postgres and fix the ones that
+    drifted, skipping any that changed while being checked. Returns
+    the number repaired.
+    """
+    from .models import Notification
+
+    client = _client()
+    compare_and_set = client.register_script(_COMPARE_AND_SET)
+    prefix = UNREAD_KEY.format(user_id='')
+    repaired = 0
+    keys = client.scan_iter(match=prefix + '*', count=batch_size)
+    while batch := [key for _, key in zip(range(batch_size), keys)]:
+        user_ids = [key.decode()[len(prefix):] for key in batch]
+        cached = client.mget(batch)
+        actual = dict(
+            Notification.objects.filter(user_id__in=user_ids, is_read=False)
+            .values('user_id').annotate(count=Count('id'))
+            .values_list('user_id', 'count')
+        )
+        fixed = {}
+        for user_id, key, value in zip(user_ids, batch, cached):
+            count = actual.get(uuid.UUID(user_id), 0)
+            if value is not None and int(value) != count:
+                if compare_and_set(keys=[key], args=[value, count]):
+                    fixed[user_id] = count
+        if fixed:
+            _push(fixed)
+            repaired += len(fixed)
+    return repaired
+
@@ -0,0 +1,105 @@
+"""
+Async Postgres access for the Socket.IO event handlers.
+
+Django's async ORM methods still run each query in a worker thread. The
+handlers run on the event loop, so they talk to Postgres through a psycopg
+3 AsyncConnectionPool instead, created once per process on first use.
+"""
+import asyncio
+
+from django.conf import settings
+from psycopg.conninfo import make_conninfo
+from psycopg_pool import AsyncConnectionPool
+
+_pool = None
+_pool_lock = None
+
+
+def _conninfo():
+    db = settings.DATABASES['default']
+    return make_conninfo(
+        dbname=db['NAME'],
+        user=db['USER'],
+        password=db['PASSWORD'],
+        host=db['HOST'],
+        port=db['PORT'],
+    )
+
+
+async def get_pool():
+    global _pool, _pool_lock
+    if _pool is not None:
+        return _pool
+    if _pool_lock is None:
+        _pool_lock = asyncio.Lock()
+    async with _pool_lock:
+        if _pool is None:
+            pool = AsyncConnectionPool(
+                _conninfo(),
+                min_size=settings.SOCKETIO_DB_POOL_MIN_SIZE,
+                max_size=settings.SOCKETIO_DB_POOL_MAX_SIZE,
+                check=AsyncConnectionPool.check_connection,
+                open=False,
+            )
+            await pool.open()
+            _pool = pool
+    return _pool
+
+
+def _table():
+    from .models import Notification
+    return Notification._meta.db_table
+
+
+async def mark_read(user_id, notification_id):
+    """
+    Mark one of the user's notifications read. Returns whether it was
+    unread before, or None if the user has no such notification.
+    """
+    table = _table()
+    pool = await get_pool()
+    async with pool.connection() as conn:
+        cursor = await conn.execute(
+            f"WITH target AS ("
+            f"SELECT id, is_read FROM {table} WHERE id = %s AND user_id = %s FOR UPDATE"
+            f") UPDATE {table} SET is_read = true FROM target"
+            f" WHERE {table}.id = target.id RETURNING NOT target.is_read",
+            (notification_id, user_id),
+        )
+        row = await cursor.fetchone()
+        return None if row is None else row[0]
+
+
+async def count_unread(user_id):
+    pool = await get_pool()
+    async with pool.connection() as conn:
+        cursor = await conn.execute(
+            f"SELECT count(*) FROM {_table()} WHERE user_id = %s AND NOT is_read",
+            (user_id,),
+        )
+        return (await cursor.fetchone())[0]
+
+
+async def mark_read_many(user_id, ids):
+    """reads.mark_read() on the async pool: the ids that were unread"""
+    from .reads import mark_read_sql
+
+    pool = await get_pool()
+    async with pool.connection() as conn:
+        cursor = await conn.execute(
+            mark_read_sql(_table(), len(ids)), [user_id, *ids]
+        )
+        return [pk for pk, in await cursor.fetchall()]
+
+
+async def mark_all_read(user_id, before=None):
+    """reads.mark_all_read() on the async pool: how many were unread"""
+    from .reads import mark_read_sql
+
+    params = [user_id] if before is None else [user_id, before]
+    pool = await get_pool()
+    async with pool.connection() as conn:
+        cursor = await conn.execute(
+            mark_read_sql(_table(), before=before is not None), params
+        )
+        return cursor.rowcount
@@ -0,0 +1,117 @@
+"""
+Write-only Socket.IO emitter for processes that don't serve sockets.
+
+Celery workers (and the REST request path, with NOTIFICATION_DIRECT_EMIT)
+publish emits straight to the Socket.IO Redis channel through one
+emitter per process: no event loop and no new Redis connection per
+notification. Many emits go out in a single pipeline. New
+notifications are also recorded in the user's replay stream
+(notifications.streams). Emits to users with no socket connected
+anywhere (notifications.presence) aren't published at all.
+"""
+import logging
+
+import orjson
+import redis
+import socketio
+from django.conf import settings
+
+from . import presence, streams
+
+logger = logging.getLogger(__name__)
+
+# python-socketio's default pub/sub channel
+CHANNEL = 'socketio'
+
+
+class Emitter(socketio.RedisManager):
+    """
+    A write-only RedisManager that raises on Redis errors instead of
+    logging and dropping the emit, so callers can retry or fall back.
+    """
+
+    def __init__(self, url):
+        super().__init__(
+            url,
+            channel=CHANNEL,
+            write_only=True,
+            redis_options={'socket_timeout': 1.0, 'socket_connect_timeout': 1.0},
+        )
+
+    def _message(self, event, data, room):
+        # Same shape as PubSubManager.emit, which the servers' listeners read
+        return orjson.dumps({
+            'method': 'emit',
+            'event': event,
+            'data': data,
+            'namespace': '/',
+            'room': room,
+            'skip_sid': None,
+            'callback': None,
+            'host_id': self.host_id,
+        })
+
+    def send(self, event, data, room):
+        self.redis.publish(self.channel, self._message(event, data, room))
+
+    def send_many(self, event, items):
+        """Publish one emit per (room, data) pair in a single pipeline"""
+        pipe = self.redis.pipeline(transaction=False)
+        for room, data in items:
+            pipe.publish(self.channel, self._message(event, data, room))
+        pipe.execute()
+
+    def send_to_users(self, event, items):
+        """
+        send_many() for (user_id, data) pairs, skipping users who are
+        offline. Returns the skipped pairs.
+        """
+        up = presence.online(self.redis, [user_id for user_id, _ in items])
+        self.send_many(
+            event,
+            [(f"user_{user_id}", data) for user_id, data in items if str(user_id) in up]
+        )
+        return [(user_id, data) for user_id, data in items if str(user_id) not in up]
+
+    def notify(self, data, user_id):
+        """Record a new notification in the user's stream and emit it"""
+        self.notify_many([(user_id, data)])
+
+    def notify_many(self, items):
+        """
+        notify() for (user_id, data) pairs, one pipeline per step.
+        Notifications for offline users go to NOTIFICATION_OFFLINE_HANDLER.
+        """
+        stamped = streams.append_many(self.redis, items)
+        offline = self.send_to_users(
+            "new_notification",
+            [(user_id, data) for (user_id, _), data in zip(items, stamped)]
+        )
+        presence.handle_offline(offline)
+
+
+_emitter = None
+
+
+def get_emitter():
+    """The process's emitter, created on first use"""
+    global _emitter
+    if _emitter is None:
+        _emitter = Emitter(settings.REDIS_URL)
+    return _emitter
+
+
+def deliver(data, user_id):
+    """
+    Push a new notification to the user's sockets: emitted right here
+    with NOTIFICATION_DIRECT_EMIT, else (or if Redis refuses) via Celery.
+    """
+    from .tasks import send_notification_task
+
+    if settings.NOTIFICATION_DIRECT_EMIT:
+        try:
+            get_emitter().notify(data, user_id)
+            return
+        except redis.RedisError as e:
+            logger.warning("Direct emit failed, queueing instead: %s", e)
+    send_notification_task.delay(data, str(user_id))
@@ -0,0 +1,52 @@
+"""
+Bulk and broadcast notification fan-out.
+
+Recipients are split into chunks of BULK_NOTIFICATION_CHUNK_SIZE. Each
+chunk is one Celery task doing one bulk_create and one Redis pipeline
+that carries every member's Socket.IO emit. This replaces one task, one
+INSERT and one event loop per user.
+"""
+import itertools
+import uuid
+
+from django.conf import settings
+
+from .models import Notification
+from .serializers import NotificationSerializer
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(itertools.islice(iterator, size)):
+        yield chunk
+
+
+def notification_id(batch_id, user_id):
+    """Stable per (batch, user), so a retried chunk doesn't insert twice"""
+    return uuid.uuid5(uuid.UUID(str(batch_id)), str(user_id))
+
+
+def create_chunk(batch_id, title, message, user_ids):
+    """Insert one batch's notifications for user_ids, returns their payloads"""
+    rows = [
+        Notification(
+            id=notification_id(batch_id, user_id),
+            user_id=user_id,
+            title=title,
+            message=message,
+        )
+        for user_id in user_ids
+    ]
+    Notification.objects.bulk_create(rows, ignore_conflicts=True)
+    return NotificationSerializer(rows, many=True).data
+
+
+def broadcast_recipients():
+    """Every user this service has notified before, streamed from the DB"""
+    return (
+        Notification.objects.order_by()
+        .values_list('user_id', flat=True)
+        .distinct()
+        .iterator(chunk_size=settings.BULK_NOTIFICATION_CHUNK_SIZE)
+    )
+
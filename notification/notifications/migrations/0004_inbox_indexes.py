@@ -0,0 +1,24 @@
+# Generated by Django 5.2.7 on 2026-10-19 09:35
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Built without locking out writes to the notifications table
+    atomic = False
+
+    dependencies = [
+        ('notifications', '0003_alter_notification_id'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='notification',
+            index=models.Index(fields=['user_id', '-created_at', '-id'], name='notif_user_created_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='notification',
+            index=models.Index(condition=models.Q(('is_read', False)), fields=['user_id', '-created_at', '-id'], name='notif_user_unread_idx'),
+        ),
+    ]
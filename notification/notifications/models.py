@@ -12,6 +12,19 @@ class Notification(models.Model):
 
     class Meta:
         ordering = ["-created_at"]
+        indexes = [
+            # Inbox pages: keyset on (created_at, id) within one user
+            models.Index(
+                fields=["user_id", "-created_at", "-id"],
+                name="notif_user_created_idx",
+            ),
+            # ?unread=true pages and unread counts
+            models.Index(
+                fields=["user_id", "-created_at", "-id"],
+                name="notif_user_unread_idx",
+                condition=models.Q(is_read=False),
+            ),
+        ]
 
     def __str__(self):
         return f"🔔 {self.title} for {self.user_id}"
@@ -0,0 +1,96 @@
+"""
+Keyset pagination for the notification inbox.
+
+Pages are ordered by (created_at, id), newest first. The cursor is the
+position of the last row served, so every page is one index range scan
+on (user_id, created_at, id) no matter how deep it is, unlike OFFSET.
+"""
+import base64
+import binascii
+import uuid
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class NotificationCursorPagination(BasePagination):
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return settings.NOTIFICATION_PAGE_SIZE
+        return max(1, min(page_size, settings.NOTIFICATION_MAX_PAGE_SIZE))
+
+    def encode_cursor(self, created_at, pk):
+        position = f"{created_at.isoformat()}|{pk}".encode()
+        return base64.urlsafe_b64encode(position).decode()
+
+    def decode_cursor(self, cursor):
+        try:
+            created_at, pk = base64.urlsafe_b64decode(cursor).decode().split('|')
+            created_at = parse_datetime(created_at)
+            pk = uuid.UUID(pk)
+        except (binascii.Error, UnicodeDecodeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if created_at is None:
+            raise NotFound(self.invalid_cursor_message)
+        return created_at, pk
+
+    def paginate_queryset(self, queryset, request, view=None):
+        """
+        One page of queryset, which may be a .values() queryset. Fetches
+        one extra row to know whether there's a next page.
+        """
+        self.request = request
+        page_size = self.get_page_size(request)
+        queryset = queryset.order_by('-created_at', '-id')
+
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            created_at, pk = self.decode_cursor(cursor)
+            # The plain created_at bound is what the index range uses
+            queryset = queryset.filter(created_at__lte=created_at).filter(
+                Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk)
+            )
+
+        rows = list(queryset[:page_size + 1])
+        self.has_next = len(rows) > page_size
+        page = rows[:page_size]
+        if self.has_next:
+            last = page[-1]
+            if isinstance(last, dict):
+                self.next_cursor = self.encode_cursor(last['created_at'], last['id'])
+            else:
+                self.next_cursor = self.encode_cursor(last.created_at, last.pk)
+        return page
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.next_cursor)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
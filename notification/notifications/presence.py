@@ -0,0 +1,122 @@
+"""
+Cluster-wide presence: which users have a socket connected anywhere.
+
+presence:user:{user_id} is a hash of Socket.IO worker (host_id) to that
+worker's connection count for the user. Only connect and disconnect
+change the counts. Every NOTIFICATION_PRESENCE_HEARTBEAT_SECONDS each
+worker pushes its users' keys' expiry forward, so a user whose only
+worker died without disconnecting them expires after a few missed
+beats. A key that is already gone (its connect failed to record, or it
+expired) is recreated with the worker's count.
+
+Emitters publish only to users whose key exists. A user who might be
+online is always treated as online: if Redis can't answer, everyone is.
+"""
+import asyncio
+import collections
+import logging
+
+import redis
+import redis.asyncio
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+PRESENCE_KEY = 'presence:user:{user_id}'
+
+# Drop this worker's field once its last connection is gone
+_DISCONNECT = """
+local count = redis.call('HINCRBY', KEYS[1], ARGV[1], -1)
+if count <= 0 then redis.call('HDEL', KEYS[1], ARGV[1]) end
+return count
+"""
+
+# Refresh expiry, never overwriting counts that connect/disconnect keep;
+# only a missing key gets this worker's count back
+_HEARTBEAT = """
+if redis.call('EXPIRE', KEYS[1], ARGV[2]) == 0 then
+    redis.call('HSET', KEYS[1], ARGV[1], ARGV[3])
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+"""
+
+_async_redis = None
+
+
+def presence_key(user_id):
+    return PRESENCE_KEY.format(user_id=user_id)
+
+
+def _ttl():
+    # Survives two missed heartbeats
+    return settings.NOTIFICATION_PRESENCE_HEARTBEAT_SECONDS * 3
+
+
+def online(client, user_ids):
+    """The subset of user_ids with a connected socket, as strings"""
+    user_ids = [str(user_id) for user_id in user_ids]
+    if not settings.NOTIFICATION_PRESENCE:
+        return set(user_ids)
+    try:
+        pipe = client.pipeline(transaction=False)
+        for user_id in user_ids:
+            pipe.exists(presence_key(user_id))
+        return {user_id for user_id, up in zip(user_ids, pipe.execute()) if up}
+    except redis.RedisError as e:
+        logger.warning("Presence check failed, assuming online: %s", e)
+        return set(user_ids)
+
+
+def handle_offline(items):
+    """Pass (user_id, data) pairs nobody received to NOTIFICATION_OFFLINE_HANDLER"""
+    if not items or not settings.NOTIFICATION_OFFLINE_HANDLER:
+        return
+    try:
+        import_string(settings.NOTIFICATION_OFFLINE_HANDLER)(items)
+    except Exception:
+        logger.exception("Offline notification handler failed")
+
+
+def _async_client():
+    global _async_redis
+    if _async_redis is None:
+        _async_redis = redis.asyncio.Redis.from_url(
+            settings.REDIS_URL, socket_timeout=1.0, socket_connect_timeout=1.0
+        )
+    return _async_redis
+
+
+async def connected(node, user_id):
+    key = presence_key(user_id)
+    async with _async_client().pipeline(transaction=False) as pipe:
+        pipe.hincrby(key, node, 1)
+        pipe.expire(key, _ttl())
+        await pipe.execute()
+
+
+async def disconnected(node, user_id):
+    await _async_client().eval(_DISCONNECT, 1, presence_key(user_id), node)
+
+
+async def heartbeat(node, connections, batch_size=1000):
+    """
+    Forever: push the expiry of every user in connections (sid ->
+    user_id) forward, restoring this worker's count where the key is gone.
+    """
+    interval = settings.NOTIFICATION_PRESENCE_HEARTBEAT_SECONDS
+    beat = _async_client().register_script(_HEARTBEAT)
+    while True:
+        await asyncio.sleep(interval)
+        counts = list(collections.Counter(connections.values()).items())
+        try:
+            for start in range(0, len(counts), batch_size):
+                async with _async_client().pipeline(transaction=False) as pipe:
+                    for user_id, count in counts[start:start + batch_size]:
+                        await beat(
+                            keys=[presence_key(user_id)], args=[node, _ttl(), count],
+                            client=pipe
+                        )
+                    await pipe.execute()
+        except redis.RedisError as e:
+            logger.warning("Presence heartbeat failed: %s", e)
@@ -0,0 +1,94 @@
+"""
+Marking notifications read in batches.
+
+A single UPDATE marks a list of the user's ids, or all of their
+notifications (optionally up to a timestamp). user_id is part of the
+WHERE clause, which is the ownership check. Only rows that were still
+unread are touched, so concurrent requests never count a row twice.
+The number changed is subtracted from the unread counter and announced
+in one event. A single notification keeps the original
+``notification_read`` ``{"id": ...}``; batches go out as
+``notifications_read`` with ``{"ids": [...]}`` for a list of ids,
+``{"before": ts}`` or ``{"all": true}`` otherwise, so marking a whole
+inbox never ships every id.
+"""
+import logging
+import uuid
+
+import redis
+from django.db import connection
+
+from . import counters
+from .emitter import get_emitter
+from .models import Notification
+
+logger = logging.getLogger(__name__)
+
+
+def mark_read_sql(table, id_count=0, before=False):
+    """
+    UPDATE for one user's unread rows, optionally limited to id_count
+    ids and/or a created_at bound. Params: user_id, *ids, before. Only
+    the ids form returns the changed ids; otherwise use the rowcount.
+    """
+    sql = f"UPDATE {table} SET is_read = true WHERE user_id = %s AND NOT is_read"
+    if id_count:
+        sql += f" AND id IN ({', '.join(['%s'] * id_count)})"
+    if before:
+        sql += " AND created_at <= %s"
+    return sql + " RETURNING id" if id_count else sql
+
+
+def read_event(ids=None, before=None):
+    """The (event, payload) announcing a mark_read call"""
+    if ids is not None and len(ids) == 1:
+        return "notification_read", {"id": str(ids[0])}
+    if ids is not None:
+        return "notifications_read", {"ids": [str(pk) for pk in ids]}
+    if before is not None:
+        return "notifications_read", {"before": before.isoformat()}
+    return "notifications_read", {"all": True}
+
+
+def _execute(user_id, ids=(), before=None):
+    meta = Notification._meta
+    params = [meta.get_field('user_id').get_db_prep_value(user_id, connection)]
+    params += [meta.get_field('id').get_db_prep_value(pk, connection) for pk in ids]
+    if before is not None:
+        params.append(meta.get_field('created_at').get_db_prep_value(before, connection))
+    sql = mark_read_sql(
+        connection.ops.quote_name(meta.db_table), len(ids), before is not None
+    )
+    cursor = connection.cursor()
+    cursor.execute(sql, params)
+    return cursor
+
+
+def mark_read(user_id, ids):
+    """Mark the user's notifications in ids read, returns those that were unread"""
+    with _execute(user_id, ids=ids) as cursor:
+        return [
+            pk if isinstance(pk, uuid.UUID) else uuid.UUID(str(pk))
+            for pk, in cursor.fetchall()
+        ]
+
+
+def mark_all_read(user_id, before=None):
+    """
+    Mark all the user's notifications read, or those created up to
+    before. Returns how many were unread.
+    """
+    with _execute(user_id, before=before) as cursor:
+        return cursor.rowcount
+
+
+def announce(user_id, count, ids=None, before=None):
+    """Push the read event and the new unread count after a mark_read"""
+    if not count:
+        return
+    event, payload = read_event(ids, before)
+    try:
+        get_emitter().send_to_users(event, [(user_id, payload)])
+    except redis.RedisError as e:
+        logger.warning("%s emit failed: %s", event, e)
+    counters.adjust_many({user_id: -count})
@@ -0,0 +1,138 @@
+"""
+Per-user inbox limits, enforced by a background trim.
+
+A user keeps their newest NOTIFICATION_INBOX_MAX notifications, and read
+ones only for NOTIFICATION_READ_RETENTION_DAYS. trim_inboxes() walks
+users in user_id order from a cursor kept in Redis, a bounded slice per
+run. Finding the next users is one index probe each and deletes go
+oldest-first in short transactions of NOTIFICATION_TRIM_CHUNK_SIZE rows,
+skipping rows another transaction holds. So there are no whole-table
+scans and a user's inbox is never locked.
+"""
+import logging
+import uuid
+from datetime import timedelta
+
+import redis
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import counters
+from .models import Notification
+
+logger = logging.getLogger(__name__)
+
+CURSOR_KEY = 'notif:trim:cursor'
+
+_redis = None
+
+
+def _client():
+    global _redis
+    if _redis is None:
+        _redis = redis.Redis.from_url(
+            settings.REDIS_URL, socket_timeout=1.0, socket_connect_timeout=1.0
+        )
+    return _redis
+
+
+def next_users(after, limit):
+    """
+    Up to limit distinct user_ids above after, in order. A loose index
+    scan: each step is a one-row probe on the user_id index, never a
+    DISTINCT over the user's rows. (Postgres has no min() for uuid.)
+    """
+    table = connection.ops.quote_name(Notification._meta.db_table)
+    field = Notification._meta.get_field('user_id')
+    step = f"SELECT user_id FROM {table} WHERE user_id > %s ORDER BY user_id LIMIT 1"
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"WITH RECURSIVE users(user_id) AS ("
+            f" SELECT ({step})"
+            f" UNION ALL"
+            f" SELECT ({step.replace('%s', 'users.user_id')})"
+            f" FROM users WHERE users.user_id IS NOT NULL"
+            f") SELECT user_id FROM users WHERE user_id IS NOT NULL LIMIT %s",
+            [field.get_db_prep_value(after, connection), limit],
+        )
+        return [
+            value if isinstance(value, uuid.UUID) else uuid.UUID(str(value))
+            for value, in cursor.fetchall()
+        ]
+
+
+def _expired(user_id):
+    """Q for the user's rows past the cap or the read retention"""
+    expired = Q(
+        is_read=True,
+        created_at__lt=timezone.now() - timedelta(days=settings.NOTIFICATION_READ_RETENTION_DAYS),
+    )
+    # Everything up to and including the first row beyond the cap
+    boundary = (
+        Notification.objects.filter(user_id=user_id)
+        .order_by('-created_at', '-id')
+        .values_list('created_at', 'id')[settings.NOTIFICATION_INBOX_MAX:][:1]
+    )
+    for created_at, pk in boundary:
+        expired |= Q(created_at__lt=created_at) | Q(created_at=created_at, id__lte=pk)
+    return Q(user_id=user_id) & expired
+
+
+def trim_user(user_id, budget):
+    """
+    Delete up to budget of the user's expired rows, oldest first.
+    Returns (deleted, unread_deleted).
+    """
+    expired = _expired(user_id)
+    deleted = unread_deleted = 0
+    while deleted < budget:
+        size = min(settings.NOTIFICATION_TRIM_CHUNK_SIZE, budget - deleted)
+        with transaction.atomic():
+            rows = list(
+                Notification.objects.filter(expired)
+                .order_by('created_at', 'id')
+                .select_for_update(skip_locked=True)
+                .values_list('id', 'is_read')[:size]
+            )
+            if rows:
+                Notification.objects.filter(id__in=[pk for pk, _ in rows]).delete()
+        deleted += len(rows)
+        unread_deleted += sum(1 for _, is_read in rows if not is_read)
+        if len(rows) < size:
+            break
+    return deleted, unread_deleted
+
+
+def trim_inboxes():
+    """
+    Trim the next NOTIFICATION_TRIM_USERS_PER_RUN users after the
+    saved cursor, deleting at most NOTIFICATION_TRIM_MAX_DELETES rows.
+    A user left unfinished is resumed first next run; past the last
+    user the cursor wraps around. Returns (users, deleted).
+    """
+    client = _client()
+    after = client.get(CURSOR_KEY)
+    after = uuid.UUID(after.decode()) if after else uuid.UUID(int=0)
+
+    users = next_users(after, settings.NOTIFICATION_TRIM_USERS_PER_RUN)
+    budget = settings.NOTIFICATION_TRIM_MAX_DELETES
+    done = deleted = 0
+    unread = {}
+    for user_id in users:
+        user_deleted, unread_deleted = trim_user(user_id, budget - deleted)
+        deleted += user_deleted
+        if unread_deleted:
+            unread[user_id] = -unread_deleted
+        if deleted >= budget:
+            break
+        after = user_id
+        done += 1
+
+    if len(users) < settings.NOTIFICATION_TRIM_USERS_PER_RUN and done == len(users):
+        client.delete(CURSOR_KEY)
+    else:
+        client.set(CURSOR_KEY, str(after))
+    counters.adjust_many(unread)
+    return done, deleted
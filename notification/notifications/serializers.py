@@ -1,3 +1,4 @@
+from django.conf import settings
 from rest_framework import serializers
 from .models import Notification
 
@@ -7,3 +8,38 @@ class NotificationSerializer(serializers.ModelSerializer):
         model = Notification
         fields = "__all__"
 
+
+class BulkNotificationSerializer(serializers.Serializer):
+    """Payload for POST /notifications/bulk: user_ids or broadcast"""
+    title = serializers.CharField(max_length=255)
+    message = serializers.CharField()
+    user_ids = serializers.ListField(
+        child=serializers.UUIDField(),
+        required=False,
+        allow_empty=False,
+        max_length=settings.BULK_NOTIFICATION_MAX_USERS
+    )
+    broadcast = serializers.BooleanField(default=False)
+
+    def validate(self, data):
+        if data['broadcast'] == bool(data.get('user_ids')):
+            raise serializers.ValidationError(
+                "Provide either user_ids or broadcast: true"
+            )
+        return data
+
+
+class MarkReadSerializer(serializers.Serializer):
+    """Payload for POST /notifications/read: ids or before"""
+    ids = serializers.ListField(
+        child=serializers.UUIDField(),
+        required=False,
+        allow_empty=False,
+        max_length=settings.NOTIFICATION_MARK_READ_MAX_IDS
+    )
+    before = serializers.DateTimeField(required=False)
+
+    def validate(self, data):
+        if ('ids' in data) == ('before' in data):
+            raise serializers.ValidationError("Provide either ids or before")
+        return data
@@ -1,59 +1,202 @@
+import datetime
+import logging
+import uuid
+
+import redis
 import socketio
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from core.logging import log_context
+from . import counters, db, presence, reads, streams
+from .coalesce import CoalescingRedisManager
+
+logger = logging.getLogger(__name__)
 
 # Use Redis as message queue for cross-process communication
 sio = socketio.AsyncServer(
     async_mode="asgi",
     cors_allowed_origins="*",
-    client_manager=socketio.AsyncRedisManager("redis://redis:6379/0")
+    client_manager=CoalescingRedisManager(settings.REDIS_URL),
+    # websocket-only needs no sticky sessions across uvicorn workers
+    transports=settings.SOCKETIO_TRANSPORTS,
+    ping_interval=settings.SOCKETIO_PING_INTERVAL,
+    ping_timeout=settings.SOCKETIO_PING_TIMEOUT,
 )
 
+# sid -> user_id for this worker's connections. Cheaper per socket
+# than a Socket.IO session, which is a dict per namespace per sid.
+users = {}
+_heartbeat = None
+
+
+def _node():
+    """This worker's presence field: the manager's per-process id"""
+    return sio.manager.host_id
+
 
 @sio.event
 async def connect(sid, environ, auth):
-    user_id = auth.get("user_id") if auth else None
-    if user_id:
-        await sio.save_session(sid, {"user_id": user_id})
-        await sio.enter_room(sid, f"user_{user_id}")
-        print(f"✅ User {user_id} connected via Socket.IO (sid: {sid})")
-    else:
-        print("❌ Connection rejected: No user_id provided")
+    try:
+        user_id = uuid.UUID(str(auth["user_id"]))
+    except (TypeError, KeyError, ValueError):
+        logger.warning("Connection rejected: No valid user_id provided (sid: %s)", sid)
         return False
 
+    users[sid] = user_id
+    await sio.enter_room(sid, f"user_{user_id}")
+    await _track_presence(user_id)
+    with log_context(user_id=user_id):
+        logger.info("Socket.IO connected (sid: %s)", sid, extra={"sampled": True})
+    # After the handler returns, so the client is connected first
+    sio.start_background_task(send_unread_count, sid, user_id)
+    last_stream_id = auth.get("last_stream_id")
+    if last_stream_id:
+        sio.start_background_task(replay_missed, sid, user_id, last_stream_id)
+
+
+async def _track_presence(user_id):
+    global _heartbeat
+    if not settings.NOTIFICATION_PRESENCE:
+        return
+    if _heartbeat is None:
+        _heartbeat = sio.start_background_task(presence.heartbeat, _node(), users)
+    try:
+        await presence.connected(_node(), user_id)
+    except redis.RedisError as e:
+        # The next heartbeat records it if the key is missing
+        logger.warning("Presence update failed: %s", e)
+
+
+async def send_unread_count(sid, user_id):
+    """Give a newly connected client its badge count"""
+    with log_context(user_id=user_id):
+        try:
+            count = await counters.aget(user_id)
+        except Exception:
+            logger.exception("Unread count on connect failed")
+            return
+        await sio.emit("unread_count", {"count": count}, to=sid)
+
+
+async def replay_missed(sid, user_id, last_stream_id):
+    """
+    Emit what the user's stream holds after last_stream_id. If the gap
+    can't be replayed in full, emit resync_required instead so the
+    client refetches its inbox.
+    """
+    with log_context(user_id=user_id):
+        try:
+            missed, complete = await streams.read_since(user_id, last_stream_id)
+        except (ValueError, redis.RedisError) as e:
+            logger.warning("Replay after %s failed: %s", last_stream_id, e)
+            missed, complete = [], False
+        for data in missed:
+            await sio.emit("new_notification", data, to=sid)
+        if not complete:
+            await sio.emit("resync_required", {}, to=sid)
+        logger.debug("Replayed %s notifications (complete: %s)", len(missed), complete)
+
 
 @sio.event
 async def disconnect(sid):
-    session = await sio.get_session(sid)
-    user_id = session.get("user_id")
+    user_id = users.pop(sid, None)
     if user_id:
-        print(f"❌ User {user_id} disconnected (sid: {sid})")
+        if settings.NOTIFICATION_PRESENCE:
+            try:
+                await presence.disconnected(_node(), user_id)
+            except redis.RedisError as e:
+                logger.warning("Presence update failed: %s", e)
+        with log_context(user_id=user_id):
+            logger.info("Socket.IO disconnected (sid: %s)", sid, extra={"sampled": True})
+
+
+async def announce_read(user_id, changed, ids=None, before=None):
+    """One read event for a mark_read that changed rows, then the new count"""
+    if not changed:
+        return
+    room = f"user_{user_id}"
+    await sio.emit(*reads.read_event(ids, before), room=room)
+    count = await counters.aadjust(user_id, -changed)
+    if count is not None:
+        await sio.emit("unread_count", {"count": count}, room=room)
+
+
+def _parse_mark_read(data):
+    """(ids, before) from a batch mark_read payload; raises ValueError"""
+    ids = data.get("ids")
+    before = data.get("before")
+    if (ids is None) == (before is None):
+        raise ValueError("Provide either ids or before")
+    if ids is not None:
+        if not isinstance(ids, list) or not ids:
+            raise ValueError("ids must be a non-empty list")
+        if len(ids) > settings.NOTIFICATION_MARK_READ_MAX_IDS:
+            raise ValueError("Too many ids")
+        try:
+            ids = [uuid.UUID(str(pk)) for pk in ids]
+        except ValueError:
+            raise ValueError("Invalid notification id")
+        return list(dict.fromkeys(ids)), None
+    before = parse_datetime(str(before))
+    if before is None:
+        raise ValueError("Invalid before timestamp")
+    if timezone.is_naive(before):
+        before = timezone.make_aware(before, datetime.timezone.utc)
+    return None, before
 
 
 @sio.event
 async def mark_read(sid, data):
-    from .models import Notification
-    from django.core.exceptions import ValidationError
+    """
+    Mark notifications read: {"id": ...} for one, {"ids": [...]} or
+    {"before": "<timestamp>"} for many in a single UPDATE.
+    """
+    data = data or {}
+    if "ids" in data or "before" in data:
+        return await _mark_read_batch(sid, data)
 
     notif_id = data.get("id")
     if not notif_id:
         return {"error": "Missing notification id"}
 
     try:
-        session = await sio.get_session(sid)
-        user_id = session.get("user_id")
-
-        # 👈 Verify ownership
-        notif = await Notification.objects.aget(id=notif_id, user_id=user_id)
-        notif.is_read = True
-        await notif.asave()
-
-        await sio.emit(
-            "notification_read",
-            {"id": str(notif_id)},
-            room=f"user_{user_id}"
-        )
-        return {"success": True}
-    except Notification.DoesNotExist:
+        notif_id = uuid.UUID(str(notif_id))
+    except ValueError:
         return {"error": "Notification not found"}
-    except Exception as e:
-        print(f"Error marking notification as read: {e}")
+
+    try:
+        user_id = users[sid]
+
+        # 👈 Verify ownership (user_id is part of the UPDATE filter)
+        was_unread = await db.mark_read(user_id, notif_id)
+        if was_unread is None:
+            return {"error": "Notification not found"}
+
+        await announce_read(user_id, int(was_unread), ids=[notif_id])
+        return {"success": True}
+    except Exception:
+        logger.exception("Error marking notification %s as read", notif_id)
+        return {"error": "Internal error"}
+
+
+async def _mark_read_batch(sid, data):
+    try:
+        ids, before = _parse_mark_read(data)
+    except ValueError as e:
+        return {"error": str(e)}
+
+    try:
+        user_id = users[sid]
+
+        if ids is not None:
+            changed = await db.mark_read_many(user_id, ids)
+            await announce_read(user_id, len(changed), ids=changed)
+            return {"success": True, "count": len(changed)}
+        count = await db.mark_all_read(user_id, before=before)
+        await announce_read(user_id, count, before=before)
+        return {"success": True, "count": count}
+    except Exception:
+        logger.exception("Error marking notifications as read")
         return {"error": "Internal error"}
@@ -0,0 +1,130 @@
+"""
+Per-user capped Redis streams of emitted notifications.
+
+Every new_notification emit is also appended to notif:stream:{user_id},
+capped at NOTIFICATION_STREAM_MAXLEN entries and dropped after
+NOTIFICATION_STREAM_TTL_SECONDS without new ones. Payloads carry their
+entry id as ``stream_id``. A reconnecting client passes the last one it
+saw as ``auth.last_stream_id`` and only the gap is replayed, from Redis.
+
+Appends are idempotent per notification id: notif:stream:{user_id}:ids
+maps the ids still in the stream to their entries, so a retried task
+or a queued fallback after a partial emit gets the existing stream_id
+back instead of a duplicate entry.
+"""
+import time
+
+import orjson
+import redis.asyncio
+from django.conf import settings
+
+STREAM_KEY = 'notif:stream:{user_id}'
+IDS_KEY = 'notif:stream:{user_id}:ids'
+
+# XADD unless the notification is already in the stream; returns its
+# entry id either way. Ids whose entries were trimmed are forgotten once
+# the map holds twice the stream's cap.
+_APPEND = """
+local entry_id = redis.call('HGET', KEYS[2], ARGV[1])
+if not entry_id then
+    local maxlen = tonumber(ARGV[3])
+    entry_id = redis.call('XADD', KEYS[1], 'MAXLEN', '~', maxlen, '*', 'd', ARGV[2])
+    redis.call('HSET', KEYS[2], ARGV[1], entry_id)
+    if redis.call('HLEN', KEYS[2]) > 2 * maxlen then
+        local oldest = redis.call('XRANGE', KEYS[1], '-', '+', 'COUNT', 1)[1][1]
+        local oldest_ms, oldest_seq = string.match(oldest, '(%d+)-(%d+)')
+        oldest_ms, oldest_seq = tonumber(oldest_ms), tonumber(oldest_seq)
+        local ids = redis.call('HGETALL', KEYS[2])
+        for i = 1, #ids, 2 do
+            local ms, seq = string.match(ids[i + 1], '(%d+)-(%d+)')
+            ms, seq = tonumber(ms), tonumber(seq)
+            if ms < oldest_ms or (ms == oldest_ms and seq < oldest_seq) then
+                redis.call('HDEL', KEYS[2], ids[i])
+            end
+        end
+    end
+end
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+redis.call('EXPIRE', KEYS[2], ARGV[4])
+return entry_id
+"""
+
+_async_redis = None
+
+
+def stream_key(user_id):
+    return STREAM_KEY.format(user_id=user_id)
+
+
+def ids_key(user_id):
+    return IDS_KEY.format(user_id=user_id)
+
+
+def _parse_id(stream_id):
+    ms, _, seq = str(stream_id).partition('-')
+    return int(ms), int(seq or 0)
+
+
+def append_many(client, items):
+    """
+    Append each (user_id, data) to the user's stream in one pipeline,
+    skipping notifications (by data['id']) it already holds. Returns
+    the payloads stamped with their ``stream_id``.
+    """
+    append = client.register_script(_APPEND)
+    pipe = client.pipeline(transaction=False)
+    for user_id, data in items:
+        append(
+            keys=[stream_key(user_id), ids_key(user_id)],
+            args=[
+                str(data['id']), orjson.dumps(data),
+                settings.NOTIFICATION_STREAM_MAXLEN,
+                settings.NOTIFICATION_STREAM_TTL_SECONDS,
+            ],
+            client=pipe,
+        )
+    stream_ids = pipe.execute()
+    return [
+        {**data, 'stream_id': stream_id.decode()}
+        for (_, data), stream_id in zip(items, stream_ids)
+    ]
+
+
+def _async_client():
+    global _async_redis
+    if _async_redis is None:
+        _async_redis = redis.asyncio.Redis.from_url(
+            settings.REDIS_URL, socket_timeout=1.0, socket_connect_timeout=1.0
+        )
+    return _async_redis
+
+
+async def read_since(user_id, last_stream_id):
+    """
+    Payloads after last_stream_id, oldest first, and whether they cover
+    the whole gap. It isn't covered when entries after last_stream_id
+    were already trimmed or expired; the client has to refetch then.
+
+    Raises ValueError for a malformed id.
+    """
+    last = _parse_id(last_stream_id)
+    key = stream_key(user_id)
+    async with _async_client().pipeline(transaction=False) as pipe:
+        pipe.xrange(
+            key, min=f'({last[0]}-{last[1]}', max='+',
+            count=settings.NOTIFICATION_STREAM_MAXLEN
+        )
+        pipe.xrange(key, count=1)
+        entries, oldest = await pipe.execute()
+
+    if oldest:
+        complete = _parse_id(oldest[0][0].decode()) <= last
+    else:
+        # Nothing left: fine unless the stream expired since last_stream_id
+        max_age_ms = settings.NOTIFICATION_STREAM_TTL_SECONDS * 1000
+        complete = last[0] >= time.time() * 1000 - max_age_ms
+    payloads = [
+        {**orjson.loads(fields[b'd']), 'stream_id': entry_id.decode()}
+        for entry_id, fields in entries
+    ]
+    return payloads, complete and len(payloads) < settings.NOTIFICATION_STREAM_MAXLEN
@@ -1,22 +1,67 @@
 from celery import shared_task
-from .sio import sio
-import asyncio
+from . import counters
+from .emitter import get_emitter
+from core.logging import log_context
 import logging
 
 logger = logging.getLogger(__name__)
 
 @shared_task(bind=True, max_retries=3)
 def send_notification_task(self, data, user_id):
-    try:
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
+    with log_context(task_id=self.request.id, user_id=user_id):
         try:
-            loop.run_until_complete(
-                sio.emit("new_notification", data, room=f"user_{user_id}")
+            get_emitter().notify(data, user_id)
+            logger.info("Notification sent", extra={"sampled": True})
+        except Exception as exc:
+            logger.error("Failed to send notification: %s", exc)
+            raise self.retry(exc=exc, countdown=60 * (2 ** self.request.retries))
+
+@shared_task(bind=True, max_retries=3)
+def bulk_notification_task(self, batch_id, title, message, user_ids):
+    """Create and emit one chunk of a bulk or broadcast notification"""
+    from .fanout import create_chunk
+
+    with log_context(task_id=self.request.id):
+        try:
+            payloads = create_chunk(batch_id, title, message, user_ids)
+            get_emitter().notify_many([(data['user_id'], data) for data in payloads])
+            # Only once the emit went out, so a retried chunk counts once
+            counters.adjust_many({data['user_id']: 1 for data in payloads})
+            logger.info(
+                "Bulk notification %s sent to %s users", batch_id, len(payloads),
+                extra={"sampled": True}
             )
-            logger.info(f"Notification sent to user {user_id}")
-        finally:
-            loop.close()
-    except Exception as exc:
-        logger.error(f"Failed to send notification: {exc}")
-        raise self.retry(exc=exc, countdown=60 * (2 ** self.request.retries))
+            return len(payloads)
+        except Exception as exc:
+            logger.error("Bulk notification %s chunk failed: %s", batch_id, exc)
+            raise self.retry(exc=exc, countdown=60 * (2 ** self.request.retries))
+
+@shared_task
+def broadcast_notification_task(batch_id, title, message):
+    """Queue one bulk chunk task per BULK_NOTIFICATION_CHUNK_SIZE known users"""
+    from django.conf import settings
+    from .fanout import broadcast_recipients, chunked
+
+    chunks = 0
+    for user_ids in chunked(broadcast_recipients(), settings.BULK_NOTIFICATION_CHUNK_SIZE):
+        bulk_notification_task.delay(batch_id, title, message, [str(u) for u in user_ids])
+        chunks += 1
+    logger.info("Broadcast %s queued in %s chunks", batch_id, chunks)
+    return chunks
+
+@shared_task
+def reconcile_unread_counts():
+    """Repair cached unread counts that drifted from Postgres"""
+    repaired = counters.reconcile()
+    if repaired:
+        logger.warning("Repaired %s drifted unread counters", repaired)
+    return repaired
+
+@shared_task
+def trim_inboxes():
+    """Delete the next slice of users' notifications past the inbox limits"""
+    from .retention import trim_inboxes as trim
+
+    users, deleted = trim()
+    logger.info("Trimmed %s notifications from %s inboxes", deleted, users)
+    return deleted
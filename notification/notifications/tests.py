@@ -1,3 +1,729 @@
-from django.test import TestCase
+import asyncio
+import contextlib
+import time
+import uuid
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from unittest import SkipTest, mock
+from zoneinfo import ZoneInfo
 
-# Create your tests here.
+import orjson
+import redis
+import redis.asyncio
+import socketio
+from django.conf import settings
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from core.authentication import SimpleUser
+from core.renderers import ORJSONRenderer
+from . import coalesce, counters, emitter, presence, reads, retention, streams
+from .models import Notification
+
+
+class FakeRedis:
+    """The three commands trim_inboxes() uses on its cursor key"""
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value):
+        self.data[key] = str(value).encode()
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+
+def make_inbox(user_id, count, start=None, step=timedelta(minutes=1), **fields):
+    """count rows for user_id, newest at start and one step older each"""
+    start = start or timezone.now()
+    rows = Notification.objects.bulk_create([
+        Notification(user_id=user_id, title=str(i), message='m', **fields)
+        for i in range(count)
+    ])
+    # created_at is auto_now_add, so set it afterwards
+    for i, row in enumerate(rows):
+        row.created_at = start - step * i
+        Notification.objects.filter(pk=row.pk).update(created_at=row.created_at)
+    return rows
+
+
+@override_settings(NOTIFICATION_INBOX_MAX=3, NOTIFICATION_READ_RETENTION_DAYS=30)
+class ExpiredTests(TestCase):
+    user_id = uuid.UUID(int=1)
+
+    def expired(self):
+        return set(
+            Notification.objects.filter(retention._expired(self.user_id))
+            .values_list('pk', flat=True)
+        )
+
+    def test_inbox_at_the_cap_keeps_everything(self):
+        make_inbox(self.user_id, 3)
+        self.assertEqual(self.expired(), set())
+
+    def test_rows_past_the_cap_expire_oldest_first(self):
+        rows = make_inbox(self.user_id, 5)
+        self.assertEqual(self.expired(), {rows[3].pk, rows[4].pk})
+
+    def test_cap_boundary_on_equal_created_at_goes_by_id(self):
+        rows = make_inbox(self.user_id, 5, step=timedelta(0))
+        newest_ids = sorted((row.pk for row in rows), reverse=True)
+        self.assertEqual(self.expired(), set(newest_ids[3:]))
+
+    def test_old_read_rows_expire_under_the_cap(self):
+        old = timezone.now() - timedelta(days=31)
+        read = make_inbox(self.user_id, 1, start=old, is_read=True)
+        make_inbox(self.user_id, 1, start=old)
+        self.assertEqual(self.expired(), {read[0].pk})
+
+    def test_other_users_are_untouched(self):
+        make_inbox(uuid.UUID(int=2), 5)
+        self.assertEqual(self.expired(), set())
+
+
+@override_settings(
+    NOTIFICATION_INBOX_MAX=2,
+    NOTIFICATION_TRIM_USERS_PER_RUN=2,
+    NOTIFICATION_TRIM_MAX_DELETES=4,
+    NOTIFICATION_TRIM_CHUNK_SIZE=3,
+)
+class TrimInboxesTests(TestCase):
+    users = [uuid.UUID(int=1), uuid.UUID(int=2), uuid.UUID(int=3)]
+
+    def setUp(self):
+        self.redis = FakeRedis()
+        patches = [
+            mock.patch.object(retention, '_client', return_value=self.redis),
+            mock.patch.object(retention.counters, 'adjust_many'),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def counts(self):
+        return [Notification.objects.filter(user_id=user_id).count() for user_id in self.users]
+
+    def cursor(self):
+        value = self.redis.get(retention.CURSOR_KEY)
+        return value and uuid.UUID(value.decode())
+
+    def test_user_over_budget_is_resumed_next_run(self):
+        make_inbox(self.users[0], 9)
+        make_inbox(self.users[1], 3)
+
+        self.assertEqual(retention.trim_inboxes(), (0, 4))
+        self.assertEqual(self.counts(), [5, 3, 0])
+        # Cursor stays before the unfinished user
+        self.assertEqual(self.cursor(), uuid.UUID(int=0))
+
+        # The budget runs out on the second user, so it's checked again
+        self.assertEqual(retention.trim_inboxes(), (1, 4))
+        self.assertEqual(self.counts(), [2, 2, 0])
+        self.assertEqual(self.cursor(), self.users[0])
+
+    def test_oldest_rows_are_deleted_and_unread_counters_adjusted(self):
+        rows = make_inbox(self.users[0], 4)
+        retention.trim_inboxes()
+        self.assertEqual(
+            set(Notification.objects.values_list('pk', flat=True)),
+            {rows[0].pk, rows[1].pk}
+        )
+        retention.counters.adjust_many.assert_called_once_with({self.users[0]: -2})
+
+    def test_cursor_wraps_around_after_the_last_user(self):
+        for user_id in self.users:
+            make_inbox(user_id, 2)
+
+        self.assertEqual(retention.trim_inboxes(), (2, 0))
+        self.assertEqual(self.cursor(), self.users[1])
+
+        # Fewer users left than a run takes: back to the start
+        self.assertEqual(retention.trim_inboxes(), (1, 0))
+        self.assertIsNone(self.cursor())
+
+        make_inbox(self.users[0], 1, start=timezone.now() - timedelta(days=1))
+        self.assertEqual(retention.trim_inboxes(), (2, 1))
+        self.assertEqual(self.counts(), [2, 2, 2])
+
+
+@override_settings(NOTIFICATION_PAGE_SIZE=4, NOTIFICATION_MAX_PAGE_SIZE=10)
+class InboxPaginationTests(TestCase):
+    user_id = uuid.UUID(int=1)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(SimpleUser(self.user_id))
+
+    def walk(self, url='/notifications/'):
+        ids = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            ids += [row['id'] for row in response.json()['results']]
+            url = response.json()['next']
+        return ids
+
+    def test_equal_created_at_pages_by_id_without_gaps_or_repeats(self):
+        start = timezone.now()
+        rows = make_inbox(self.user_id, 10, start=start, step=timedelta(0))
+        newer = make_inbox(self.user_id, 1, start=start + timedelta(seconds=1))
+        make_inbox(uuid.UUID(int=2), 3, start=start, step=timedelta(0))
+
+        expected = [str(newer[0].pk)] + sorted((str(row.pk) for row in rows), reverse=True)
+        self.assertEqual(self.walk(), expected)
+
+    def test_unread_filter_pages_through_unread_only(self):
+        make_inbox(self.user_id, 5, is_read=True)
+        unread = make_inbox(self.user_id, 6, start=timezone.now() - timedelta(hours=1))
+        self.assertEqual(
+            self.walk('/notifications/?unread=true'), [str(row.pk) for row in unread]
+        )
+
+    def test_invalid_cursor_is_not_found(self):
+        response = self.client.get('/notifications/?cursor=garbage')
+        self.assertEqual(response.status_code, 404)
+
+
+class ORJSONRendererTests(SimpleTestCase):
+
+    def test_renders_like_drf_json_renderer(self):
+        data = {
+            'id': uuid.UUID('6f1c2a4e-8d3b-4f7a-9c1e-2b5d8e0f3a71'),
+            'utc': datetime(2026, 1, 2, 3, 4, 5, 678901, tzinfo=ZoneInfo('UTC')),
+            'london': datetime(2026, 1, 2, 3, 4, 5, tzinfo=ZoneInfo('Europe/London')),
+            'berlin': datetime(2026, 7, 2, 3, 4, 5, 120000, tzinfo=ZoneInfo('Europe/Berlin')),
+            'naive': datetime(2026, 1, 2, 3, 4, 5),
+            'amount': Decimal('12.50'),
+            'rows': [{'price': Decimal('0.1'), 'day': date(2026, 1, 2)}],
+            'text': 'h\u00e9llo',
+        }
+        self.assertEqual(ORJSONRenderer().render(data), JSONRenderer().render(data))
+
+
+class MarkReadEventTests(TestCase):
+    user_id = uuid.UUID(int=1)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(SimpleUser(self.user_id))
+        self.emitter = mock.Mock()
+        patches = [
+            mock.patch.object(reads, 'get_emitter', return_value=self.emitter),
+            mock.patch.object(reads.counters, 'adjust_many'),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def events(self):
+        return [
+            (event, payload)
+            for (event, items), _ in self.emitter.send_to_users.call_args_list
+            for user_id, payload in items
+        ]
+
+    def test_single_read_keeps_the_id_shape(self):
+        rows = make_inbox(self.user_id, 1)
+        response = self.client.patch(f'/notifications/{rows[0].pk}/read')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.events(), [('notification_read', {'id': str(rows[0].pk)})])
+
+        # Already read: nothing to announce
+        self.client.patch(f'/notifications/{rows[0].pk}/read')
+        self.assertEqual(len(self.events()), 1)
+
+    def test_batches_use_their_own_event(self):
+        rows = make_inbox(self.user_id, 5)
+        self.client.post(
+            '/notifications/read', {'ids': [str(rows[0].pk), str(rows[1].pk)]}, format='json'
+        )
+        before = rows[3].created_at
+        self.client.post('/notifications/read', {'before': before.isoformat()}, format='json')
+        self.client.post('/notifications/read-all')
+
+        event, payload = self.events()[0]
+        self.assertEqual(event, 'notifications_read')
+        self.assertEqual(sorted(payload['ids']), sorted([str(rows[0].pk), str(rows[1].pk)]))
+        self.assertEqual(self.events()[1:], [
+            ('notifications_read', {'before': before.isoformat()}),
+            ('notifications_read', {'all': True}),
+        ])
+
+    def test_batch_of_one_changed_id_is_a_single_read(self):
+        rows = make_inbox(self.user_id, 2, is_read=True)
+        unread = make_inbox(self.user_id, 1)
+        self.client.post(
+            '/notifications/read',
+            {'ids': [str(row.pk) for row in rows + unread]},
+            format='json'
+        )
+        self.assertEqual(self.events(), [('notification_read', {'id': str(unread[0].pk)})])
+
+
+class RedisTestMixin:
+    """Runs against the Redis at REDIS_URL, skipped when it's unreachable"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.redis = redis.Redis.from_url(
+            settings.REDIS_URL, socket_timeout=1.0, socket_connect_timeout=1.0
+        )
+        try:
+            cls.redis.ping()
+        except redis.RedisError as e:
+            raise SkipTest(f"Redis at REDIS_URL is unreachable: {e}")
+        super().setUpClass()
+
+    def new_user(self):
+        """A user id whose Redis keys are removed after the test"""
+        user_id = str(uuid.uuid4())
+
+        def cleanup():
+            for key in self.redis.scan_iter(match=f'*{user_id}*'):
+                self.redis.delete(key)
+
+        self.addCleanup(cleanup)
+        return user_id
+
+    @contextlib.asynccontextmanager
+    async def async_redis(self, *modules):
+        """A redis.asyncio client on the test's own loop, patched into modules"""
+        client = redis.asyncio.Redis.from_url(
+            settings.REDIS_URL, socket_timeout=1.0, socket_connect_timeout=1.0
+        )
+        try:
+            with contextlib.ExitStack() as stack:
+                for module in modules:
+                    stack.enter_context(
+                        mock.patch.object(module, '_async_client', return_value=client)
+                    )
+                yield client
+        finally:
+            await client.aclose()
+
+    def set_online(self, *user_ids):
+        for user_id in user_ids:
+            self.redis.hset(presence.presence_key(user_id), 'worker', 1)
+
+
+class EmitterTests(RedisTestMixin, SimpleTestCase):
+
+    def setUp(self):
+        self.emitter = emitter.Emitter(settings.REDIS_URL)
+        # Off the real channel, so no running server picks these up
+        self.emitter.channel = f'test:{uuid.uuid4()}'
+        self.pubsub = self.redis.pubsub()
+        self.pubsub.subscribe(self.emitter.channel)
+        self.addCleanup(self.pubsub.close)
+        self.pubsub.get_message(timeout=1)  # subscribe confirmation
+
+    def published(self, expected):
+        messages = []
+        while len(messages) < expected:
+            message = self.pubsub.get_message(timeout=1)
+            if message is None:
+                break
+            messages.append(orjson.loads(message['data']))
+        self.assertIsNone(self.pubsub.get_message(timeout=0.1))
+        return messages
+
+    def test_messages_match_socketio_pubsub_emits(self):
+        manager = socketio.RedisManager(settings.REDIS_URL, write_only=True)
+        with mock.patch.object(manager, '_publish') as publish:
+            manager.emit('new_notification', {'id': 1}, namespace='/', room='user_1')
+        expected = {**publish.call_args.args[0], 'host_id': self.emitter.host_id}
+
+        self.emitter.send('new_notification', {'id': 1}, 'user_1')
+        self.assertEqual(self.published(1), [expected])
+
+    def test_send_many_publishes_one_emit_per_room(self):
+        self.emitter.send_many('unread_count', [('user_1', {'count': 1}), ('user_2', {'count': 5})])
+        self.assertEqual(
+            [(message['room'], message['data']) for message in self.published(2)],
+            [('user_1', {'count': 1}), ('user_2', {'count': 5})],
+        )
+
+    def test_offline_users_are_skipped(self):
+        online, offline = self.new_user(), self.new_user()
+        self.set_online(online)
+
+        skipped = self.emitter.send_to_users(
+            'unread_count', [(online, {'count': 1}), (offline, {'count': 2})]
+        )
+        self.assertEqual(skipped, [(offline, {'count': 2})])
+        self.assertEqual([message['room'] for message in self.published(1)], [f'user_{online}'])
+
+    @override_settings(NOTIFICATION_PRESENCE=False)
+    def test_everyone_is_online_without_presence(self):
+        user_id = self.new_user()
+        self.assertEqual(self.emitter.send_to_users('unread_count', [(user_id, {})]), [])
+        self.assertEqual(len(self.published(1)), 1)
+
+    def test_notify_many_streams_then_emits(self):
+        online, offline = self.new_user(), self.new_user()
+        self.set_online(online)
+        items = [(online, {'id': 1, 'title': 'a'}), (offline, {'id': 2, 'title': 'b'})]
+
+        with mock.patch.object(emitter.presence, 'handle_offline') as handle_offline:
+            self.emitter.notify_many(items)
+
+        message, = self.published(1)
+        self.assertEqual(message['event'], 'new_notification')
+        self.assertEqual(message['room'], f'user_{online}')
+        entry_id, fields = self.redis.xrange(streams.stream_key(online))[0]
+        self.assertEqual(message['data'], {'id': 1, 'title': 'a', 'stream_id': entry_id.decode()})
+        self.assertEqual(orjson.loads(fields[b'd']), {'id': 1, 'title': 'a'})
+
+        # Offline users' notifications are still in their stream
+        (user_id, data), = handle_offline.call_args.args[0]
+        self.assertEqual((user_id, data['id']), (offline, 2))
+        self.assertEqual(self.redis.xlen(streams.stream_key(offline)), 1)
+
+
+class DeliverTests(SimpleTestCase):
+
+    def test_deliver_queues_when_direct_emit_fails(self):
+        with mock.patch('notifications.tasks.send_notification_task.delay') as delay, \
+                mock.patch.object(emitter, 'get_emitter') as get_emitter:
+            emitter.deliver({'id': 1}, uuid.UUID(int=1))
+            get_emitter.assert_not_called()
+            delay.assert_called_once_with({'id': 1}, str(uuid.UUID(int=1)))
+
+            delay.reset_mock()
+            get_emitter.return_value.notify.side_effect = redis.ConnectionError('down')
+            with override_settings(NOTIFICATION_DIRECT_EMIT=True):
+                emitter.deliver({'id': 1}, uuid.UUID(int=1))
+            delay.assert_called_once_with({'id': 1}, str(uuid.UUID(int=1)))
+
+    def test_deliver_emits_directly(self):
+        with mock.patch('notifications.tasks.send_notification_task.delay') as delay, \
+                mock.patch.object(emitter, 'get_emitter') as get_emitter, \
+                override_settings(NOTIFICATION_DIRECT_EMIT=True):
+            emitter.deliver({'id': 1}, uuid.UUID(int=1))
+        get_emitter.return_value.notify.assert_called_once_with({'id': 1}, uuid.UUID(int=1))
+        delay.assert_not_called()
+
+
+@override_settings(NOTIFICATION_STREAM_MAXLEN=200, NOTIFICATION_STREAM_TTL_SECONDS=3600)
+class StreamTests(RedisTestMixin, SimpleTestCase):
+
+    def append(self, user_id, *notification_ids):
+        stamped = streams.append_many(
+            self.redis, [(user_id, {'id': i}) for i in notification_ids]
+        )
+        return [payload['stream_id'] for payload in stamped]
+
+    def test_appends_are_idempotent_per_notification(self):
+        user_id = self.new_user()
+        first = self.append(user_id, 1, 2)
+        # A retried task, or the queued fallback after a partial emit
+        again = self.append(user_id, 2, 1, 3)
+
+        self.assertEqual(again[:2], [first[1], first[0]])
+        self.assertEqual(self.redis.xlen(streams.stream_key(user_id)), 3)
+        for key in (streams.stream_key(user_id), streams.ids_key(user_id)):
+            self.assertTrue(0 < self.redis.ttl(key) <= 3600)
+
+    @override_settings(NOTIFICATION_STREAM_MAXLEN=2)
+    def test_ids_of_trimmed_entries_are_forgotten(self):
+        user_id = self.new_user()
+        first = self.append(user_id, 'a', 'b', 'c')
+        self.redis.xtrim(streams.stream_key(user_id), maxlen=1, approximate=False)
+        self.append(user_id, 'd', 'e')
+
+        remembered = {key.decode() for key in self.redis.hkeys(streams.ids_key(user_id))}
+        self.assertLessEqual({'d', 'e'}, remembered)
+        self.assertFalse({'a', 'b'} & remembered)
+        # So they would be appended again
+        self.assertNotEqual(self.append(user_id, 'a'), first[:1])
+
+    async def test_read_since_replays_the_gap(self):
+        user_id = self.new_user()
+        stream_ids = self.append(user_id, 1, 2, 3)
+
+        async with self.async_redis(streams):
+            payloads, complete = await streams.read_since(user_id, stream_ids[0])
+            self.assertEqual(payloads, [
+                {'id': 2, 'stream_id': stream_ids[1]},
+                {'id': 3, 'stream_id': stream_ids[2]},
+            ])
+            self.assertTrue(complete)
+            self.assertEqual(await streams.read_since(user_id, stream_ids[2]), ([], True))
+
+    async def test_read_since_reports_trimmed_gaps(self):
+        user_id = self.new_user()
+        stream_ids = self.append(user_id, 1, 2, 3)
+        self.redis.xtrim(streams.stream_key(user_id), maxlen=1, approximate=False)
+
+        async with self.async_redis(streams):
+            payloads, complete = await streams.read_since(user_id, stream_ids[0])
+        self.assertEqual([payload['id'] for payload in payloads], [3])
+        self.assertFalse(complete)
+
+    async def test_read_since_an_expired_stream(self):
+        user_id = self.new_user()
+        now_ms = int(time.time() * 1000)
+        async with self.async_redis(streams):
+            self.assertEqual(await streams.read_since(user_id, f'{now_ms - 1000}-0'), ([], True))
+            expired = now_ms - 3601 * 1000
+            self.assertEqual(await streams.read_since(user_id, f'{expired}-0'), ([], False))
+            with self.assertRaises(ValueError):
+                await streams.read_since(user_id, 'not-an-id')
+
+
+@override_settings(NOTIFICATION_UNREAD_TTL_SECONDS=3600)
+class UnreadCounterTests(RedisTestMixin, TestCase):
+
+    def setUp(self):
+        client = mock.patch.object(counters, '_client', return_value=self.redis)
+        client.start()
+        self.addCleanup(client.stop)
+        push = mock.patch.object(counters, '_push')
+        self.push = push.start()
+        self.addCleanup(push.stop)
+
+    def cached(self, user_id):
+        value = self.redis.get(counters.unread_key(user_id))
+        return None if value is None else int(value)
+
+    def test_get_initialises_the_counter_from_postgres(self):
+        user_id = self.new_user()
+        make_inbox(user_id, 3)
+        make_inbox(user_id, 2, is_read=True)
+
+        self.assertEqual(counters.get(user_id), 3)
+        self.assertEqual(self.cached(user_id), 3)
+        self.assertTrue(0 < self.redis.ttl(counters.unread_key(user_id)) <= 3600)
+        make_inbox(user_id, 1)
+        with self.assertNumQueries(0):
+            self.assertEqual(counters.get(user_id), 3)
+
+    def test_adjust_only_touches_existing_counters(self):
+        cached, uncached = self.new_user(), self.new_user()
+        self.redis.set(counters.unread_key(cached), 2)
+
+        counters.adjust_many({cached: 1, uncached: 1})
+        self.assertEqual((self.cached(cached), self.cached(uncached)), (3, None))
+        self.push.assert_called_once_with({cached: 3})
+
+        # Never below zero
+        counters.adjust_many({cached: -5})
+        self.assertEqual(self.cached(cached), 0)
+
+    def test_reconcile_repairs_drifted_counters(self):
+        drifted, accurate, racing = self.new_user(), self.new_user(), self.new_user()
+        for user_id in (drifted, accurate, racing):
+            make_inbox(user_id, 2)
+            self.redis.set(counters.unread_key(user_id), 2)
+        self.redis.set(counters.unread_key(drifted), 7)
+        self.redis.set(counters.unread_key(racing), 9)
+
+        def mget(keys):
+            values = redis.Redis.mget(self.redis, keys)
+            # A notification for racing lands between the read and the fix
+            if counters.unread_key(racing).encode() in keys:
+                self.redis.incr(counters.unread_key(racing))
+            return values
+
+        with mock.patch.object(self.redis, 'mget', side_effect=mget):
+            self.assertGreaterEqual(counters.reconcile(batch_size=2), 1)
+
+        self.assertEqual(self.cached(drifted), 2)
+        self.assertEqual(self.cached(accurate), 2)
+        # Skipped: it changed after it was read, the next run fixes it
+        self.assertEqual(self.cached(racing), 10)
+        pushed = {user_id: count for (counts,), _ in self.push.call_args_list for user_id, count in counts.items()}
+        self.assertEqual(pushed.get(drifted), 2)
+        self.assertNotIn(accurate, pushed)
+        self.assertNotIn(racing, pushed)
+
+    async def test_async_adjust(self):
+        cached, uncached = self.new_user(), self.new_user()
+        self.redis.set(counters.unread_key(cached), 1)
+        async with self.async_redis(counters):
+            self.assertEqual(await counters.aadjust(cached, -1), 0)
+            self.assertIsNone(await counters.aadjust(uncached, 1))
+        self.assertIsNone(self.cached(uncached))
+
+
+@override_settings(NOTIFICATION_PRESENCE_HEARTBEAT_SECONDS=10)
+class PresenceTests(RedisTestMixin, SimpleTestCase):
+
+    def counts(self, user_id):
+        return {
+            node.decode(): int(count)
+            for node, count in self.redis.hgetall(presence.presence_key(user_id)).items()
+        }
+
+    async def test_connect_and_disconnect_count_per_worker(self):
+        user_id = self.new_user()
+        async with self.async_redis(presence):
+            await presence.connected('a', user_id)
+            await presence.connected('a', user_id)
+            await presence.connected('b', user_id)
+            self.assertEqual(self.counts(user_id), {'a': 2, 'b': 1})
+            self.assertTrue(0 < self.redis.ttl(presence.presence_key(user_id)) <= 30)
+
+            await presence.disconnected('a', user_id)
+            await presence.disconnected('a', user_id)
+            self.assertEqual(self.counts(user_id), {'b': 1})
+            await presence.disconnected('b', user_id)
+        self.assertFalse(self.redis.exists(presence.presence_key(user_id)))
+
+    def test_online(self):
+        up, down = self.new_user(), self.new_user()
+        self.set_online(up)
+        self.assertEqual(presence.online(self.redis, [up, uuid.UUID(down)]), {up})
+
+    def test_everyone_is_online_when_presence_is_unknown(self):
+        user_ids = [self.new_user(), self.new_user()]
+        with self.settings(NOTIFICATION_PRESENCE=False):
+            self.assertEqual(presence.online(self.redis, user_ids), set(user_ids))
+
+        client = mock.Mock()
+        client.pipeline.return_value.execute.side_effect = redis.ConnectionError
+        with self.assertLogs('notifications.presence', 'WARNING'):
+            self.assertEqual(presence.online(client, user_ids), set(user_ids))
+
+    async def test_heartbeat_refreshes_without_overwriting_counts(self):
+        live, expired = self.new_user(), self.new_user()
+        key = presence.presence_key(live)
+        self.redis.hset(key, mapping={'worker': 5, 'other': 1})
+        self.redis.expire(key, 2)
+        connections = {'sid1': live, 'sid2': live, 'sid3': expired}
+
+        # One beat, then stop at the next sleep
+        sleep = mock.AsyncMock(side_effect=[None, asyncio.CancelledError])
+        async with self.async_redis(presence):
+            with mock.patch.object(presence.asyncio, 'sleep', sleep):
+                with self.assertRaises(asyncio.CancelledError):
+                    await presence.heartbeat('worker', connections, batch_size=1)
+
+        sleep.assert_called_with(10)
+        self.assertEqual(self.counts(live), {'worker': 5, 'other': 1})
+        self.assertGreater(self.redis.ttl(key), 2)
+        self.assertEqual(self.counts(expired), {'worker': 1})
+        self.assertTrue(0 < self.redis.ttl(presence.presence_key(expired)) <= 30)
+
+    def test_offline_handler_errors_are_logged(self):
+        items = [('u', {'title': 't'})]
+        handler = mock.Mock(side_effect=RuntimeError)
+        with self.settings(NOTIFICATION_OFFLINE_HANDLER='push.send'), \
+                mock.patch.object(presence, 'import_string', return_value=handler) as load:
+            with self.assertLogs('notifications.presence', 'ERROR'):
+                presence.handle_offline(items)
+            presence.handle_offline([])
+        load.assert_called_once_with('push.send')
+        handler.assert_called_once_with(items)
+
+
+@override_settings(
+    NOTIFICATION_COALESCE_WINDOW_MS=50,
+    NOTIFICATION_COALESCE_MAX_DELAY_MS=150,
+    NOTIFICATION_COALESCE_STATS_SECONDS=10,
+)
+class CoalescingManagerTests(RedisTestMixin, SimpleTestCase):
+
+    @contextlib.asynccontextmanager
+    async def manager(self):
+        """A manager for user_a's one local socket, recording what it sends"""
+        mgr = coalesce.CoalescingRedisManager(settings.REDIS_URL)
+        mgr.rooms = {'/': {'user_a': {'sid': 'eio'}, 'user_empty': {}}}
+        mgr._send = mock.AsyncMock(side_effect=lambda *args: mgr.stats.update(['emits']))
+        try:
+            yield mgr
+        finally:
+            for window in mgr.windows.values():
+                window.timer.cancel()
+            for task in list(mgr.flushes):
+                task.cancel()
+            await mgr.redis.aclose()
+
+    def emit(self, mgr, data, event='new_notification', room='user_a', callback=None):
+        return mgr._handle_emit({
+            'method': 'emit', 'event': event, 'data': data, 'namespace': '/',
+            'room': room, 'skip_sid': None, 'callback': callback, 'host_id': 'other',
+        })
+
+    async def test_first_goes_out_at_once_and_a_burst_is_batched(self):
+        async with self.manager() as mgr:
+            for i in range(3):
+                await self.emit(mgr, {'id': i})
+            mgr._send.assert_awaited_once_with('new_notification', {'id': 0}, 'user_a')
+
+            await asyncio.sleep(0.1)
+            mgr._send.assert_awaited_with('new_notifications', [{'id': 1}, {'id': 2}], 'user_a')
+            self.assertEqual(mgr.stats, {'notifications': 3, 'emits': 2})
+
+            # A quiet window closes it, so the next one is immediate again
+            await asyncio.sleep(0.1)
+            self.assertEqual(mgr.windows, {})
+            await self.emit(mgr, {'id': 3})
+            mgr._send.assert_awaited_with('new_notification', {'id': 3}, 'user_a')
+
+    async def test_a_lone_held_notification_keeps_its_event(self):
+        async with self.manager() as mgr:
+            await self.emit(mgr, {'id': 0})
+            await self.emit(mgr, {'id': 1})
+            await asyncio.sleep(0.1)
+            mgr._send.assert_awaited_with('new_notification', {'id': 1}, 'user_a')
+            self.assertEqual(mgr._send.await_count, 2)
+
+    async def test_a_steady_stream_is_flushed_by_max_delay(self):
+        async with self.manager() as mgr:
+            started = time.monotonic()
+            # One every 30 ms never leaves the 50 ms window quiet
+            while time.monotonic() - started < 0.4:
+                await self.emit(mgr, {})
+                await asyncio.sleep(0.03)
+            batches = [call.args[1] for call in mgr._send.await_args_list[1:]]
+            self.assertGreaterEqual(len(batches), 2)
+            self.assertTrue(all(len(batch) > 1 for batch in batches))
+
+    async def test_rooms_without_local_members_are_dropped(self):
+        async with self.manager() as mgr:
+            await self.emit(mgr, {}, room='user_empty')
+            await self.emit(mgr, {}, room='user_elsewhere')
+            mgr._send.assert_not_awaited()
+            self.assertEqual(mgr.windows, {})
+
+    async def test_other_emits_are_not_coalesced(self):
+        async with self.manager() as mgr:
+            messages = [
+                {'event': 'notification_read'},
+                {'room': 'broadcast'},
+                {'room': None},
+                {'callback': ('sid', '/', 1)},
+            ]
+            with mock.patch.object(socketio.AsyncRedisManager, '_handle_emit') as handle:
+                for message in messages:
+                    await self.emit(mgr, {}, **message)
+                with self.settings(NOTIFICATION_COALESCE_WINDOW_MS=0):
+                    async with self.manager() as off:
+                        await self.emit(off, {})
+            self.assertEqual(handle.await_count, len(messages) + 1)
+            mgr._send.assert_not_awaited()
+
+    async def test_stats_are_added_to_redis(self):
+        async with self.manager() as mgr:
+            before = self.redis.hgetall(coalesce.STATS_KEY)
+            mgr.stats.update(notifications=5, emits=2)
+
+            sleep = mock.AsyncMock(side_effect=[None, None, asyncio.CancelledError])
+            with mock.patch.object(coalesce.asyncio, 'sleep', sleep):
+                with self.assertRaises(asyncio.CancelledError):
+                    await mgr._report_stats()
+
+            after = self.redis.hgetall(coalesce.STATS_KEY)
+            added = {
+                field: int(after[field.encode()]) - int(before.get(field.encode(), 0))
+                for field in ('notifications', 'emits', 'saved')
+            }
+            self.assertEqual(added, {'notifications': 5, 'emits': 2, 'saved': 3})
+            self.assertEqual(mgr.stats, {})
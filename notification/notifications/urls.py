@@ -1,7 +1,19 @@
 from django.urls import path
-from .views import NotificationListCreateView
+from .views import (
+    NotificationBulkCreateView,
+    NotificationListCreateView,
+    NotificationMarkAllReadView,
+    NotificationMarkReadBatchView,
+    NotificationMarkReadView,
+    NotificationUnreadCountView,
+)
 
 urlpatterns = [
     path("", NotificationListCreateView.as_view(), name="notification-list-create"),
+    path("<uuid:pk>/read", NotificationMarkReadView.as_view(), name="notification-mark-read"),
+    path("read", NotificationMarkReadBatchView.as_view(), name="notification-mark-read-batch"),
+    path("read-all", NotificationMarkAllReadView.as_view(), name="notification-mark-all-read"),
+    path("unread-count", NotificationUnreadCountView.as_view(), name="notification-unread-count"),
+    path("bulk", NotificationBulkCreateView.as_view(), name="notification-bulk-create"),
 ]
 
@@ -1,20 +1,45 @@
+from django.conf import settings
 from rest_framework import generics, status
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
+from core.authentication import InternalAPIKeyAuthentication
+from core.serializers import values_fields
+from . import counters, reads
+from .emitter import deliver
+from .fanout import chunked
 from .models import Notification
-from .serializers import NotificationSerializer
-from .tasks import send_notification_task
+from .pagination import NotificationCursorPagination
+from .serializers import (
+    BulkNotificationSerializer,
+    MarkReadSerializer,
+    NotificationSerializer,
+)
+from .tasks import broadcast_notification_task, bulk_notification_task
 import logging
+import uuid
 
 logger = logging.getLogger(__name__)
 
 class NotificationListCreateView(generics.ListCreateAPIView):
     serializer_class = NotificationSerializer
     permission_classes = [IsAuthenticated]  # 👈 Add authentication
+    pagination_class = NotificationCursorPagination
     
     def get_queryset(self):
         # Only return notifications for the authenticated user
-        return Notification.objects.filter(user_id=self.request.user.id)
+        queryset = Notification.objects.filter(user_id=self.request.user.id)
+        if self.request.query_params.get('unread') == 'true':
+            # Served by the partial unread index
+            queryset = queryset.filter(is_read=False)
+        return queryset
+    
+    def list(self, request, *args, **kwargs):
+        # Build rows from .values() instead of per-object serializer fields
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(
+            queryset.values(*values_fields(NotificationSerializer))
+        )
+        return self.get_paginated_response(page)
     
     def perform_create(self, serializer):
         # Ensure user can only create notifications for themselves
@@ -22,12 +47,17 @@ class NotificationListCreateView(generics.ListCreateAPIView):
         data = NotificationSerializer(notification).data
         
         # Send real-time notification
-        send_notification_task.delay(data, str(notification.user_id))
+        deliver(data, notification.user_id)
+        counters.adjust_many({notification.user_id: 1})
         
-        logger.info(f"Notification created for user {notification.user_id}: {notification.title}")
+        logger.info(
+            "Notification created for user %s: %s",
+            notification.user_id, notification.title,
+            extra={"sampled": True}
+        )
 
-class NotificationMarkReadView(generics.UpdateAPIView):
-    """Mark a notification as read"""
+class NotificationMarkReadView(generics.GenericAPIView):
+    """Mark a notification as read (PATCH only, nothing else is writable)"""
     serializer_class = NotificationSerializer
     permission_classes = [IsAuthenticated]
     
@@ -36,25 +66,103 @@ class NotificationMarkReadView(generics.UpdateAPIView):
     
     def patch(self, request, *args, **kwargs):
         notification = self.get_object()
+        # Empty if it was already read, so it's only counted once
+        changed = reads.mark_read(request.user.id, [notification.pk])
+        reads.announce(request.user.id, len(changed), ids=changed)
         notification.is_read = True
-        notification.save()
         
         return Response(
             NotificationSerializer(notification).data,
             status=status.HTTP_200_OK
         )
 
+class NotificationMarkReadBatchView(generics.GenericAPIView):
+    """
+    Mark several notifications as read in one UPDATE
+    
+    POST /notifications/read  {"ids": [...]}
+    POST /notifications/read  {"before": "<timestamp>"}
+    
+    Ids that aren't the user's are ignored. Returns how many were unread
+    until now, and for the ids form which ones.
+    """
+    serializer_class = MarkReadSerializer
+    permission_classes = [IsAuthenticated]
+    
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = serializer.validated_data.get('ids')
+        if ids is None:
+            before = serializer.validated_data['before']
+            count = reads.mark_all_read(request.user.id, before=before)
+            reads.announce(request.user.id, count, before=before)
+            return Response({"count": count}, status=status.HTTP_200_OK)
+        
+        changed = reads.mark_read(request.user.id, ids)
+        reads.announce(request.user.id, len(changed), ids=changed)
+        
+        return Response(
+            {"count": len(changed), "ids": [str(pk) for pk in changed]},
+            status=status.HTTP_200_OK
+        )
+
 class NotificationMarkAllReadView(generics.GenericAPIView):
     """Mark all notifications as read for the authenticated user"""
     permission_classes = [IsAuthenticated]
     
     def post(self, request, *args, **kwargs):
-        count = Notification.objects.filter(
-            user_id=request.user.id,
-            is_read=False
-        ).update(is_read=True)
+        count = reads.mark_all_read(request.user.id)
+        reads.announce(request.user.id, count)
         
         return Response(
             {"message": f"{count} notifications marked as read"},
             status=status.HTTP_200_OK
         )
+
+class NotificationUnreadCountView(generics.GenericAPIView):
+    """The authenticated user's unread count, served from Redis"""
+    permission_classes = [IsAuthenticated]
+    
+    def get(self, request, *args, **kwargs):
+        return Response({"count": counters.get(request.user.id)})
+
+class NotificationBulkCreateView(generics.GenericAPIView):
+    """
+    Notify many users at once (service-to-service, X-API-Key)
+    
+    POST /notifications/bulk  {"title", "message", "user_ids": [...]}
+    POST /notifications/bulk  {"title", "message", "broadcast": true}
+    
+    Rows are written and emitted by Celery tasks, one per
+    BULK_NOTIFICATION_CHUNK_SIZE users. A broadcast reaches every user
+    this service has notified before.
+    """
+    serializer_class = BulkNotificationSerializer
+    authentication_classes = [InternalAPIKeyAuthentication]
+    permission_classes = [IsAuthenticated]
+    
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        batch_id = str(uuid.uuid4())
+        
+        if data['broadcast']:
+            broadcast_notification_task.delay(batch_id, data['title'], data['message'])
+            recipients = None
+        else:
+            user_ids = list(dict.fromkeys(str(user_id) for user_id in data['user_ids']))
+            for chunk in chunked(user_ids, settings.BULK_NOTIFICATION_CHUNK_SIZE):
+                bulk_notification_task.delay(batch_id, data['title'], data['message'], chunk)
+            recipients = len(user_ids)
+        
+        logger.info(
+            "Bulk notification %s queued by %s for %s users",
+            batch_id, request.user.service,
+            "all" if recipients is None else recipients
+        )
+        return Response(
+            {"batch_id": batch_id, "recipients": recipients},
+            status=status.HTTP_202_ACCEPTED
+        )